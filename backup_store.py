@@ -0,0 +1,180 @@
+import os
+import json
+import shutil
+import hashlib
+
+# should be increased whenever the format of snapshots changes
+backup_store_version = 1
+
+snapshot_extension = ".json"
+
+# the files the SyntaxUpdater adds to mods (see SyntaxUpdater.update_body_detail_plan()), which restoring a snapshot
+# removes, as they weren't there when it was made
+syntax_updater_file_prefix = "objects/o_template_bdp_"
+
+
+class BackupStore:
+    # The backups of mods the SyntaxUpdater makes before changing them, in backup_path.
+    # Each file is stored only once, in /objects, named by the hash of its contents; no matter how many mods or
+    # backups it is part of. A backup of a mod (a "snapshot") is then just the list of its files and their hashes,
+    # in /snapshots.
+    # Files are stored by hardlinking them where possible, so backing up a mod copies nothing. The SyntaxUpdater
+    # replaces the files it changes instead of writing into them (see raw_handler.write_raw_file()), which leaves the
+    # stored files as they were. Editing a backed up file in place (as some text editors do) changes the stored file
+    # too though, so restore_snapshot() checks the hash of each stored file it restores.
+
+    def __init__(self, backup_path):
+        self.backup_path = backup_path
+        self.objects_path = backup_path + "/objects"
+        self.snapshots_path = backup_path + "/snapshots"
+        self.file_hashes_path = backup_path + "/file_hashes.json"
+        os.makedirs(self.objects_path, exist_ok=True)
+        os.makedirs(self.snapshots_path, exist_ok=True)
+        # absolute file path => [size, modification time, hash], so files that haven't changed aren't hashed again
+        self.file_hashes = {}
+        if os.path.isfile(self.file_hashes_path):
+            try:
+                with open(self.file_hashes_path, "r", encoding="utf-8") as file_hashes_file:
+                    self.file_hashes = json.load(file_hashes_file)
+            except (OSError, ValueError):
+                print("Could not read " + self.file_hashes_path + ", hashing all files again.")
+
+    def has_snapshot(self, snapshot_name):
+        return os.path.isfile(self.snapshot_path(snapshot_name))
+
+    def get_snapshot_names(self):
+        return sorted(file_name[:-len(snapshot_extension)] for file_name in os.listdir(self.snapshots_path)
+                      if file_name.endswith(snapshot_extension))
+
+    def store_snapshot(self, mod):
+        # Backs up the whole folder of a mod, replacing its previous snapshot (if any), and returns the snapshot name.
+        # The hashes of its files are only saved by save_file_hashes(), which should be called after the last one.
+        snapshot_name = mod.name + " " + mod.version
+        snapshot = {"backup_store_version": backup_store_version,
+                    "name": mod.name,
+                    "version": mod.version,
+                    "mod_path": os.path.abspath(mod.path),
+                    "folders": [],
+                    "files": {}}
+        for folder_path, folder_names, file_names in os.walk(mod.path):
+            folder_names.sort()
+            relative_folder_path = os.path.relpath(folder_path, mod.path).replace("\\", "/")
+            if relative_folder_path != ".":
+                snapshot["folders"].append(relative_folder_path)
+            for file_name in sorted(file_names):
+                relative_path = file_name if relative_folder_path == "." else relative_folder_path + "/" + file_name
+                snapshot["files"][relative_path] = self.store_file(folder_path + "/" + file_name)
+
+        write_json(self.snapshot_path(snapshot_name), snapshot)
+        return snapshot_name
+
+    def restore_snapshot(self, snapshot_name, mod_path=None, remove_added_files=False):
+        # Makes the mod folder (by default where the mod was when it was backed up) the way it was in the snapshot.
+        # Only files that differ from the snapshot are touched. Of the files that weren't in it, those added by the
+        # SyntaxUpdater are removed; any others (e.g. raws added since) are only removed if remove_added_files is
+        # True. Each removed or kept file is printed.
+        # Returns whether all files could be restored. Like for store_snapshot(), save_file_hashes() should be called
+        # after the last one.
+        with open(self.snapshot_path(snapshot_name), "r", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot.get("backup_store_version") != backup_store_version:
+            print("The backup " + snapshot_name + " was made by another version of the modloader, "
+                  "and can't be restored.")
+            return False
+        if mod_path is None:
+            mod_path = snapshot["mod_path"]
+
+        is_complete = True
+        os.makedirs(mod_path, exist_ok=True)
+        for relative_folder_path in snapshot["folders"]:
+            os.makedirs(mod_path + "/" + relative_folder_path, exist_ok=True)
+        for relative_path, content_hash in snapshot["files"].items():
+            file_path = mod_path + "/" + relative_path
+            if os.path.isfile(file_path) and self.get_file_hash(file_path) == content_hash:
+                continue
+            object_path = self.object_path(content_hash)
+            if not os.path.isfile(object_path) or self.get_file_hash(object_path) != content_hash:
+                print("The backed up " + relative_path + " of " + snapshot_name + " is missing, or has been "
+                      "changed since it was backed up, and can't be restored.")
+                is_complete = False
+                continue
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            link_or_copy_file(object_path, file_path)
+
+        # looks for the files that weren't there when the snapshot was made
+        for folder_path, _, file_names in os.walk(mod_path):
+            relative_folder_path = os.path.relpath(folder_path, mod_path).replace("\\", "/")
+            for file_name in file_names:
+                relative_path = file_name if relative_folder_path == "." else relative_folder_path + "/" + file_name
+                if relative_path in snapshot["files"]:
+                    continue
+                if relative_path.startswith(syntax_updater_file_prefix) or remove_added_files:
+                    print("Removing " + relative_path + " from " + snapshot_name + ", as it wasn't in the backup.")
+                    os.remove(folder_path + "/" + file_name)
+                else:
+                    print("Keeping " + relative_path + " in " + snapshot_name + ", which wasn't in the backup.")
+        return is_complete
+
+    def remove_unused_objects(self):
+        # removes the stored files that no snapshot refers to any longer, e.g. after snapshots have been replaced
+        used_hashes = set()
+        for snapshot_name in self.get_snapshot_names():
+            with open(self.snapshot_path(snapshot_name), "r", encoding="utf-8") as snapshot_file:
+                used_hashes.update(json.load(snapshot_file)["files"].values())
+        for folder in os.scandir(self.objects_path):
+            for entry in os.scandir(folder.path):
+                if entry.name not in used_hashes:
+                    os.remove(entry.path)
+                    self.file_hashes.pop(os.path.abspath(entry.path), None)
+        self.save_file_hashes()
+
+    def store_file(self, file_path):
+        # stores a file (unless a file with the same contents is already stored), and returns its hash
+        content_hash = self.get_file_hash(file_path)
+        object_path = self.object_path(content_hash)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            link_or_copy_file(file_path, object_path)
+        return content_hash
+
+    def get_file_hash(self, file_path):
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry = self.file_hashes.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        content_hash = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                content_hash.update(chunk)
+        self.file_hashes[key] = [stat.st_size, stat.st_mtime_ns, content_hash.hexdigest()]
+        return content_hash.hexdigest()
+
+    def save_file_hashes(self):
+        # forgets the files that no longer exist
+        self.file_hashes = {path: entry for path, entry in self.file_hashes.items() if os.path.isfile(path)}
+        write_json(self.file_hashes_path, self.file_hashes)
+
+    def object_path(self, content_hash):
+        return self.objects_path + "/" + content_hash[:2] + "/" + content_hash
+
+    def snapshot_path(self, snapshot_name):
+        return self.snapshots_path + "/" + snapshot_name + snapshot_extension
+
+
+def link_or_copy_file(source_path, target_path):
+    # hardlinks the file if possible (i.e. if both paths are on the same drive, and it supports hardlinks)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        temp_path = target_path + ".tmp"
+        shutil.copy2(source_path, temp_path)
+        os.replace(temp_path, target_path)
+
+
+def write_json(path, value):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as json_file:
+        json.dump(value, json_file, indent=1)
+    os.replace(temp_path, path)
@@ -0,0 +1,3 @@
+# Benchmarks for the Compiler and SyntaxUpdater, run them from the repository root, e.g.
+#   python -m benchmarks.compile_speed --scale 1 --save my_baseline
+#   python -m benchmarks.memory
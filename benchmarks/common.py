@@ -0,0 +1,26 @@
+import os
+import io
+import shutil
+import contextlib
+from raw_handler import SyntaxUpdater
+from mods_folder import load_mod
+
+default_mods_path = os.getcwd() + "/mods"
+
+
+def find_example_mods(mods_path):
+    # vanilla first, then the example mods in order
+    example_mods_path = mods_path + "/example mods"
+    return [load_mod(mods_path + "/vanilla_0.47.05")] + \
+           [load_mod(example_mods_path + "/" + folder_name) for folder_name in sorted(os.listdir(example_mods_path))
+            if os.path.isfile(example_mods_path + "/" + folder_name + "/mod_info.txt")]
+
+
+def prepare_example_mods(work_path, mods_path=default_mods_path):
+    # The vanilla raws in the mods folder have to have their syntax updated before they can be compiled.
+    # This copies the mods into work_path, updates them there, and returns the updated mods.
+    shutil.copytree(mods_path, work_path + "/mods")
+    mods = find_example_mods(work_path + "/mods")
+    with contextlib.redirect_stdout(io.StringIO()):
+        SyntaxUpdater().update_mods_syntax(mods, work_path + "/backup")
+    return find_example_mods(work_path + "/mods")
@@ -0,0 +1,158 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+from raw_handler import Compiler
+from raw_handler import SyntaxUpdater
+from compile_metrics import CompileMetrics
+from benchmarks.common import load_mod
+from benchmarks.synthetic import generate_synthetic_mods
+
+# Times each phase of updating the syntax of and compiling synthetic mods (see benchmarks/synthetic.py),
+# stores the results as JSON baselines, and flags regressions against a chosen baseline.
+#   python -m benchmarks.compile_speed --scale 1 --save my_baseline
+#   python -m benchmarks.compile_speed --scale 1 --compare my_baseline
+#   python -m benchmarks.compile_speed --scale 1 --profile 10
+# Baselines are machine-specific, so only compare against ones made on the same machine.
+
+baselines_path = os.path.dirname(os.path.abspath(__file__)) + "/baselines"
+
+phases = ["syntax_update", "read", "apply_special_tokens", "write"]
+
+
+def run_benchmark(scale, repeats, seed, profile_top_n=None):
+    # returns the lowest time of each phase over the repeats.
+    # With profile_top_n, one more instrumented compile is run afterwards, and its CompileMetrics report printed.
+    phase_times = {phase: [] for phase in phases}
+    with tempfile.TemporaryDirectory() as work_path:
+        print("generating synthetic mods at scale " + str(scale) + "...")
+        generated_mod_paths = generate_synthetic_mods(work_path + "/generated", scale, seed)
+
+        for i in range(repeats):
+            # the syntax is updated in place, so each repeat starts from a fresh copy
+            run_path = work_path + "/run_" + str(i)
+            shutil.copytree(work_path + "/generated", run_path + "/mods")
+            mod_paths = [run_path + "/mods/" + os.path.basename(mod_path) for mod_path in generated_mod_paths]
+            os.makedirs(run_path + "/output")
+
+            # all the print()s of the SyntaxUpdater and Compiler are thrown away, as printing takes time too
+            with contextlib.redirect_stdout(io.StringIO()):
+                mods = [load_mod(mod_path) for mod_path in mod_paths]
+                start_time = time.perf_counter()
+                SyntaxUpdater().update_mods_syntax(mods, run_path + "/backup")
+                phase_times["syntax_update"].append(time.perf_counter() - start_time)
+
+                # reloaded, as the SyntaxUpdater renames files
+                mods = [load_mod(mod_path) for mod_path in mod_paths]
+                compiler = Compiler()
+                start_time = time.perf_counter()
+                compiler.read_mods(mods)
+                phase_times["read"].append(time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                compiler.apply_special_tokens_to_create_compiled_objects()
+                phase_times["apply_special_tokens"].append(time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                compiler.write_compiled_objects(run_path + "/output")
+                phase_times["write"].append(time.perf_counter() - start_time)
+
+            print("run " + str(i + 1) + "/" + str(repeats) + ": " +
+                  ", ".join(phase + " " + format_seconds(phase_times[phase][-1]) for phase in phases))
+            shutil.rmtree(run_path)
+
+        if profile_top_n is not None:
+            print_profile(work_path, generated_mod_paths, profile_top_n)
+
+    return {"scale": scale,
+            "seed": seed,
+            "repeats": repeats,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "phases": {phase: min(phase_times[phase]) for phase in phases}}
+
+
+def print_profile(work_path, generated_mod_paths, top_n):
+    # the timed runs aren't instrumented, so that the metrics don't affect their times
+    run_path = work_path + "/run_profile"
+    shutil.copytree(work_path + "/generated", run_path + "/mods")
+    mod_paths = [run_path + "/mods/" + os.path.basename(mod_path) for mod_path in generated_mod_paths]
+    os.makedirs(run_path + "/output")
+    metrics = CompileMetrics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        SyntaxUpdater().update_mods_syntax([load_mod(mod_path) for mod_path in mod_paths], run_path + "/backup")
+        Compiler(metrics=metrics).compile_mods([load_mod(mod_path) for mod_path in mod_paths], run_path + "/output")
+    print("profile:")
+    print(metrics.get_report(top_n))
+    shutil.rmtree(run_path)
+
+
+def compare_to_baseline(result, baseline, threshold):
+    # prints a comparison of each phase, and returns the names of the phases that are slower than the baseline
+    # by more than the threshold (a fraction, e.g. 0.1 for 10%)
+    if (baseline["scale"], baseline["seed"]) != (result["scale"], result["seed"]):
+        print("Warning: the baseline was made with scale " + str(baseline["scale"]) + " and seed " +
+              str(baseline["seed"]) + ", the comparison is not meaningful.")
+    regressed_phases = []
+    for phase in phases:
+        if phase not in baseline["phases"]:
+            continue
+        ratio = result["phases"][phase] / baseline["phases"][phase]
+        line = "\t" + phase.ljust(22) + format_seconds(baseline["phases"][phase]).rjust(10) + " -> " + \
+               format_seconds(result["phases"][phase]).rjust(10) + "  (" + format(ratio, ".2f") + "x)"
+        if ratio > 1 + threshold:
+            line += "  REGRESSION"
+            regressed_phases.append(phase)
+        print(line)
+    return regressed_phases
+
+
+def format_seconds(seconds):
+    return format(seconds, ".3f") + " s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times updating the syntax of and compiling synthetic mods.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="size of the synthetic mods, 1 is about the size of vanilla (default 1)")
+    parser.add_argument("--repeats", type=int, default=3, help="how many times to run, the fastest run counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="NAME", help="save the results as a baseline with this name")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results to the baseline with this name")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="how much slower than the baseline a phase may be before it counts as a regression "
+                             "(default 0.1, i.e. 10%%)")
+    parser.add_argument("--profile", type=int, metavar="N",
+                        help="also run an instrumented compile, and report the N most expensive mods, files, "
+                             "selectors and templates")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare is not None:
+        with open(baselines_path + "/" + args.compare + ".json", "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    result = run_benchmark(args.scale, args.repeats, args.seed, args.profile)
+    print("fastest: " + ", ".join(phase + " " + format_seconds(result["phases"][phase]) for phase in phases))
+
+    if args.save is not None:
+        os.makedirs(baselines_path, exist_ok=True)
+        with open(baselines_path + "/" + args.save + ".json", "w") as baseline_file:
+            json.dump(result, baseline_file, indent=4)
+        print("saved baseline " + args.save)
+
+    if baseline is not None:
+        print("compared to baseline " + args.compare + ":")
+        if compare_to_baseline(result, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from raw_handler import Compiler
+from benchmarks.common import find_example_mods
+from benchmarks.common import prepare_example_mods
+from benchmarks.common import default_mods_path
+
+# Measures the peak memory use of compiling vanilla plus the example mods.
+# Each compile runs in a fresh process, so the peak isn't affected by anything else.
+#   python -m benchmarks.memory [--mods-path mods] [--runs 3]
+# Run it on two checkouts to compare them.
+
+
+def get_peak_memory():
+    # peak resident set size in bytes where the resource module is available (not on Windows),
+    # and otherwise the peak of memory allocated by Python, as traced by tracemalloc
+    try:
+        import resource
+    except ImportError:
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[1], "tracemalloc peak"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, but in kilobytes elsewhere
+    if sys.platform != "darwin":
+        peak *= 1024
+    return peak, "peak RSS"
+
+
+def measure_compile(prepared_mods_path, output_path):
+    # run in the child process
+    try:
+        import resource
+    except ImportError:
+        import tracemalloc
+        tracemalloc.start()
+    mods = find_example_mods(prepared_mods_path)
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Compiler().compile_mods(mods, output_path)
+    seconds = time.perf_counter() - start_time
+    peak, peak_kind = get_peak_memory()
+    print(json.dumps({"peak_bytes": peak, "peak_kind": peak_kind, "seconds": seconds}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the peak memory use of compiling vanilla plus the "
+                                                 "example mods.")
+    parser.add_argument("--mods-path", default=default_mods_path)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--measure", nargs=2, metavar=("PREPARED_MODS_PATH", "OUTPUT_PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure_compile(*args.measure)
+        return
+
+    with tempfile.TemporaryDirectory() as work_path:
+        print("updating the syntax of the mods in a temporary folder...")
+        prepare_example_mods(work_path, args.mods_path)
+        os.makedirs(work_path + "/output")
+
+        results = []
+        for i in range(args.runs):
+            process = subprocess.run([sys.executable, "-m", "benchmarks.memory", "--measure",
+                                      work_path + "/mods", work_path + "/output"],
+                                     stdout=subprocess.PIPE, check=True, text=True)
+            result = json.loads(process.stdout.splitlines()[-1])
+            print("run " + str(i + 1) + "/" + str(args.runs) + ": " + result["peak_kind"] + " " +
+                  str(round(result["peak_bytes"] / 2**20, 1)) + " MiB, " + str(round(result["seconds"], 2)) + " s")
+            results.append(result)
+
+        print("lowest " + results[0]["peak_kind"] + ": " +
+              str(round(min(result["peak_bytes"] for result in results) / 2**20, 1)) + " MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+import random
+
+# Generates synthetic mods shaped like vanilla plus the example mods, for benchmarking.
+# At scale 1 the base mod is about the size of the vanilla creature raws (~800 creatures of ~60 tokens each),
+# at scale 100 it is a hundred times that. The base mod is written in vanilla syntax (creature variations and body
+# detail plans), so that the SyntaxUpdater has something to do, while the EDIT mods use the modloader syntax:
+# - EDIT blocks selecting by SEL_BY_CLASS, SEL_BY_TAG and SEL_BY_ID, with PLUS_SELECT and UNSELECT
+# - COPY_TAGS_FROM chains of copy_chain_depth creatures
+# - OBJECT_TEMPLATEs used with arguments, both directly and through converted creature variations
+
+creatures_per_scale = 800
+filler_tokens_per_creature = 50
+creature_variations_per_scale = 30
+object_templates_per_scale = 10
+edit_blocks_per_scale = 200
+edit_mods_per_scale = 5
+copy_chain_depth = 8
+# every copy_chain_spacing creatures starts a new COPY_TAGS_FROM chain
+copy_chain_spacing = 40
+creatures_per_file = 100
+creature_classes_count = 20
+filler_token_names_count = 200
+filler_token_values_count = 10
+
+
+def generate_synthetic_mods(mods_path, scale=1.0, seed=0):
+    # writes the synthetic mods into mods_path, and returns their folder paths in load order
+    rng = random.Random(seed)
+    creature_count = max(1, int(creatures_per_scale * scale))
+    creature_variation_count = max(1, int(creature_variations_per_scale * scale))
+    object_template_count = max(1, int(object_templates_per_scale * scale))
+    edit_block_count = max(1, int(edit_blocks_per_scale * scale))
+    edit_mod_count = max(1, int(edit_mods_per_scale * scale))
+
+    base_path = mods_path + "/synthetic_base"
+    write_mod_info(base_path, "Synthetic base", "A synthetic stand-in for vanilla, generated for benchmarking.")
+    write_raw_file(base_path, "b_detail_plan_synthetic", "BODY_DETAIL_PLAN",
+                   get_body_detail_plan_lines())
+    write_raw_file(base_path, "c_variation_synthetic", "CREATURE_VARIATION",
+                   get_creature_variation_lines(rng, creature_variation_count))
+    write_raw_file(base_path, "o_template_synthetic", "OBJECT_TEMPLATE",
+                   get_object_template_lines(rng, object_template_count))
+    for file_start in range(0, creature_count, creatures_per_file):
+        write_raw_file(base_path, "creature_synthetic_" + str(file_start // creatures_per_file), "CREATURE",
+                       get_creature_lines(rng, range(file_start, min(file_start + creatures_per_file, creature_count)),
+                                          creature_variation_count, object_template_count))
+
+    mod_paths = [base_path]
+    for mod_number in range(edit_mod_count):
+        edit_mod_path = mods_path + "/synthetic_edits_" + str(mod_number)
+        write_mod_info(edit_mod_path, "Synthetic edits " + str(mod_number),
+                       "Synthetic EDIT blocks, generated for benchmarking.")
+        # the edit blocks are spread evenly over the mods
+        block_count = edit_block_count // edit_mod_count + (mod_number < edit_block_count % edit_mod_count)
+        write_raw_file(edit_mod_path, "creature_synthetic_edits_" + str(mod_number), "CREATURE",
+                       get_edit_lines(rng, block_count, creature_count, object_template_count))
+        mod_paths.append(edit_mod_path)
+
+    return mod_paths
+
+
+def write_mod_info(mod_path, name, description):
+    os.makedirs(mod_path + "/objects", exist_ok=True)
+    with open(mod_path + "/mod_info.txt", "w", encoding="latin1") as mod_info_file:
+        mod_info_file.write("name:" + name + "\n" +
+                            "version:1.0\n" +
+                            "creator:benchmarks\n" +
+                            "df_version:0.47.05\n" +
+                            "description_string:" + description + "\n" +
+                            "dependencies_string:\n")
+
+
+def write_raw_file(mod_path, header, object_type, lines):
+    with open(mod_path + "/objects/" + header + ".txt", "w", encoding="latin1") as raw_file:
+        raw_file.write(header + "\n\n[OBJECT:" + object_type + "]\n")
+        for line in lines:
+            raw_file.write(line + "\n")
+
+
+def get_filler_token(rng):
+    return "[SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + ":" + \
+           str(rng.randrange(filler_token_values_count)) + "]"
+
+
+def get_body_detail_plan_lines():
+    return ["",
+            "[BODY_DETAIL_PLAN:SYN_MATERIALS]",
+            "\t[ADD_MATERIAL:SKIN:SKIN_TEMPLATE]",
+            "\t[ADD_MATERIAL:BONE:BONE_TEMPLATE]",
+            "\t[ADD_TISSUE:SKIN:SKIN_TEMPLATE]",
+            "\t[ADD_TISSUE:BONE:BONE_TEMPLATE]",
+            "",
+            "[BODY_DETAIL_PLAN:SYN_POSITIONS]",
+            "\t[BP_POSITION:BY_CATEGORY:EYE:FRONT]",
+            "\t[BP_RELSIZE:BY_CATEGORY:EYE:ARG1]"]
+
+
+def get_creature_variation_lines(rng, creature_variation_count):
+    lines = []
+    for i in range(creature_variation_count):
+        lines += ["",
+                  "[CREATURE_VARIATION:SYN_VARIATION_" + str(i) + "]",
+                  "\t[CV_CONVERT_TAG]",
+                  "\t\t[CVCT_MASTER:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + "]",
+                  "\t\t[CVCT_TARGET:1]",
+                  "\t\t[CVCT_REPLACEMENT:2]",
+                  "\t[CV_REMOVE_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + "]",
+                  "\t[CV_ADD_TAG:SYN_GAIT:!ARG1:!ARG2]",
+                  "\t[CV_ADD_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + ":!ARG1]"]
+    return lines
+
+
+def get_object_template_lines(rng, object_template_count):
+    lines = []
+    for i in range(object_template_count):
+        lines += ["",
+                  "[OBJECT_TEMPLATE:CREATURE:SYN_TEMPLATE_" + str(i) + "]",
+                  "\t[OT_REMOVE_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + "]",
+                  "\t[OT_ADD_TAG:SYN_MATERIAL:!ARG1:!ARG2]",
+                  "\t[OT_ADD_TAG:SYN_TISSUE:!ARG1]",
+                  "\t[OT_ADD_CTAG:2:YES:SYN_CONDITIONAL]"]
+    return lines
+
+
+def get_creature_lines(rng, creature_numbers, creature_variation_count, object_template_count):
+    lines = []
+    for i in creature_numbers:
+        lines += ["", "[CREATURE:SYN_CREATURE_" + str(i) + "]"]
+        # the start of a chain copies from nothing, and each following creature copies from the one before
+        if 0 < i % copy_chain_spacing < copy_chain_depth:
+            lines.append("\t[COPY_TAGS_FROM:SYN_CREATURE_" + str(i - 1) + "]")
+        lines += ["\t[DESCRIPTION:A synthetic creature, number " + str(i) + ".]",
+                  "\t[NAME:synthetic " + str(i) + ":synthetics " + str(i) + ":synthetic " + str(i) + "]",
+                  "\t[CREATURE_CLASS:SYN_CLASS_" + str(rng.randrange(creature_classes_count)) + "]",
+                  "\t[CREATURE_CLASS:SYN_CLASS_" + str(rng.randrange(creature_classes_count)) + "]",
+                  "\t[BODY:BASIC_1PARTBODY:BASIC_HEAD]",
+                  "\t[BODY_DETAIL_PLAN:SYN_MATERIALS]",
+                  "\t[BODY_DETAIL_PLAN:SYN_POSITIONS:" + str(rng.randrange(1, 10)) + "]"]
+        lines += ["\t" + get_filler_token(rng) for j in range(filler_tokens_per_creature)]
+        if i % 2 == 0:
+            lines.append("\t[APPLY_CREATURE_VARIATION:SYN_VARIATION_" + str(rng.randrange(creature_variation_count)) +
+                         ":" + str(rng.randrange(100)) + ":" + str(rng.randrange(100)) + "]")
+        if i % 3 == 0:
+            lines.append("\t[USE_OBJECT_TEMPLATE:SYN_TEMPLATE_" + str(rng.randrange(object_template_count)) +
+                         ":SYN_MATERIAL_" + str(rng.randrange(10)) + ":" + rng.choice(["YES", "NO"]) + "]")
+        lines += ["\t[SELECT_CASTE:FEMALE]",
+                  "\t\t[FEMALE]",
+                  "\t[SELECT_CASTE:MALE]",
+                  "\t\t[MALE]"]
+    return lines
+
+
+def get_edit_lines(rng, block_count, creature_count, object_template_count):
+    lines = []
+    for i in range(block_count):
+        kind = i % 4
+        if kind == 0:
+            lines += ["",
+                      "[EDIT:CREATURE:SEL_BY_CLASS:SYN_CLASS_" + str(rng.randrange(creature_classes_count)) + "]",
+                      "\t[OT_REMOVE_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + "]",
+                      "\t[SYN_EDITED:" + str(i) + "]"]
+        elif kind == 1:
+            lines += ["",
+                      "[EDIT:CREATURE:SEL_BY_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + ":" +
+                      str(rng.randrange(filler_token_values_count)) + "]",
+                      "[PLUS_SELECT:SEL_BY_CLASS:SYN_CLASS_" + str(rng.randrange(creature_classes_count)) + "]",
+                      "[UNSELECT:SEL_BY_ID:SYN_CREATURE_" + str(rng.randrange(creature_count)) + "]",
+                      "\t[GO_TO_START]",
+                      "\t" + get_filler_token(rng)]
+        elif kind == 2:
+            lines += ["",
+                      "[EDIT:CREATURE:SEL_BY_CLASS:SYN_CLASS_" + str(rng.randrange(creature_classes_count)) +
+                      ":SEL_BY_TAG:SYN_TAG_" + str(rng.randrange(filler_token_names_count)) + "]",
+                      "\t[GO_TO_TAG:SELECT_CASTE:FEMALE]",
+                      "\t[SYN_EDITED:" + str(i) + "]"]
+        else:
+            lines += ["",
+                      "[EDIT:CREATURE:SEL_BY_ID:SYN_CREATURE_" + str(rng.randrange(creature_count)) + "]",
+                      "\t[USE_OBJECT_TEMPLATE:SYN_TEMPLATE_" + str(rng.randrange(object_template_count)) +
+                      ":SYN_MATERIAL_" + str(rng.randrange(10)) + ":YES]"]
+    return lines
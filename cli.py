@@ -0,0 +1,199 @@
+import os
+import sys
+import argparse
+import traceback
+from raw_handler import Compiler
+from raw_handler import SyntaxUpdater
+from parse_cache import ParseCache
+from compile_metrics import CompileMetrics
+from mod_manifest import ManifestCache
+from compile_checkpoints import CompileCheckpoints
+from backup_store import BackupStore
+from mods_folder import find_mods
+from mods_folder import read_load_order
+from mods_folder import get_mods_in_load_order
+
+# A command line interface to the modloader, for compiling without the GUI (e.g. on servers or in scripts).
+#   python cli.py list --mods-dir mods
+#   python cli.py update-syntax --mods-dir mods --profile modlist.json --backup backup [--overwrite-backups]
+#   python cli.py restore-backup --mods-dir mods --profile modlist.json --backup backup
+#   python cli.py compile --mods-dir mods --profile modlist.json --out output
+# The profile is the load order file, see mods_folder.read_load_order().
+#
+# Exit codes:
+exit_ok = 0
+# something went wrong while updating the syntax or compiling
+exit_failed = 1
+# the command line arguments are wrong (also used by argparse)
+exit_usage = 2
+# the mods folder or profile can't be read, or the profile names mods that aren't in the mods folder
+exit_bad_input = 3
+
+
+def list_command(args):
+    for mod in find_mods(args.mods_dir):
+        print(mod.name + " " + mod.version + "\t" + mod.path)
+    return exit_ok
+
+
+def update_syntax_command(args):
+    mods = get_mods(args)
+    if mods is None:
+        return exit_bad_input
+    print("Updating syntax started...")
+    SyntaxUpdater(ask_overwrite_backups=lambda: args.overwrite_backups,
+                  workers=args.workers).update_mods_syntax(mods, args.backup)
+    print("Updating syntax completed!")
+    return exit_ok
+
+
+def restore_backup_command(args):
+    mods = get_mods(args)
+    if mods is None:
+        return exit_bad_input
+    backup_store = BackupStore(args.backup)
+    missing_backup_names = [mod.name + " " + mod.version for mod in mods
+                            if not backup_store.has_snapshot(mod.name + " " + mod.version)]
+    if len(missing_backup_names) != 0:
+        print_error("Mods in the profile that have no backup: " + ", ".join(missing_backup_names))
+        return exit_bad_input
+
+    is_complete = True
+    for mod in mods:
+        print("Restoring " + mod.name + " " + mod.version)
+        is_complete = backup_store.restore_snapshot(mod.name + " " + mod.version, mod.path,
+                                                    args.remove_added_files) and is_complete
+    backup_store.save_file_hashes()
+    if not is_complete:
+        return exit_failed
+    return exit_ok
+
+
+def compile_command(args):
+    mods = get_mods(args)
+    if mods is None:
+        return exit_bad_input
+
+    parse_cache = None
+    build_state_path = None
+    manifest_cache = None
+    if args.cache_dir is not None:
+        parse_cache = ParseCache(args.cache_dir + "/parse")
+        build_state_path = args.cache_dir + "/build_state.pickle"
+        manifest_cache = ManifestCache(args.cache_dir + "/manifests", parse_cache)
+    checkpoints = None
+    if args.checkpoints:
+        if args.cache_dir is None:
+            print_error("--checkpoints needs a cache folder to store the checkpoints in.")
+            return exit_usage
+        checkpoints = CompileCheckpoints(args.cache_dir + "/checkpoints")
+    metrics = None
+    if args.report is not None:
+        metrics = CompileMetrics()
+
+    print("Compiling started...")
+    os.makedirs(args.out, exist_ok=True)
+    compiler = Compiler(parse_cache=parse_cache, build_state_path=build_state_path, workers=args.workers,
+                        metrics=metrics, manifest_cache=manifest_cache, lazy_objects=args.lazy,
+                        checkpoints=checkpoints)
+    compiler.compile_mods(mods, args.out)
+    print("Compiling completed!")
+
+    if metrics is not None:
+        print(metrics.get_report(args.report))
+    return exit_ok
+
+
+def get_mods(args):
+    # returns the mods named in the profile, in load order, or None (after printing why) if that isn't possible
+    if not os.path.isdir(args.mods_dir):
+        print_error("The mods folder " + args.mods_dir + " does not exist.")
+        return None
+    try:
+        load_order = read_load_order(args.profile)
+    except (OSError, ValueError) as error:
+        print_error("Could not read the profile " + args.profile + "; " + str(error))
+        return None
+
+    mods, missing_mod_names = get_mods_in_load_order(find_mods(args.mods_dir), load_order)
+    if len(missing_mod_names) != 0:
+        print_error("Mods in the profile that are missing from the mods folder: " + ", ".join(missing_mod_names))
+        return None
+    if len(mods) == 0:
+        print_error("The profile " + args.profile + " contains no mods.")
+        return None
+    return mods
+
+
+def print_error(message):
+    print(message, file=sys.stderr)
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="Updates the syntax of and compiles Dwarf Fortress mods.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list the mods in the mods folder")
+    list_parser.set_defaults(function=list_command)
+
+    update_syntax_parser = subparsers.add_parser("update-syntax",
+                                                 help="update the raws of the mods to the modloader syntax, in place")
+    update_syntax_parser.add_argument("--backup", required=True,
+                                      help="folder to back up the unchanged mods in, see restore-backup")
+    overwrite_backups_group = update_syntax_parser.add_mutually_exclusive_group()
+    overwrite_backups_group.add_argument("--overwrite-backups", dest="overwrite_backups", action="store_true",
+                                         help="replace the backups of mods that already have one")
+    overwrite_backups_group.add_argument("--keep-backups", dest="overwrite_backups", action="store_false",
+                                         help="keep the backups of mods that already have one as they are (default)")
+    update_syntax_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                                      help="how many processes to update the raw files with (default one per CPU)")
+    update_syntax_parser.set_defaults(function=update_syntax_command, overwrite_backups=False)
+
+    restore_backup_parser = subparsers.add_parser("restore-backup",
+                                                  help="restore the mods to how they were before updating their "
+                                                       "syntax")
+    restore_backup_parser.add_argument("--backup", required=True, help="the folder the backups were made in")
+    restore_backup_parser.add_argument("--remove-added-files", action="store_true",
+                                       help="also remove the files added to the mods since they were backed up "
+                                            "(by default only those added by update-syntax are removed)")
+    restore_backup_parser.set_defaults(function=restore_backup_command)
+
+    compile_parser = subparsers.add_parser("compile", help="compile the mods into the output folder")
+    compile_parser.add_argument("--out", required=True, help="the output folder")
+    compile_parser.add_argument("--cache-dir", default=os.getcwd() + "/cache",
+                                help="folder for the parse cache, mod manifests and build state (default ./cache)")
+    compile_parser.add_argument("--no-cache", dest="cache_dir", action="store_const", const=None,
+                                help="don't use or update the parse cache, mod manifests and build state")
+    compile_parser.add_argument("--workers", type=int, default=1,
+                                help="how many processes to tokenize the raw files with, with --no-lazy (default 1)")
+    compile_parser.add_argument("--no-lazy", dest="lazy", action="store_false",
+                                help="tokenize every object, instead of only those that are changed by other objects "
+                                     "(the output is the same, this is mostly for testing)")
+    compile_parser.add_argument("--checkpoints", action="store_true",
+                                help="multi-step compilation; store the state after reading the first mods in the "
+                                     "cache folder, so later compiles of a load order starting with the same mods "
+                                     "only have to read the mods after them")
+    compile_parser.add_argument("--report", type=int, metavar="N",
+                                help="report the N most expensive mods, files, selectors and templates")
+    compile_parser.set_defaults(function=compile_command)
+
+    for subparser in [list_parser, update_syntax_parser, restore_backup_parser, compile_parser]:
+        subparser.add_argument("--mods-dir", default=os.getcwd() + "/mods", help="the mods folder (default ./mods)")
+    for subparser in [update_syntax_parser, restore_backup_parser, compile_parser]:
+        subparser.add_argument("--profile", "--load-order", dest="profile", required=True,
+                               help="the load order file; a JSON list of mod names, or a text file with one mod "
+                                    "name per line, first mod first")
+    return parser
+
+
+def main(argv=None):
+    args = get_argument_parser().parse_args(argv)
+    try:
+        return args.function(args)
+    except Exception:
+        traceback.print_exc()
+        return exit_failed
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import os
+import pickle
+
+# how many checkpoints are kept by default; the least recently used are thrown away first
+default_max_count = 16
+
+checkpoint_extension = ".checkpoint"
+
+
+class CompileCheckpoints:
+    # Snapshots of a Compiler's state after reading the first mods of a load order, for "multi-step compilation".
+    # A compile whose load order starts with the same mods (with the same files) as an earlier one can resume from
+    # the snapshot after them, instead of reading those mods again; see Compiler.read_mods().
+    # The snapshots are kept in memory, or in cache_path if one is given so they last between runs.
+
+    def __init__(self, cache_path=None, max_count=default_max_count):
+        self.cache_path = cache_path
+        self.max_count = max_count
+        # key => pickled state, for checkpoints kept in memory, the most recently used last
+        self.checkpoints = {}
+        if self.cache_path is not None:
+            os.makedirs(self.cache_path, exist_ok=True)
+
+    def get_state(self, key):
+        # returns the state stored for key, or None if there is none
+        if self.cache_path is None:
+            data = self.checkpoints.pop(key, None)
+            if data is not None:
+                # (re)inserted last, as dicts keep their insertion order
+                self.checkpoints[key] = data
+        else:
+            data = None
+            if os.path.isfile(self.checkpoint_path(key)):
+                try:
+                    with open(self.checkpoint_path(key), "rb") as checkpoint_file:
+                        data = checkpoint_file.read()
+                    # marks the checkpoint as recently used
+                    os.utime(self.checkpoint_path(key))
+                except OSError:
+                    data = None
+
+        if data is None:
+            return None
+        try:
+            state = pickle.loads(data)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            print("Could not read the checkpoint " + key + ", reading the mods again.")
+            return None
+        return state
+
+    def store_state(self, key, state):
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.cache_path is None:
+            self.checkpoints.pop(key, None)
+            self.checkpoints[key] = data
+            while len(self.checkpoints) > self.max_count:
+                del self.checkpoints[next(iter(self.checkpoints))]
+        else:
+            # writes to a temporary file first, so a half-written checkpoint is never read
+            temp_path = self.checkpoint_path(key) + ".tmp"
+            with open(temp_path, "wb") as checkpoint_file:
+                checkpoint_file.write(data)
+            os.replace(temp_path, self.checkpoint_path(key))
+            self.evict_checkpoints()
+
+    def get_checkpoint_positions(self, mods_count):
+        # Returns after which numbers of mods the Compiler stores a checkpoint. Storing one means copying the whole
+        # state, so it isn't done after every mod. Mods are mostly added or moved near the end of the load order, so
+        # they are stored after the first mod (usually vanilla, the largest one), after all mods, and after all but
+        # the last 1, 2, 4, 8... mods.
+        positions = {1, mods_count}
+        distance = 1
+        while mods_count - distance >= 1:
+            positions.add(mods_count - distance)
+            distance *= 2
+        return positions
+
+    def checkpoint_path(self, key):
+        return self.cache_path + "/" + key + checkpoint_extension
+
+    def evict_checkpoints(self):
+        # removes the least recently used checkpoints on disk until there are at most max_count
+        entries = [entry for entry in os.scandir(self.cache_path) if entry.name.endswith(checkpoint_extension)]
+        if len(entries) <= self.max_count:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_count]:
+            os.remove(entry.path)
+
@@ -0,0 +1,123 @@
+import time
+
+
+class CompileMetrics:
+    # Collects metrics from a Compiler, to find out which mods, files, EDIT selectors and object templates make a
+    # compile slow. Use it as Compiler(metrics=CompileMetrics()), and call get_report() after compiling.
+    # Without metrics the Compiler only does an "is None" check in the places that would record something.
+    #
+    # If a callback is given, it is called as callback(event, data) for each recorded event, data being a dict.
+    # The events are "phase", "file", "selection", "template_expansion" and "object".
+
+    def __init__(self, callback=None):
+        self.callback = callback
+
+        # phase name => seconds
+        self.phase_times = {}
+        # mod name and version => seconds, the time spent reading its files and compiling its objects
+        self.mod_times = {}
+        # (mod name and version, file name) => seconds, the same but for each file
+        self.file_times = {}
+        # (mod name and version, file name, selector) => [times used, objects matched, seconds]
+        self.selections = {}
+        # (object type, object template id) => [times expanded, tokens produced, seconds]
+        self.template_expansions = {}
+        # (object type, object id) => [list inserts, list removes] done to the tokens while compiling it
+        self.object_edits = {}
+
+        # the times of objects being compiled inside each other (e.g. due to COPY_TAGS_FROM) are subtracted from
+        # the outer objects, so each object is only counted once
+        self.object_start_times = []
+        self.object_inner_times = []
+
+    def notify(self, event, data):
+        if self.callback is not None:
+            self.callback(event, data)
+
+    def record_phase(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0) + seconds
+        self.notify("phase", {"phase": phase, "seconds": seconds})
+
+    def record_file(self, mod_name_and_version, file_name, seconds):
+        self.add_source_time(mod_name_and_version, file_name, seconds)
+        self.notify("file", {"mod": mod_name_and_version, "file": file_name, "seconds": seconds})
+
+    def record_selection(self, mod_name_and_version, file_name, selector, matched_count, seconds):
+        selection = self.selections.setdefault((mod_name_and_version, file_name, selector), [0, 0, 0])
+        selection[0] += 1
+        selection[1] += matched_count
+        selection[2] += seconds
+        self.notify("selection", {"mod": mod_name_and_version, "file": file_name, "selector": selector,
+                                  "matched": matched_count, "seconds": seconds})
+
+    def record_template_expansion(self, object_type, template_id, tokens_count, seconds):
+        expansion = self.template_expansions.setdefault((object_type, template_id), [0, 0, 0])
+        expansion[0] += 1
+        expansion[1] += tokens_count
+        expansion[2] += seconds
+        self.notify("template_expansion", {"object_type": object_type, "template": template_id,
+                                           "tokens": tokens_count, "seconds": seconds})
+
+    def object_started(self):
+        self.object_start_times.append(time.perf_counter())
+        self.object_inner_times.append(0)
+
+    def object_finished(self, object_type, raw_object, inserts_count, removes_count):
+        # raw_object is the compiled object, holding the source mod and file
+        elapsed = time.perf_counter() - self.object_start_times.pop()
+        seconds = elapsed - self.object_inner_times.pop()
+        if len(self.object_inner_times) != 0:
+            self.object_inner_times[-1] += elapsed
+        self.add_source_time(raw_object.source_mod_name_and_version, raw_object.source_file_name, seconds)
+        self.object_edits[(object_type, raw_object.object_id)] = [inserts_count, removes_count]
+        self.notify("object", {"object_type": object_type, "object_id": raw_object.object_id,
+                               "mod": raw_object.source_mod_name_and_version, "file": raw_object.source_file_name,
+                               "inserts": inserts_count, "removes": removes_count, "seconds": seconds})
+
+    def add_source_time(self, mod_name_and_version, file_name, seconds):
+        self.mod_times[mod_name_and_version] = self.mod_times.get(mod_name_and_version, 0) + seconds
+        self.file_times[(mod_name_and_version, file_name)] = \
+            self.file_times.get((mod_name_and_version, file_name), 0) + seconds
+
+    def get_report(self, top_n=10):
+        # returns a report of the phases, and the top_n most expensive mods, files, selectors, templates and objects
+        lines = ["Phases:"]
+        for phase, seconds in self.phase_times.items():
+            lines.append("\t" + format_seconds(seconds) + "  " + phase)
+
+        lines.append("Most expensive mods (reading and compiling):")
+        for mod, seconds in get_top(self.mod_times, top_n, lambda seconds: seconds):
+            lines.append("\t" + format_seconds(seconds) + "  " + mod)
+
+        lines.append("Most expensive files (reading and compiling):")
+        for (mod, file_name), seconds in get_top(self.file_times, top_n, lambda seconds: seconds):
+            lines.append("\t" + format_seconds(seconds) + "  " + mod + ", " + file_name)
+
+        lines.append("Most expensive EDIT selectors:")
+        for (mod, file_name, selector), (count, matched_count, seconds) in \
+                get_top(self.selections, top_n, lambda selection: selection[2]):
+            lines.append("\t" + format_seconds(seconds) + "  [" + selector + "] in " + mod + ", " + file_name +
+                         "; used " + str(count) + " times, matched " + str(matched_count) + " objects")
+
+        lines.append("Most expensive object templates:")
+        for (object_type, template_id), (count, tokens_count, seconds) in \
+                get_top(self.template_expansions, top_n, lambda expansion: expansion[2]):
+            lines.append("\t" + format_seconds(seconds) + "  " + object_type + ":" + template_id +
+                         "; expanded " + str(count) + " times, producing " + str(tokens_count) + " tokens")
+
+        lines.append("Most edited objects (list inserts + removes while compiling):")
+        for (object_type, object_id), (inserts_count, removes_count) in \
+                get_top(self.object_edits, top_n, lambda edits: edits[0] + edits[1]):
+            lines.append("\t" + str(inserts_count) + " inserts, " + str(removes_count) + " removes  " +
+                         object_type + ":" + object_id)
+
+        return "\n".join(lines)
+
+
+def get_top(dictionary, top_n, key):
+    # returns the top_n (key, value) pairs of dictionary, sorted by key(value), largest first
+    return sorted(dictionary.items(), key=lambda item: key(item[1]), reverse=True)[:top_n]
+
+
+def format_seconds(seconds):
+    return format(seconds, "8.4f") + " s"
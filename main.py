@@ -1,4 +1,7 @@
 import os
+import queue
+import threading
+import traceback
 from operator import attrgetter
 # tkinter-related imports
 import tkinter as tk
@@ -8,18 +11,25 @@ from tkinter import filedialog
 from PIL import ImageTk, Image
 from tooltip import create_tooltip
 # raw_handler-related imports
-from raw_handler import Mod
 from raw_handler import Compiler
 from raw_handler import SyntaxUpdater
+from raw_handler import CompileCancelled
+from parse_cache import ParseCache
+from mod_manifest import ManifestCache
+from compile_checkpoints import CompileCheckpoints
+from mod_registry import ModRegistry
+from mod_listbox import ModListbox
+from mod_search import ModSearchIndex
 
 
 def select_from_non_selected_mods(*args):
     current_selection = non_selected_mods_listbox.curselection()
     # if the event was due to the listbox being unselected (and thus len(current_selection) not being 1), ignores it
     if len(current_selection) == 1:
-        mod = non_selected_mods[current_selection[0]]
+        mod = non_selected_mods_model.mods[current_selection[0]]
         update_mod_info_box(mod)
-        select_unselect_button.configure(command=select_button_command, text="Select mod \u21D2", state='normal')
+        select_unselect_button.configure(command=select_button_command, text="Select mod \u21D2",
+                                         state=get_mod_list_buttons_state())
 
 
 def select_from_selected_mods(*args):
@@ -29,7 +39,8 @@ def select_from_selected_mods(*args):
         mod = selected_mods[current_selection[0]]
         update_mod_info_box(mod)
 
-        select_unselect_button.configure(command=unselect_button_command, text="\u21D0 Unselect mod", state='normal')
+        select_unselect_button.configure(command=unselect_button_command, text="\u21D0 Unselect mod",
+                                         state=get_mod_list_buttons_state())
 
 
 def update_mod_info_box(mod):
@@ -56,95 +67,62 @@ def update_mod_info_box(mod):
 
 
 def update_selected_mods_listbox():
-    # populates the selected_mods listbox
-    selected_mods_listvar = tk.StringVar(value=[mod.name + " " + mod.version for mod in selected_mods])
-    selected_mods_listbox.configure(listvariable=selected_mods_listvar)
-
-    # marks missing mods
-    for i in range(len(selected_mods)):
-        if selected_mods[i] in missing_mods:
-            selected_mods_listbox.itemconfigure(i, background='red')
-        else:
-            selected_mods_listbox.itemconfigure(i, background='white')
+    # updates the rows of the selected_mods listbox that changed, see ModListbox
+    selected_mods_model.update(selected_mods)
 
 
 def update_non_selected_mods_listbox():
-    non_selected_mods_listvar = tk.StringVar(value=[mod.name + " " + mod.version for mod in non_selected_mods])
-    non_selected_mods_listbox.configure(listvariable=non_selected_mods_listvar)
+    # only shows the mods that match the search, if there is one
+    if mod_search_var.get().strip() == "":
+        non_selected_mods_model.update(non_selected_mods)
+    else:
+        matching_mods = mod_search_index.search(mod_search_var.get())
+        non_selected_mods_model.update([mod for mod in non_selected_mods if mod in matching_mods])
+
+
+def search_mods(*args):
+    # the rows show other mods now, so the selected row (if any) no longer is the mod in the mod info box
+    if len(non_selected_mods_listbox.curselection()) != 0:
+        non_selected_mods_listbox.selection_clear(0, tk.END)
+        select_unselect_button.configure(state='disabled')
+    update_non_selected_mods_listbox()
+
+
+def get_mod_list_buttons_state():
+    # While a task runs, the worker thread uses the selected mods, and the Mod objects themselves (which reloading the
+    # mods folder changes in place), so the buttons that change them are disabled until it's done.
+    return 'disabled' if is_task_running else 'normal'
+
+
+def update_mod_list_buttons():
+    state = get_mod_list_buttons_state()
+    for button in (reload_mods_folder_button, move_up_button, move_down_button, move_to_top_button,
+                   move_to_bottom_button):
+        button.configure(state=state)
+    # without a selected mod, the select_unselect_button stays disabled
+    if len(non_selected_mods_listbox.curselection()) == 0 and len(selected_mods_listbox.curselection()) == 0:
+        state = 'disabled'
+    select_unselect_button.configure(state=state)
 
-    # marks missing mods
-    for i in range(len(non_selected_mods)):
-        if non_selected_mods[i] in missing_mods:
-            non_selected_mods_listbox.itemconfigure(i, background='red')
-        else:
-            non_selected_mods_listbox.itemconfigure(i, background='white')
+
+def is_missing_mod(mod):
+    return mod in missing_mods
 
 
 def load_mods_folder():
     global mods, non_selected_mods, missing_mods
 
-    def load_mod(path):
-        mod_info_file = open(path + "\\mod_info.txt", "r", encoding="latin1")
-        # populates a Mod object with what's in the mod_info_file, and appends it to the mods list
-        mod_name = mod_info_file.readline().replace("name:", "").replace("\n", "")
-        mod_version = mod_info_file.readline().replace("version:", "").replace("\n", "")
-        # already loaded mods are made to keep their object IDs (so other parts of the code can work)
-        is_old_mod = False
-        for old_mod in mods:
-            if (mod_name, mod_version) == (old_mod.name, old_mod.version):
-                is_old_mod = True
-                # the mod is re-initialized, but its identity remains the same
-                old_mod.__init__(name=mod_name, version=mod_version,
-                                 creator=mod_info_file.readline().replace("creator:", "").replace("\n", ""),
-                                 df_version=mod_info_file.readline().replace("df_version:", "").replace("\n", ""),
-                                 description_string=mod_info_file.readline().replace("description_string:", ""),
-                                 dependencies_string=mod_info_file.readline().replace("dependencies_string:", ""),
-                                 path=path)
-                new_mods.append(old_mod)
-        if not is_old_mod:
-            mod_creator = mod_info_file.readline().replace("creator:", "").replace("\n", "")
-            mod_df_version = mod_info_file.readline().replace("df_version:", "").replace("\n", "")
-            mod_description_string = mod_info_file.readline().replace("description_string:", "")
-            mod_dependencies_string = mod_info_file.readline().replace("dependencies_string:", "")
-            new_mods.append(Mod(name=mod_name, version=mod_version, creator=mod_creator, df_version=mod_df_version,
-                                description_string=mod_description_string, dependencies_string=mod_dependencies_string,
-                                path=path))
-        mod_info_file.close()
-
-    new_mods = []
-    # finds the mods
-    for top_directory in os.scandir(os.getcwd() + "\\mods"):
-        if top_directory.is_dir():
-
-            # Mods may either be directly in the mods folder (i.e. contained within a folder for each such mod,
-            # but nothing more). A mod needs a mod_info.txt to be valid.
-            if os.path.isfile(top_directory.path + "\\mod_info.txt"):
-                load_mod(top_directory.path)
-
-            # Or mods may be part of a "modpack", containing a modpack_info.txt and multiple such mod folders
-            elif os.path.isfile(top_directory.path + "\\modpack_info.txt"):
-                for mod_directory in os.scandir(top_directory.path):
-                    if mod_directory.is_dir():
-                        if os.path.isfile(mod_directory.path + "\\mod_info.txt"):
-                            load_mod(mod_directory.path)
-                        else:
-                            print(mod_directory.path + " is not neither a valid mod nor a valid modpack - "
-                                                       "it lacks mod_info.txt")
-            else:
-                print(top_directory.path + " is not neither a valid mod nor a valid modpack - it lacks mod_info.txt "
-                                           "/ modpack_info.txt")
-
-    # old mods that were not loaded now must be missing
-    missing_mods = []
-    for old_mod in mods:
-        if old_mod not in new_mods and old_mod not in missing_mods:
-            missing_mods.append(old_mod)
-            new_mods.append(old_mod)
-    # and replaces the old mods with the new
-    mods = new_mods
+    # Finds the mods; only the mod folders that changed since the last time are read again. Already loaded mods keep
+    # their object IDs (so other parts of the code can work), and old mods that were not found now are missing.
+    mod_registry.reload()
+    mods = mod_registry.get_mods()
+    missing_mods = mod_registry.get_missing_mods()
+    # only the mods that were added or changed are indexed again
+    mod_search_index.update(mods)
 
     # populates the non_selected_mods and sorts them alphabetically
-    non_selected_mods = [mod for mod in mods if mod not in selected_mods]
+    selected_mods_set = set(selected_mods)
+    non_selected_mods = [mod for mod in mods if mod not in selected_mods_set]
     non_selected_mods.sort(key=attrgetter('name'))
 
     # updates/populates the listboxes
@@ -168,12 +146,15 @@ def modloader_help_button_command():
 
 def select_button_command():
     mod_index = non_selected_mods_listbox.curselection()[0]
-    selected_mods.append(non_selected_mods.pop(mod_index))
+    # the listbox may only show the mods that match the search
+    mod = non_selected_mods_model.mods[mod_index]
+    non_selected_mods.remove(mod)
+    selected_mods.append(mod)
     update_selected_mods_listbox()
     update_non_selected_mods_listbox()
 
     # disables the select_unselect_button
-    if mod_index >= len(non_selected_mods):
+    if mod_index >= len(non_selected_mods_model.mods):
         select_unselect_button.configure(state='disabled')
 
 
@@ -254,19 +235,143 @@ def change_output_folder_button_command():
 
 
 def update_syntax_button_command():
-    print("Updating syntax started...")
-    syntax_updater = SyntaxUpdater()
-    syntax_updater.update_mods_syntax(selected_mods, backup_path)
-    # so the updated raws are used
-    load_mods_folder()
-    print("Updating syntax completed! Look in your mods folder! Find the unchanged files in the backup folder.")
+    # a snapshot of the selected mods, so changing the selection while updating doesn't affect it
+    mods_to_update = list(selected_mods)
+
+    def update_syntax(progress_callback, cancel_event):
+        print("Updating syntax started...")
+        syntax_updater = SyntaxUpdater(progress_callback=progress_callback, cancel_event=cancel_event,
+                                       ask_overwrite_backups=ask_overwrite_backups,
+                                       manifest_cache=ManifestCache(manifest_cache_path))
+        syntax_updater.update_mods_syntax(mods_to_update, backup_path)
+        print("Updating syntax completed! Look in your mods folder! The unchanged mods are backed up in the backup "
+              "folder, and can be restored with \"cli.py restore-backup\".")
+
+    # the mods folder is reloaded even if cancelled, so the updated raws are used
+    start_task("Updating syntax", update_syntax, on_finished=load_mods_folder)
 
 
 def compile_button_command():
-    print("Compiling started...")
-    compiler = Compiler()
-    compiler.compile_mods(selected_mods, output_path)
-    print("Compiling completed! Look in your output folder!")
+    # a snapshot of the selected mods, so changing the selection while compiling doesn't affect it
+    mods_to_compile = list(selected_mods)
+    compile_output_path = output_path
+    is_multi_step = multi_step_compilation.get()
+
+    def compile_mods(progress_callback, cancel_event):
+        print("Compiling started...")
+        parse_cache = ParseCache(parse_cache_path)
+        # with multi-step compilation, only the mods after those read the same way in an earlier compile are read
+        checkpoints = None
+        if is_multi_step:
+            checkpoints = CompileCheckpoints(checkpoints_path)
+        compiler = Compiler(parse_cache=parse_cache, build_state_path=build_state_path,
+                            progress_callback=progress_callback, cancel_event=cancel_event,
+                            manifest_cache=ManifestCache(manifest_cache_path, parse_cache), lazy_objects=True,
+                            checkpoints=checkpoints)
+        compiler.compile_mods(mods_to_compile, compile_output_path)
+        print("Compiling completed! Look in your output folder!")
+
+    start_task("Compiling", compile_mods)
+
+
+def cancel_button_command():
+    cancel_event.set()
+    cancel_button.configure(state='disabled')
+    progress_label.configure(text="Cancelling...")
+
+
+# ====== Worker thread =================================================================================================
+
+def start_task(task_name, task, on_finished=None):
+    # Runs task(progress_callback, cancel_event) in a worker thread, so the window doesn't freeze meanwhile.
+    # The worker thread must not touch the widgets, so it puts messages in task_queue instead,
+    # which the main loop handles every task_poll_interval ms, see poll_task_queue().
+    global cancel_event, is_task_running
+    cancel_event = threading.Event()
+    is_task_running = True
+
+    def progress_callback(phase, index, count, name):
+        task_queue.put(("progress", (phase, index, count, name)))
+
+    def run_task():
+        try:
+            task(progress_callback, cancel_event)
+        except CompileCancelled:
+            task_queue.put(("finished", task_name + " cancelled."))
+        except Exception:
+            traceback.print_exc()
+            task_queue.put(("failed", task_name + " failed! See the console for details."))
+        else:
+            task_queue.put(("finished", task_name + " completed!"))
+
+    update_syntax_button.configure(state='disabled')
+    compile_button.configure(state='disabled')
+    cancel_button.configure(state='normal')
+    update_mod_list_buttons()
+    progress_label.configure(text=task_name + "...")
+    progressbar.configure(value=0)
+
+    threading.Thread(target=run_task, daemon=True).start()
+    root.after(task_poll_interval, poll_task_queue, on_finished)
+
+
+def ask_overwrite_backups():
+    # called from the worker thread; asks the main loop to show the question, and waits for the answer
+    answer_queue = queue.Queue()
+    task_queue.put(("ask_overwrite_backups", answer_queue))
+    return answer_queue.get()
+
+
+def poll_task_queue(on_finished):
+    global is_task_running
+    while True:
+        try:
+            message, data = task_queue.get_nowait()
+        except queue.Empty:
+            break
+
+        if message == "progress":
+            show_progress(*data)
+
+        elif message == "ask_overwrite_backups":
+            data.put(messagebox.askyesno(message="Found an existing backup for one of the mods. "
+                                                 "Do you want to overwrite existing backups?",
+                                         title="Overwrite backups? - DF Modloader mockup"))
+
+        # the task is done
+        else:
+            progress_label.configure(text=data)
+            if message == "finished" and not cancel_event.is_set():
+                progressbar.configure(value=100)
+            else:
+                progressbar.configure(value=0)
+            update_syntax_button.configure(state='normal')
+            compile_button.configure(state='normal')
+            cancel_button.configure(state='disabled')
+            is_task_running = False
+            if on_finished is not None:
+                on_finished()
+            update_mod_list_buttons()
+            return
+
+    root.after(task_poll_interval, poll_task_queue, on_finished)
+
+
+def show_progress(phase, index, count, name):
+    # The mods (or object types, output files) of a phase each get an equal part of the progress bar,
+    # which is further divided between the files of a mod.
+    global progress_step
+    if phase.endswith("_file"):
+        step_phase, step_index, step_count, step_name = progress_step
+        progressbar.configure(value=100 * (step_index + index / count) / step_count)
+        progress_label.configure(text=progress_phase_texts[step_phase] + " " + str(step_index + 1) + "/" +
+                                 str(step_count) + ": " + step_name + ", file " + str(index + 1) + "/" +
+                                 str(count) + ": " + name)
+    else:
+        progress_step = (phase, index, count, name)
+        progressbar.configure(value=100 * index / count)
+        progress_label.configure(text=progress_phase_texts[phase] + " " + str(index + 1) + "/" + str(count) + ": " +
+                                 name)
 
 
 # ======================================================================================================================
@@ -288,17 +393,25 @@ mod_list_frame.grid(column=0, row=0, columnspan=2, padx=5, pady=5)
 
 # labels for mod lists
 non_selected_mods_label = ttk.Label(mod_list_frame, text="Non-selected mods:")
-non_selected_mods_label.grid(column=1, row=0, columnspan=2)
+non_selected_mods_label.grid(column=1, row=0)
 selected_mods_label = tk.Label(mod_list_frame, text="Selected mods:")
 selected_mods_label.grid(column=5, row=0)
 
+# search box for the non-selected mods, which filters them as you type
+mod_search_var = tk.StringVar()
+mod_search_var.trace_add('write', search_mods)
+mod_search_entry = ttk.Entry(mod_list_frame, textvariable=mod_search_var, width=25)
+mod_search_entry.grid(column=2, row=0)
+create_tooltip(mod_search_entry, "Search the non-selected mods by name, creator, DF version and description")
+
 # listbox for the non-selected mods
 non_selected_mods_listbox = tk.Listbox(mod_list_frame, height=15, width=50)
 non_selected_mods_listbox.grid(column=1, row=1, rowspan=5, columnspan=2)
 non_selected_mods_listbox.bind('<<ListboxSelect>>', select_from_non_selected_mods)
 
 non_selected_mods_scrollbar = tk.Scrollbar(mod_list_frame, orient=tk.VERTICAL, command=non_selected_mods_listbox.yview)
-non_selected_mods_listbox.configure(yscrollcommand=non_selected_mods_scrollbar.set)
+# keeps the listbox showing non_selected_mods, and the scrollbar following it
+non_selected_mods_model = ModListbox(non_selected_mods_listbox, non_selected_mods_scrollbar, is_missing_mod)
 non_selected_mods_scrollbar.grid(column=0, row=1, rowspan=5)
 
 # buttons for moving the selected mod around
@@ -320,7 +433,7 @@ selected_mods_listbox.grid(column=5, row=1, rowspan=5)
 selected_mods_listbox.bind('<<ListboxSelect>>', select_from_selected_mods)
 
 selected_mods_scrollbar = tk.Scrollbar(mod_list_frame, orient=tk.VERTICAL, command=selected_mods_listbox.yview)
-selected_mods_listbox.configure(yscrollcommand=selected_mods_scrollbar.set)
+selected_mods_model = ModListbox(selected_mods_listbox, selected_mods_scrollbar, is_missing_mod)
 selected_mods_scrollbar.grid(column=6, row=1, rowspan=5)
 
 # button for opening the mods folder
@@ -359,12 +472,14 @@ mod_info_text_scrollbar.grid(column=1, row=1)
 
 # --- Bottom row buttons (Compile and ?/Help)---------------------------------------------------------------------------
 
-compile_setting_checkbutton = tk.Checkbutton(mainframe, text="Multi-step compilation?")
+multi_step_compilation = tk.BooleanVar(value=False)
+compile_setting_checkbutton = tk.Checkbutton(mainframe, text="Multi-step compilation?",
+                                             variable=multi_step_compilation)
 compile_setting_checkbutton.grid(column=0, row=1, sticky=tk.E)
 
-compile_button = tk.Button(mainframe, text="\u2460Update mods' syntax", command=update_syntax_button_command,
-                           background='Gray', foreground='White')
-compile_button.grid(column=1, row=1)
+update_syntax_button = tk.Button(mainframe, text="\u2460Update mods' syntax", command=update_syntax_button_command,
+                                 background='Gray', foreground='White')
+update_syntax_button.grid(column=1, row=1)
 
 compile_button = tk.Button(mainframe, text="\u2461Compile/install mods", command=compile_button_command,
                            background='Green', foreground='White')
@@ -373,6 +488,21 @@ compile_button.grid(column=1, row=2)
 modloader_help_button = tk.Button(mainframe, text="?", command=modloader_help_button_command)
 modloader_help_button.grid(column=2, row=1, sticky=tk.E)
 
+# --- Progress (of updating the syntax or compiling) -------------------------------------------------------------------
+
+progress_frame = ttk.Frame(mainframe)
+progress_frame.grid(column=0, row=3, columnspan=3, sticky=(tk.W, tk.E), padx=5, pady=5)
+progress_frame.columnconfigure(0, weight=1)
+
+progressbar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate', maximum=100)
+progressbar.grid(column=0, row=0, sticky=(tk.W, tk.E))
+
+cancel_button = tk.Button(progress_frame, text="Cancel", command=cancel_button_command, state='disabled')
+cancel_button.grid(column=1, row=0, padx=5)
+
+progress_label = ttk.Label(progress_frame, text="")
+progress_label.grid(column=0, row=1, columnspan=2, sticky=tk.W)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 # initializes the lists of all mods, selected mods, and non-selected mods
@@ -382,6 +512,10 @@ non_selected_mods = []
 # missing mods are mods that are not in the mods folder, but have been read once
 # (i.e. their folder existed but then disappeared)
 missing_mods = []
+# keeps track of the mods in the mods folder between reloads
+mod_registry = ModRegistry(os.getcwd() + "\\mods")
+# indexes the mods for the search box
+mod_search_index = ModSearchIndex()
 
 # loads the mods
 load_mods_folder()
@@ -396,6 +530,27 @@ logo_label.grid(column=2, row=1, sticky=tk.S)
 output_path = os.getcwd() + "\\output"
 # sets the default backup path
 backup_path = os.getcwd() + "\\backup"
+# sets the path of the parse cache
+parse_cache_path = os.getcwd() + "\\cache\\parse"
+# sets the path of the mod manifests, used for sorting the raw files of mods without opening them
+manifest_cache_path = os.getcwd() + "\\cache\\manifests"
+# sets the path of the build state, used for incremental compilation
+build_state_path = os.getcwd() + "\\cache\\build_state.pickle"
+# sets the path of the checkpoints, used for multi-step compilation
+checkpoints_path = os.getcwd() + "\\cache\\checkpoints"
+
+# for running the syntax updates and compiles in a worker thread, see start_task()
+task_queue = queue.Queue()
+task_poll_interval = 50
+cancel_event = threading.Event()
+is_task_running = False
+# the last progress (phase, index, count, name) that wasn't of a file, see show_progress()
+progress_step = None
+progress_phase_texts = {"read": "Reading mod",
+                        "apply_special_tokens": "Applying object templates etc. to",
+                        "write": "Writing",
+                        "syntax_backup": "Making a backup of mod",
+                        "syntax_update": "Updating the syntax of mod"}
 
 # runs the main loop
 root.mainloop()
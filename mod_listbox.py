@@ -0,0 +1,76 @@
+from difflib import SequenceMatcher
+
+marked_background = 'red'
+unmarked_background = 'white'
+
+
+class ModListbox:
+    # Keeps a tk.Listbox showing a list of mods (e.g. the GUI's selected_mods), with missing mods marked red.
+    # update() compares the list with the mods the listbox shows, and only deletes and inserts the rows that changed
+    # (moving a mod is deleting one row and inserting one), instead of filling the whole listbox again.
+    # Rows are only configured while they are visible: whenever the listbox changes or is scrolled, the visible rows
+    # that aren't marked the way they should be are configured. Rows keep their configuration when rows around them
+    # are inserted or deleted, so usually that is just the inserted rows.
+
+    def __init__(self, listbox, scrollbar, is_marked):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        # mod => whether its row should be marked
+        self.is_marked = is_marked
+        # the mods the listbox shows, in order
+        self.mods = []
+        self.listbox.configure(yscrollcommand=self.on_scroll)
+
+    def update(self, mods):
+        # The selected row numbers stay selected, e.g. after selecting a mod, the mod after it is selected (which the
+        # select/unselect button relies on).
+        selection = self.listbox.curselection()
+
+        # skips the rows that stay the same at the start and the end, which is all but a few of them when a mod is
+        # selected, unselected or moved
+        old_mods = self.mods
+        start = 0
+        while start < len(old_mods) and start < len(mods) and old_mods[start] is mods[start]:
+            start += 1
+        old_end = len(old_mods)
+        end = len(mods)
+        while old_end > start and end > start and old_mods[old_end - 1] is mods[end - 1]:
+            old_end -= 1
+            end -= 1
+
+        if old_end - start == 0 or end - start == 0:
+            opcodes = [("replace", 0, old_end - start, 0, end - start)]
+        else:
+            opcodes = SequenceMatcher(None, old_mods[start:old_end], mods[start:end], autojunk=False).get_opcodes()
+        # applied from the last to the first, so the row numbers of those before it stay the same
+        for tag, old_i, old_j, i, j in reversed(opcodes):
+            if tag == "equal":
+                continue
+            if old_j > old_i:
+                self.listbox.delete(start + old_i, start + old_j - 1)
+            if j > i:
+                self.listbox.insert(start + old_i, *[get_row_text(mod) for mod in mods[start + i:start + j]])
+        self.mods = list(mods)
+
+        for index in selection:
+            if index < len(self.mods):
+                self.listbox.selection_set(index)
+        self.configure_visible_rows()
+
+    def configure_visible_rows(self):
+        if len(self.mods) == 0:
+            return
+        first_index = self.listbox.nearest(0)
+        last_index = self.listbox.nearest(self.listbox.winfo_height())
+        for index in range(first_index, last_index + 1):
+            background = marked_background if self.is_marked(self.mods[index]) else unmarked_background
+            if self.listbox.itemcget(index, 'background') != background:
+                self.listbox.itemconfigure(index, background=background)
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.configure_visible_rows()
+
+
+def get_row_text(mod):
+    return mod.name + " " + mod.version
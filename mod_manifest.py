@@ -0,0 +1,174 @@
+import os
+import pickle
+import hashlib
+from raw_handler import object_types
+from raw_handler import iter_string_tokens
+from raw_handler import get_file_header
+from raw_handler import header_load_order
+from raw_handler import tokenizer_version
+
+# should be increased whenever what is recorded about each file changes, as it invalidates stored manifests
+manifest_version = 1
+
+manifest_extension = ".manifest"
+
+
+class ModManifest:
+    # What is known about the raw files of a mod, so it doesn't have to be found out by opening them again.
+    # For each file it records its size, modification time and a hash of its contents, the header it is sorted by
+    # (see header_load_order), and the objects and object templates it defines and the objects it EDITs.
+    # Only files whose size or modification time changed are read again, see ModManifest.refresh().
+
+    def __init__(self, mod_path):
+        self.mod_path = mod_path
+        # file name => {"size", "mtime_ns", "hash", "header", "objects", "object_templates", "edits"}
+        # "objects" and "object_templates" are lists of (object type, object ID),
+        # "edits" is a list of (object type, the selection criteria of the EDIT)
+        self.files = {}
+
+    def refresh(self, file_names, parse_cache=None):
+        # Brings the manifest up to date with the files in file_names (e.g. Mod.file_names), and returns whether
+        # anything changed. Tokenizing goes through the parse_cache if one is given, so a following compile can use
+        # the same tokens.
+        is_changed = False
+        for file_name in list(self.files):
+            if file_name not in file_names:
+                del self.files[file_name]
+                is_changed = True
+
+        for file_name in file_names:
+            file_path = self.mod_path + "/objects/" + file_name
+            stat = os.stat(file_path)
+            entry = self.files.get(file_name)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+
+            with open(file_path, "rb") as raw_file:
+                data = raw_file.read()
+            content_hash = hashlib.sha1(data).hexdigest()
+            if entry is not None and entry["hash"] == content_hash:
+                # only touched, the contents are the same
+                entry["size"] = stat.st_size
+                entry["mtime_ns"] = stat.st_mtime_ns
+            else:
+                # the same as reading it in text mode, which is what the Compiler does
+                file_string = data.decode("latin1").replace("\r\n", "\n").replace("\r", "\n")
+                if parse_cache is None:
+                    tokens = iter_string_tokens(file_string)
+                else:
+                    tokens = parse_cache.get_tokens(file_string)
+                entry = {"size": stat.st_size,
+                         "mtime_ns": stat.st_mtime_ns,
+                         "hash": content_hash,
+                         "header": get_file_header(file_string.split("\n", 1)[0])}
+                entry.update(get_object_inventory(tokens))
+                self.files[file_name] = entry
+            is_changed = True
+        return is_changed
+
+    def get_sorted_file_names(self, file_names):
+        # the same as raw_handler.sort_file_names(), but using the recorded headers
+        file_names_by_header = {header: [] for header in header_load_order}
+        for file_name in file_names:
+            file_header = self.files[file_name]["header"]
+            # if there is no proper header, the file is simply ignored
+            if file_header is not None:
+                file_names_by_header[file_header].append(file_name)
+
+        sorted_file_names = []
+        for header in header_load_order:
+            sorted_file_names += file_names_by_header[header]
+        return sorted_file_names
+
+    def get_object_types(self):
+        # returns the object types the mod defines objects or object templates of, or EDITs
+        found_object_types = set()
+        for entry in self.files.values():
+            found_object_types.update(object_type for object_type, _ in entry["objects"])
+            found_object_types.update(object_type for object_type, _ in entry["object_templates"])
+            found_object_types.update(object_type for object_type, _ in entry["edits"])
+        return found_object_types
+
+    def touches_object_type(self, object_type):
+        return object_type in self.get_object_types()
+
+    def get_fingerprint(self):
+        # a hash of the names and contents of all files, which changes if any file changes
+        file_hashes = hashlib.sha1()
+        for file_name in sorted(self.files):
+            file_hashes.update((file_name + ":" + self.files[file_name]["hash"] + "\n").encode("latin1"))
+        return file_hashes.hexdigest()
+
+
+class ManifestCache:
+    # Stores a ModManifest for each mod in cache_path, keyed by the path of the mod.
+    # get_manifest() returns an up to date manifest, reading only the files that changed since it was stored.
+
+    def __init__(self, cache_path, parse_cache=None):
+        self.cache_path = cache_path
+        self.parse_cache = parse_cache
+        os.makedirs(self.cache_path, exist_ok=True)
+        # mod path => ModManifest, for the manifests already loaded
+        self.manifests = {}
+
+    def get_manifest(self, mod):
+        manifest = self.manifests.get(mod.path)
+        if manifest is None:
+            manifest = self.load_manifest(mod.path)
+            self.manifests[mod.path] = manifest
+        if manifest.refresh(mod.file_names, self.parse_cache):
+            self.save_manifest(manifest)
+        return manifest
+
+    def get_mods_touching_object_type(self, mods, object_type):
+        # returns the mods that define objects or object templates of object_type, or EDIT them
+        return [mod for mod in mods if self.get_manifest(mod).touches_object_type(object_type)]
+
+    def manifest_path(self, mod_path):
+        key = hashlib.sha1(os.path.abspath(mod_path).encode("utf-8")).hexdigest()
+        return self.cache_path + "/" + key + manifest_extension
+
+    def load_manifest(self, mod_path):
+        # returns the stored manifest of the mod, or an empty one if there is none (or it can't be used)
+        manifest_path = self.manifest_path(mod_path)
+        if os.path.isfile(manifest_path):
+            try:
+                with open(manifest_path, "rb") as manifest_file:
+                    stored = pickle.load(manifest_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                print("Could not read the manifest " + manifest_path + ", reading the mod again.")
+            else:
+                if stored.get("manifest_version") == manifest_version and \
+                        stored.get("tokenizer_version") == tokenizer_version:
+                    manifest = ModManifest(mod_path)
+                    manifest.files = stored["files"]
+                    return manifest
+        return ModManifest(mod_path)
+
+    def save_manifest(self, manifest):
+        manifest_path = self.manifest_path(manifest.mod_path)
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "wb") as manifest_file:
+            pickle.dump({"manifest_version": manifest_version,
+                         "tokenizer_version": tokenizer_version,
+                         "files": manifest.files}, manifest_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, manifest_path)
+
+
+def get_object_inventory(tokens):
+    # returns the objects and object templates defined by, and the EDITs in, the tokens of a file
+    objects = []
+    object_templates = []
+    edits = []
+    # like when reading the file, the "OBJECT" token tells what object types to expect
+    pos_object_types = []
+    for token in tokens:
+        if token[0] == "OBJECT" and len(token) > 1:
+            pos_object_types = object_types.get(token[1], [])
+        elif token[0] == "EDIT" and len(token) > 1:
+            edits.append((token[1], ":".join(token[2:])))
+        elif token[0] == "OBJECT_TEMPLATE" and len(token) > 2:
+            object_templates.append((token[1], token[2]))
+        elif token[0] in pos_object_types and len(token) > 1:
+            objects.append((token[0], token[1]))
+    return {"objects": objects, "object_templates": object_templates, "edits": edits}
@@ -0,0 +1,131 @@
+import os
+from raw_handler import Mod
+
+
+class ModRegistry:
+    # Keeps track of the mods in a mods folder, so reloading it only has to re-read the mods that changed.
+    # Mods are keyed by (name, version). A mod keeps its identity (the same Mod object) as long as its name and
+    # version are the same, even if it changes or goes missing in between, so e.g. the GUI's selected mods stay valid.
+    #
+    # A mod folder counts as changed if its modification time, that of its /objects folder, or that of its
+    # mod_info.txt changed; i.e. if files were added to or removed from it, or its mod_info.txt was edited.
+    # Edits to the raw files themselves don't change anything about the Mod, so they aren't looked for.
+
+    def __init__(self, mods_path):
+        self.mods_path = mods_path
+        # (name, version) => Mod, including missing mods
+        self.mods = {}
+        # the keys of mods that were found before, but not in the last reload
+        self.missing_mod_keys = set()
+        # mod folder path => ((folder, objects folder and mod_info.txt modification times), (name, version))
+        self.mod_folder_states = {}
+        # modpack folder path => (modification time, mod folder paths in it)
+        self.modpack_folder_states = {}
+
+    def get_mods(self):
+        # returns all mods, including missing ones, in the order they were first found
+        return list(self.mods.values())
+
+    def get_missing_mods(self):
+        return [self.mods[key] for key in self.mods if key in self.missing_mod_keys]
+
+    def reload(self):
+        # Looks through the mods folder, and re-reads the mod folders that changed since the last reload.
+        # Returns the mods that were added (including missing mods that are back), the mods that changed,
+        # and the mods that are now missing.
+        added_mods = []
+        changed_mods = []
+        found_mod_keys = set()
+        mod_folder_states = {}
+
+        for mod_path in self.find_mod_folders():
+            state = get_mod_folder_state(mod_path)
+            previous_state = self.mod_folder_states.get(mod_path)
+            if previous_state is not None and previous_state[0] == state and previous_state[1] in self.mods:
+                # unchanged, so there is no need to read it again
+                key = previous_state[1]
+                is_changed = False
+            else:
+                mod_info = read_mod_info(mod_path)
+                key = (mod_info["name"], mod_info["version"])
+                is_changed = True
+
+            if key in found_mod_keys:
+                print(mod_path + " has the same name and version as another mod, and is ignored.")
+                continue
+            found_mod_keys.add(key)
+            mod_folder_states[mod_path] = (state, key)
+
+            if key not in self.mods:
+                self.mods[key] = Mod(**mod_info)
+                added_mods.append(self.mods[key])
+            else:
+                if is_changed:
+                    # the mod is re-initialized, but its identity remains the same
+                    self.mods[key].__init__(**mod_info)
+                if key in self.missing_mod_keys:
+                    added_mods.append(self.mods[key])
+                elif is_changed:
+                    changed_mods.append(self.mods[key])
+
+        self.mod_folder_states = mod_folder_states
+        self.missing_mod_keys = set(self.mods) - found_mod_keys
+        return added_mods, changed_mods, self.get_missing_mods()
+
+    def find_mod_folders(self):
+        # returns the paths of all mod folders, sorted by folder name
+        mod_paths = []
+        modpack_folder_states = {}
+        for top_directory in sorted(os.scandir(self.mods_path), key=lambda entry: entry.name):
+            if top_directory.is_dir():
+
+                # Mods may either be directly in the mods folder (i.e. contained within a folder for each such mod,
+                # but nothing more). A mod needs a mod_info.txt to be valid.
+                if os.path.isfile(top_directory.path + "/mod_info.txt"):
+                    mod_paths.append(top_directory.path)
+
+                # Or mods may be part of a "modpack", containing a modpack_info.txt and multiple such mod folders.
+                # The mod folders of a modpack are only looked for again if the modpack folder changed.
+                elif os.path.isfile(top_directory.path + "/modpack_info.txt"):
+                    modpack_state = self.modpack_folder_states.get(top_directory.path)
+                    if modpack_state is None or modpack_state[0] != top_directory.stat().st_mtime_ns:
+                        modpack_state = (top_directory.stat().st_mtime_ns,
+                                         self.find_modpack_mod_folders(top_directory.path))
+                    modpack_folder_states[top_directory.path] = modpack_state
+                    mod_paths += modpack_state[1]
+                else:
+                    print(top_directory.path + " is not neither a valid mod nor a valid modpack - it lacks "
+                                               "mod_info.txt / modpack_info.txt")
+        self.modpack_folder_states = modpack_folder_states
+        return mod_paths
+
+    def find_modpack_mod_folders(self, modpack_path):
+        mod_paths = []
+        for mod_directory in sorted(os.scandir(modpack_path), key=lambda entry: entry.name):
+            if mod_directory.is_dir():
+                if os.path.isfile(mod_directory.path + "/mod_info.txt"):
+                    mod_paths.append(mod_directory.path)
+                else:
+                    print(mod_directory.path + " is not neither a valid mod nor a valid modpack - "
+                                               "it lacks mod_info.txt")
+        return mod_paths
+
+
+def read_mod_info(path):
+    # returns the contents of the mod_info.txt of a mod folder, as arguments for Mod()
+    with open(path + "/mod_info.txt", "r", encoding="latin1") as mod_info_file:
+        return {"name": mod_info_file.readline().replace("name:", "").replace("\n", ""),
+                "version": mod_info_file.readline().replace("version:", "").replace("\n", ""),
+                "creator": mod_info_file.readline().replace("creator:", "").replace("\n", ""),
+                "df_version": mod_info_file.readline().replace("df_version:", "").replace("\n", ""),
+                "description_string": mod_info_file.readline().replace("description_string:", ""),
+                "dependencies_string": mod_info_file.readline().replace("dependencies_string:", ""),
+                "path": path}
+
+
+def get_mod_folder_state(mod_path):
+    # the modification times of a mod folder, its /objects folder (if any) and its mod_info.txt
+    objects_mtime = None
+    if os.path.isdir(mod_path + "/objects"):
+        objects_mtime = os.stat(mod_path + "/objects").st_mtime_ns
+    return (os.stat(mod_path).st_mtime_ns, objects_mtime, os.stat(mod_path + "/mod_info.txt").st_mtime_ns)
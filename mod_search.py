@@ -0,0 +1,72 @@
+trigram_length = 3
+
+
+class ModSearchIndex:
+    # An index of the mods for the GUI's search box, which searches their name, creator, DF version and description.
+    # A search matches the mods whose text contains every word of it, ignoring case.
+    # Each trigram (three characters in a row) is mapped to the mods whose text contains it, so a search only has to
+    # look through the mods that contain all trigrams of its words. Typing mostly narrows the search, so a search that
+    # contains every word of the previous one only looks through the mods the previous one matched.
+
+    def __init__(self):
+        # mod => the (lowercase) text it is indexed by
+        self.mod_texts = {}
+        # trigram => set of mods whose text contains it
+        self.trigram_mods = {}
+        # the words and matches of the last search
+        self.last_words = None
+        self.last_matches = None
+
+    def update(self, mods):
+        # indexes the mods whose text changed since the last update (or that are new), and forgets those not in mods
+        mod_texts = {mod: get_search_text(mod) for mod in mods}
+        for mod, text in self.mod_texts.items():
+            if mod_texts.get(mod) != text:
+                for trigram in get_trigrams(text):
+                    trigram_mods = self.trigram_mods[trigram]
+                    trigram_mods.discard(mod)
+                    if len(trigram_mods) == 0:
+                        del self.trigram_mods[trigram]
+        for mod, text in mod_texts.items():
+            if self.mod_texts.get(mod) != text:
+                for trigram in get_trigrams(text):
+                    self.trigram_mods.setdefault(trigram, set()).add(mod)
+        self.mod_texts = mod_texts
+        self.last_words = None
+        self.last_matches = None
+
+    def search(self, query):
+        # returns the set of mods that match the query
+        words = query.lower().split()
+        if self.last_words is not None and all(any(last_word in word for word in words)
+                                               for last_word in self.last_words):
+            # every mod that matches is one of those that matched the last search
+            candidates = self.last_matches
+        else:
+            candidates = self.mod_texts.keys()
+
+        # intersects the mods of the rarest trigrams first, as that leaves the fewest mods to intersect with the others
+        trigram_mods = [self.trigram_mods.get(trigram, set()) for word in words for trigram in get_trigrams(word)]
+        trigram_mods.sort(key=len)
+        for mods in trigram_mods:
+            if len(candidates) == 0:
+                break
+            if len(mods) < len(candidates):
+                candidates = {mod for mod in mods if mod in candidates}
+            else:
+                candidates = {mod for mod in candidates if mod in mods}
+
+        # trigrams don't tell in which order they are in the text, and words shorter than a trigram have none
+        matches = {mod for mod in candidates if all(word in self.mod_texts[mod] for word in words)}
+        self.last_words = words
+        self.last_matches = matches
+        return matches
+
+
+def get_search_text(mod):
+    # the fields are separated by newlines, so no word of a search can match across two of them
+    return "\n".join([mod.name, mod.creator, mod.df_version, mod.description_string]).lower()
+
+
+def get_trigrams(text):
+    return {text[i:i + trigram_length] for i in range(len(text) - trigram_length + 1)}
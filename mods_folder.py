@@ -0,0 +1,57 @@
+import os
+import json
+from raw_handler import Mod
+from mod_registry import ModRegistry
+from mod_registry import read_mod_info
+
+# Finding mods in a mods folder and reading their mod_info.txt, without any GUI.
+# The GUI keeps a mod_registry.ModRegistry instead, to keep track of already loaded and missing mods between reloads.
+
+
+def load_mod(path):
+    # reads the mod_info.txt of a mod folder
+    return Mod(**read_mod_info(path))
+
+
+def find_mods(mods_path):
+    # returns the mods in mods_path, sorted by folder name
+    mod_registry = ModRegistry(mods_path)
+    mod_registry.reload()
+    return mod_registry.get_mods()
+
+
+def read_load_order(load_order_path):
+    # Returns the mod names in a load order file, first mod first.
+    # The file is either a JSON list of mod names, or a JSON object with such a list as "mods",
+    # or (if not ending in .json) a text file with one mod name per line, where empty lines and lines starting
+    # with "#" are ignored. A mod name is either the name and version as shown in the GUI (e.g.
+    # "Vanilla Dwarf Fortress 0.47.05"), just the name, or the name of the mod's folder.
+    with open(load_order_path, "r", encoding="utf-8") as load_order_file:
+        if load_order_path.lower().endswith(".json"):
+            load_order = json.load(load_order_file)
+            if type(load_order) == dict:
+                load_order = load_order.get("mods")
+            if type(load_order) != list or any(type(mod_name) != str for mod_name in load_order):
+                raise ValueError(load_order_path + " should contain a list of mod names, "
+                                                   "or an object with a list of mod names as \"mods\".")
+            return load_order
+        return [line.strip() for line in load_order_file
+                if line.strip() != "" and not line.strip().startswith("#")]
+
+
+def get_mods_in_load_order(mods, load_order):
+    # returns the mods named by load_order (see read_load_order()) in that order,
+    # and a list of the names that didn't match any mod
+    ordered_mods = []
+    missing_mod_names = []
+    for mod_name in load_order:
+        for matches in [lambda mod: mod.name + " " + mod.version == mod_name,
+                        lambda mod: mod.name == mod_name,
+                        lambda mod: os.path.basename(mod.path) == mod_name]:
+            matching_mods = [mod for mod in mods if matches(mod)]
+            if len(matching_mods) != 0:
+                ordered_mods.append(matching_mods[0])
+                break
+        else:
+            missing_mod_names.append(mod_name)
+    return ordered_mods, missing_mod_names
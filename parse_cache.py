@@ -0,0 +1,132 @@
+import os
+import hashlib
+import marshal
+from raw_handler import iter_string_tokens
+from raw_handler import tokenizer_version
+
+# the default size limit of a parse cache, in bytes
+default_max_size = 256 * 1024 * 1024
+
+cache_entry_extension = ".tokens"
+
+
+class ParseCache:
+    # Stores the tokens of raw files on disk, so unchanged files don't have to be tokenized again.
+    # Entries are keyed by a hash of the file contents, meaning identical files (e.g. copies of vanilla files
+    # shipped by several mods) share a single entry. The least recently used entries are evicted when the
+    # cache grows beyond max_size.
+
+    def __init__(self, cache_path, max_size=default_max_size):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        # entries made by another version of the tokenizer can't be trusted, so they are all thrown away
+        version_file_path = self.cache_path + "/version.txt"
+        cached_version = None
+        if os.path.isfile(version_file_path):
+            with open(version_file_path, "r") as version_file:
+                cached_version = version_file.read().strip()
+        if cached_version != str(tokenizer_version):
+            self.clear()
+            with open(version_file_path, "w") as version_file:
+                version_file.write(str(tokenizer_version))
+
+        # sizes of all entries, and their last access time (the mtime of the entry file) for the LRU eviction
+        self.entry_sizes = {}
+        self.entry_access_times = {}
+        for entry in os.scandir(self.cache_path):
+            if entry.name.endswith(cache_entry_extension):
+                key = entry.name[:-len(cache_entry_extension)]
+                stat = entry.stat()
+                self.entry_sizes[key] = stat.st_size
+                self.entry_access_times[key] = stat.st_mtime
+        self.total_size = sum(self.entry_sizes.values())
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_tokens(self, file_string):
+        # returns the tokens of file_string (the contents of a raw file), from the cache if possible
+        tokens = self.get_cached_tokens(file_string)
+        if tokens is None:
+            tokens = list(iter_string_tokens(file_string))
+            self.store_tokens(file_string, tokens)
+        return tokens
+
+    def get_cached_tokens(self, file_string):
+        # returns the cached tokens of file_string, or None if they aren't in the cache
+        key = get_key(file_string)
+
+        if key in self.entry_sizes:
+            try:
+                with open(self.entry_path(key), "rb") as entry_file:
+                    tokens = marshal.load(entry_file)
+            except (OSError, EOFError, ValueError, TypeError):
+                # a broken or vanished entry is treated like a miss
+                self.forget_entry(key)
+            else:
+                self.hits += 1
+                self.touch_entry(key)
+                return tokens
+
+        self.misses += 1
+        return None
+
+    def store_tokens(self, file_string, tokens):
+        self.store_entry(get_key(file_string), tokens)
+
+    def entry_path(self, key):
+        return self.cache_path + "/" + key + cache_entry_extension
+
+    def store_entry(self, key, tokens):
+        data = marshal.dumps(tokens)
+        # entries larger than the whole cache are not stored at all
+        if len(data) > self.max_size:
+            return
+        # writes to a temporary file first, so a half-written entry is never read
+        temp_path = self.entry_path(key) + ".tmp"
+        with open(temp_path, "wb") as entry_file:
+            entry_file.write(data)
+        os.replace(temp_path, self.entry_path(key))
+
+        self.total_size += len(data) - self.entry_sizes.get(key, 0)
+        self.entry_sizes[key] = len(data)
+        self.touch_entry(key)
+        self.evict_entries()
+
+    def touch_entry(self, key):
+        # marks the entry as recently used
+        try:
+            os.utime(self.entry_path(key))
+            self.entry_access_times[key] = os.path.getmtime(self.entry_path(key))
+        except OSError:
+            self.forget_entry(key)
+
+    def forget_entry(self, key):
+        if key in self.entry_sizes:
+            self.total_size -= self.entry_sizes.pop(key)
+            self.entry_access_times.pop(key, None)
+        if os.path.isfile(self.entry_path(key)):
+            os.remove(self.entry_path(key))
+
+    def evict_entries(self):
+        # removes the least recently used entries until the cache fits within max_size
+        if self.total_size <= self.max_size:
+            return
+        for key in sorted(self.entry_access_times, key=self.entry_access_times.get):
+            self.forget_entry(key)
+            if self.total_size <= self.max_size:
+                break
+
+    def clear(self):
+        for entry in os.scandir(self.cache_path):
+            if entry.name.endswith(cache_entry_extension) or entry.name.endswith(cache_entry_extension + ".tmp"):
+                os.remove(entry.path)
+        self.entry_sizes = {}
+        self.entry_access_times = {}
+        self.total_size = 0
+
+
+def get_key(file_string):
+    return hashlib.sha1(file_string.encode("latin1")).hexdigest()
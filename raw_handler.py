@@ -1,7 +1,14 @@
 import os
-import copy
-import shutil
+import sys
+import pickle
+import marshal
+import time
+import hashlib
+import bisect
+import itertools
+import concurrent.futures
 import regex as re
+from backup_store import BackupStore
 
 object_types = {"BODY_DETAIL_PLAN": ["BODY_DETAIL_PLAN"],
                 "BODY": ["BODY",
@@ -83,6 +90,42 @@ header_load_order = ["o_template",
                      "interaction",
                      "edit"]
 
+# matches a single token, capturing everything between its brackets
+token_pattern = re.compile(r"\[([^\]]*)\]")
+# matches the same as token_pattern, but also captures the token name separately, see iter_lazy_tokens()
+lazy_token_pattern = re.compile(r"\[(([^\]:]*)[^\]]*)\]")
+# matches an object template argument ("!ARG" followed by its number), see insert_arguments()
+argument_pattern = re.compile(r"!ARG(\d+)")
+# matches a BODY_DETAIL_PLAN token, capturing its object ID, see SyntaxUpdater.update_body_detail_plan()
+body_detail_plan_pattern = re.compile(r"\[BODY_DETAIL_PLAN:([^\[\]]*)\]")
+# matches a BODY_DETAIL_PLAN token used by a creature, see SyntaxUpdater.convert_body_detail_plan_tokens()
+body_detail_plan_use_pattern = re.compile(r"\[BODY_DETAIL_PLAN:[^\]]*[\]:]")
+# the patterns for removing tokens, keyed by the tuple of token names, see get_token_removal_patterns()
+token_removal_patterns = {}
+# should be increased whenever the output of the tokenizer changes, as it invalidates cached tokens
+tokenizer_version = 2
+# should be increased whenever the Compiler's output (or the format of its build state) changes for the same input,
+# as it invalidates build states
+compiler_version = 8
+
+# compiles with fewer raw files than this are read in a single process, as starting worker processes takes time
+parallel_read_min_files = 32
+# the same for syntax updates
+parallel_syntax_update_min_files = 8
+
+# how many object template expansions the Compiler keeps, see Compiler.expand_object_template()
+max_cached_template_expansions = 4096
+
+# RawObjects with fewer tokens than this are scanned instead of indexing their token positions,
+# see RawObject.get_token_positions()
+min_indexed_token_count = 64
+# the positions of a RawObject's tokens are found again once more than this many shifts of them are logged (and more
+# than the square root of the token count), see TokenPositions
+min_token_shifts = 16
+
+# a TokenRope with more segments than this is flattened before inserting in it, see TokenRope.open_buffer()
+max_rope_segments = 64
+
 special_tokens = ["GO_TO_END", "GO_TO_START", "GO_TO_TAG", "COPY_TAGS_FROM", "REMOVE_OBJECT",
                   "USE_OBJECT_TEMPLATE"]
 
@@ -90,6 +133,9 @@ object_template_tokens = ["OT_ADD_TAG", "OT_REMOVE_TAG", "OT_CONVERT_TAG",
                           "OTCT_TARGET", "OTCT_REPLACEMENT",
                           "OT_ADD_CTAG", "OT_REMOVE_CTAG", "OT_CONVERT_CTAG"]
 
+# objects with any of these tokens have to be compiled token by token, see LazyRawObject
+lazy_special_token_names = set(special_tokens + object_template_tokens)
+
 # for the SyntaxUpdater
 creature_variation_tokens = ["CV_ADD_TAG", "CV_NEW_TAG", "CV_REMOVE_TAG", "CV_CONVERT_TAG",
                              "CVCT_MASTER", "CVCT_TARGET", "CVCT_REPLACEMENT",
@@ -127,12 +173,21 @@ file_disclaimer2 = "The syntax updater is not strictly needed for the modloader
 
 # ====== classes  ===========================================================================================
 
+class CompileCancelled(Exception):
+    # raised by the Compiler and SyntaxUpdater when their cancel_event is set, see Compiler.report_progress()
+    pass
+
+
 class RawObject:
+    # there are a lot of RawObjects, so they use __slots__ to save memory
+    __slots__ = ["object_id", "_tokens", "token_name_counts", "token_positions", "source_file_name",
+                 "source_mod_name_and_version", "is_removed"]
 
     def __init__(self, object_id, tokens=None,
                  source_file_name=None, source_mod_name_and_version=None,
                  is_removed=False):
         self.object_id = object_id
+        # setting self.tokens also builds self.token_name_counts, see RawObject.tokens
         if tokens is None:
             self.tokens = []
         else:
@@ -141,79 +196,610 @@ class RawObject:
         self.source_mod_name_and_version = source_mod_name_and_version
         self.is_removed = is_removed
 
+    # The tokens are indexed in two ways:
+    # self.token_name_counts, a count of how many tokens of each name the object has. This lets lookups and removals
+    # of tokens the object doesn't have (the common case, e.g. when an object template removes a tag) return at once.
+    # self.token_positions, the positions of the tokens of each name (see TokenPositions), so lookups and removals of
+    # tokens the object does have only look at the tokens of that name. It is only built once such lookups are done,
+    # see RawObject.get_token_positions().
+    # To keep the indexes up to date, tokens should only be added/removed using the methods below,
+    # or by setting self.tokens to a new list.
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens
+        self.token_name_counts = {}
+        for token in tokens:
+            self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        self.token_positions = None
+
+    def get_token_positions(self, token_name):
+        # returns the (ascending) positions of the tokens named token_name, which must not be changed
+        if not self.token_positions:
+            if self.token_positions is None or len(self._tokens) < min_indexed_token_count:
+                # Small objects, and objects that are only looked up once (most of them), are scanned faster than
+                # the index would be built. self.token_positions is False after the first lookup, so the index is
+                # built on the next one.
+                self.token_positions = False
+                return [i for i, token in enumerate(self._tokens) if token[0] == token_name]
+            self.token_positions = TokenPositions(self._tokens)
+        elif self.token_positions.is_outdated(len(self._tokens)):
+            self.token_positions = TokenPositions(self._tokens)
+        return self.token_positions.get(token_name)
+
+    def append_token(self, token):
+        self._tokens.append(token)
+        self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        if self.token_positions:
+            self.token_positions.add(token[0], len(self._tokens) - 1)
+
+    def insert_token(self, index, token):
+        self._tokens.insert(index, token)
+        self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        if self.token_positions:
+            self.token_positions.insert(get_insertion_index(index, len(self._tokens) - 1), [token], len(self._tokens))
+
+    def insert_tokens(self, index, tokens):
+        self._tokens[index:index] = tokens
+        for token in tokens:
+            self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        if self.token_positions:
+            self.token_positions.insert(get_insertion_index(index, len(self._tokens) - len(tokens)), tokens,
+                                        len(self._tokens))
+
     def has_token(self, ask_token):
         # takes either a string; checks for a token of that name
         if type(ask_token) == str:
-            for token in self.tokens:
-                if token[0] == ask_token:
-                    return True
-            return False
-        # or a list (of strings); checks for a token of that name and those leading values.
+            return ask_token in self.token_name_counts
+        # or a list/tuple (of strings); checks for a token of that name and those leading values.
         # e.g. ask_token=["BODY", "QUADRUPED_NECK"] returns True for the vanilla toad raws, as those include
         #      "[BODY:QUADRUPED_NECK:2_EYES:...:RIBCAGE]"
-        elif type(ask_token) == list:
-            for token in self.tokens:
-                if token[:len(ask_token)] == ask_token:
+        elif type(ask_token) in [list, tuple]:
+            # tokens are tuples, see iter_string_tokens()
+            ask_token = tuple(ask_token)
+            if len(ask_token) == 0:
+                return len(self._tokens) != 0
+            if ask_token[0] not in self.token_name_counts:
+                return False
+            for position in self.get_token_positions(ask_token[0]):
+                if self._tokens[position][:len(ask_token)] == ask_token:
                     return True
             return False
         else:
-            raise TypeError("Unexpected type for ask_token, ", type(ask_token), ". Expected str or list.")
+            raise TypeError("Unexpected type for ask_token, ", type(ask_token), ". Expected str, list or tuple.")
+
+    def get_token_count(self):
+        return len(self._tokens)
 
     def get_token_values(self, token_name, max_amount="inf"):
-        token_values = []
-        for token in self.tokens:
-            if token[0] == token_name:
-                token_values.append(token[1:])
-            if len(token_values) == max_amount:
-                return token_values
-        return token_values
+        if token_name not in self.token_name_counts:
+            return []
+        positions = self.get_token_positions(token_name)
+        if max_amount != "inf":
+            positions = positions[:max_amount]
+        return [self._tokens[position][1:] for position in positions]
 
     def get_last_token_value(self, token_name, error_message):
-        try:
-            self.get_token_values(token_name)[-1]
-        except IndexError:
-            # should perhaps be Raise-d instead?
-            print(error_message)
-            return False
+        if token_name in self.token_name_counts:
+            return self._tokens[self.get_token_positions(token_name)[-1]][1:]
+        # should perhaps be Raise-d instead?
+        print(error_message)
+        return False
+
+    def get_token_string_index(self, token_string):
+        # Returns the index of the first token which, joined into a string, starts with token_string, or None.
+        # Such a token's name must be the first part of token_string (or start with it, if that is all there is),
+        # so only the tokens of those names are joined.
+        name_start = token_string.split(":")[0]
+        if ":" in token_string:
+            token_names = [name_start] if name_start in self.token_name_counts else []
         else:
-            return self.get_token_values(token_name)[-1]
+            token_names = get_token_names_starting_with(self.token_name_counts, name_start)
+        first_index = None
+        for token_name in token_names:
+            for position in self.get_token_positions(token_name):
+                if first_index is not None and position >= first_index:
+                    break
+                if ":".join(self._tokens[position]).startswith(token_string):
+                    first_index = position
+                    break
+        return first_index
 
     def remove_token(self, ask_token):
         # returns how many tokens were is_removed, useful for moving an "insertion_index"
-        len_before = len(self.tokens)
-        self.tokens = [token for token in self.tokens
-                       if token[:len(ask_token)] != ask_token]
-        return len_before - len(self.tokens)
+        ask_token = tuple(ask_token)
+        if len(ask_token) == 0:
+            # an empty ask_token matches every token
+            removed_count = len(self._tokens)
+            self.tokens = []
+            return removed_count
+        if ask_token[0] not in self.token_name_counts:
+            return 0
+        positions = [position for position in self.get_token_positions(ask_token[0])
+                     if self._tokens[position][:len(ask_token)] == ask_token]
+        if len(positions) == 0:
+            return 0
+        self.remove_tokens_at(positions)
+        if self.token_positions:
+            self.token_positions.remove(ask_token[0], positions)
+        # all removed tokens share the name ask_token[0]
+        if len(positions) == self.token_name_counts[ask_token[0]]:
+            del self.token_name_counts[ask_token[0]]
+        else:
+            self.token_name_counts[ask_token[0]] -= len(positions)
+        return len(positions)
+
+    def remove_tokens_at(self, positions):
+        # positions should be ascending
+        for position in reversed(positions):
+            del self._tokens[position]
 
     def convert_token(self, master, target, replacement):
         # master should be a list, target and replacement strings
-        for i in range(len(self.tokens)):
+        # (converted tokens keep their name and position, so the indexes stay the same)
+        master = tuple(master)
+        if len(master) == 0:
+            positions = range(len(self._tokens))
+        elif master[0] not in self.token_name_counts:
+            return
+        else:
+            positions = self.get_token_positions(master[0])
+        for i in positions:
             if self.tokens[i][:len(master)] == master:
                 arg_string = ":".join(self.tokens[i][1:])
                 if target in arg_string:
-                    self.tokens[i] = [self.tokens[i][0]] + [arg for arg in
-                                                            arg_string.replace(target, replacement).split(":")
-                                                            if arg != ""]
+                    self.tokens[i] = (self.tokens[i][0],) + tuple(sys.intern(arg) for arg in
+                                                                  arg_string.replace(target, replacement).split(":")
+                                                                  if arg != "")
 
     def tokens_with_arguments_inserted(self, arguments, arg_prefix="!ARG"):
         # returns a list of tokens with arguments inserted
-        new_tokens = copy.copy(self.tokens)
-
         # "|" can be used in arguments as a stand-in for ":"
-        for i in range(len(arguments)):
-            arguments[i] = arguments[i].replace("|", ":")
+        arguments = [argument.replace("|", ":") for argument in arguments]
+
+        # the exclamation args are usually inserted in a single pass, see insert_arguments()
+        if arg_prefix == "!ARG" and not any("!" in argument for argument in arguments):
+            return [insert_arguments(token, arguments) for token in self._tokens]
 
+        new_tokens = list(self.tokens)
         # inserts the exclamation args, in reverse order so that "!ARG1" doesn't take priority over e.g. "!ARG10"
         for i in range(len(arguments)-1, -1, -1):
             arg = arguments[i]
             for j in range(len(new_tokens)):
-                new_tokens[j] = [token_arg.replace(arg_prefix+str(i+1), arg)
-                                 for token_arg in new_tokens[j]]
+                new_tokens[j] = tuple(token_arg.replace(arg_prefix+str(i+1), arg)
+                                      for token_arg in new_tokens[j])
 
         return new_tokens
 
 
+class LazyRawObject(RawObject):
+    # A RawObject read by a Compiler in lazy mode. Its tokens are only split out of its text (see LazyTokens) once
+    # they are needed, e.g. when an EDIT selects it by something other than its ID, or something copies its tags.
+    # Most objects are never needed that way; if one also has no special tokens, it compiles to itself and is
+    # written out from its text, without ever being split into tokens (see LazyRawObject.is_verbatim()).
+    __slots__ = ["texts", "has_special_tokens", "is_split"]
+
+    def __init__(self, object_id, source_file_name=None, source_mod_name_and_version=None):
+        # self._tokens and its indexes are only set once needed, see LazyRawObject.__getattr__()
+        self.object_id = object_id
+        self.texts = []
+        self.has_special_tokens = False
+        self.is_split = False
+        self.source_file_name = source_file_name
+        self.source_mod_name_and_version = source_mod_name_and_version
+        self.is_removed = False
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set,
+        # i.e. self._tokens and its indexes before the tokens have been split out of the text
+        if name != "_tokens" and name != "token_name_counts" and name != "token_positions":
+            raise AttributeError(name)
+        self.split_tokens()
+        return getattr(self, name)
+
+    def __getstate__(self):
+        # for pickling, see CompileCheckpoints; the slots are read without going through __getattr__(),
+        # so that pickling an object doesn't split its tokens out of its text
+        slots = {}
+        for name in RawObject.__slots__ + LazyRawObject.__slots__:
+            try:
+                slots[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return None, slots
+
+    def split_tokens(self):
+        self.tokens = [token for text in self.texts for token in iter_string_tokens(text)]
+        self.is_split = True
+
+    def add_lazy_tokens(self, lazy_tokens):
+        if self.is_split:
+            for token in iter_string_tokens(lazy_tokens.text):
+                self.append_token(token)
+        else:
+            self.texts.append(lazy_tokens.text)
+            self.has_special_tokens = self.has_special_tokens or lazy_tokens.has_special_tokens
+
+    def is_verbatim(self):
+        # whether the tokens are unchanged since they were read, and none of them are special tokens,
+        # meaning the compiled object would have the very same tokens
+        return self.texts is not None and not self.has_special_tokens
+
+    def get_verbatim_string(self):
+        # the tokens as written to a compiled file, made from the text without splitting the tokens
+        return "".join(["\t[" + token_string + "]\n"
+                        for text in self.texts for token_string in token_pattern.findall(text)])
+
+    def forget_texts(self):
+        # called before the tokens are changed, as the text no longer matches them after that
+        if not self.is_split:
+            self.split_tokens()
+        self.texts = None
+
+    def append_token(self, token):
+        self.forget_texts()
+        super().append_token(token)
+
+    def insert_token(self, index, token):
+        self.forget_texts()
+        super().insert_token(index, token)
+
+    def insert_tokens(self, index, tokens):
+        self.forget_texts()
+        super().insert_tokens(index, tokens)
+
+    def remove_token(self, ask_token):
+        self.forget_texts()
+        return super().remove_token(ask_token)
+
+    def convert_token(self, master, target, replacement):
+        self.forget_texts()
+        super().convert_token(master, target, replacement)
+
+
+class TokenPositions:
+    # The positions of the tokens of a RawObject, by token name, see RawObject.get_token_positions().
+    # Inserting or removing a token shifts the positions of all tokens after it. Instead of updating all of them, each
+    # shift is logged, and only the positions of the names that are looked up are shifted, when they are looked up.
+    # Once more shifts are logged than the square root of the token count (or min_token_shifts, if more), the positions
+    # are found again instead (see RawObject.get_token_positions()), which keeps both costs well below a full scan.
+    __slots__ = ["positions", "shifts", "synced_shift_counts"]
+
+    def __init__(self, tokens):
+        # token name => ascending positions
+        self.positions = {}
+        for position, token in enumerate(tokens):
+            positions = self.positions.get(token[0])
+            if positions is None:
+                self.positions[token[0]] = [position]
+            else:
+                positions.append(position)
+        # (index, delta) for each shift, meaning every position at or after index was moved by delta
+        self.shifts = []
+        # token name => how many of self.shifts its positions have been shifted by (none, if it isn't in here)
+        self.synced_shift_counts = {}
+
+    def is_outdated(self, token_count):
+        return len(self.shifts) > min_token_shifts and len(self.shifts) ** 2 > token_count
+
+    def get(self, token_name):
+        positions = self.positions.get(token_name)
+        if positions is None:
+            return []
+        for index, delta in self.shifts[self.synced_shift_counts.get(token_name, 0):]:
+            i = bisect.bisect_left(positions, index)
+            if i != len(positions):
+                positions[i:] = [position + delta for position in positions[i:]]
+        self.synced_shift_counts[token_name] = len(self.shifts)
+        return positions
+
+    def insert(self, index, tokens, token_count):
+        # called after tokens have been inserted at index, making token_count tokens;
+        # if they were appended, no position is shifted
+        if index + len(tokens) != token_count:
+            self.shifts.append((index, len(tokens)))
+        for i in range(len(tokens)):
+            self.add(tokens[i][0], index + i)
+
+    def add(self, token_name, position):
+        positions = self.positions.get(token_name)
+        if positions is None:
+            self.positions[token_name] = [position]
+            self.synced_shift_counts[token_name] = len(self.shifts)
+            return
+        if self.synced_shift_counts.get(token_name, 0) != len(self.shifts):
+            positions = self.get(token_name)
+        # tokens are mostly inserted after all others of their name
+        if positions[-1] < position:
+            positions.append(position)
+        else:
+            bisect.insort(positions, position)
+
+    def remove(self, token_name, removed_positions):
+        # called after the tokens at removed_positions (ascending), all named token_name, have been removed
+        removed_positions_set = set(removed_positions)
+        positions = [position for position in self.get(token_name) if position not in removed_positions_set]
+        if len(positions) == 0:
+            del self.positions[token_name]
+            del self.synced_shift_counts[token_name]
+        else:
+            self.positions[token_name] = positions
+        # from the last to the first, so each is where the token was when it was removed;
+        # the remaining positions of token_name are shifted by them the next time they are looked up
+        for position in reversed(removed_positions):
+            self.shifts.append((position + 1, -1))
+
+
+class LazyTokens:
+    # The text of the tokens in (a part of) the body of an object, yielded by iter_lazy_tokens() instead of the
+    # tokens themselves. It starts at the first token and ends at the last, so tokens never span two of them.
+    __slots__ = ["text", "has_special_tokens"]
+
+    def __init__(self, text, has_special_tokens):
+        self.text = text
+        self.has_special_tokens = has_special_tokens
+
+
+class TokenRope:
+    # The tokens of a compiled object, stored as a list of segments (lists or tuples of tokens).
+    # Segments are never changed once done, so they can be shared between objects; an object that copies the tags
+    # of another (COPY_TAGS_FROM) just gets the other's segments, instead of a copy of all its tokens.
+    # The one segment that is changed is the "buffer", which tokens inserted within it are inserted into.
+    # Since the compiler mostly inserts each token right after the one before, this is usually an append to a
+    # short list, instead of a list insertion that moves all tokens after it.
+    # Removing tokens copies only the segments they are in; converting tokens joins all segments into a new buffer.
+    __slots__ = ["segments", "length", "buffer", "buffer_position", "buffer_start"]
+
+    def __init__(self, tokens=()):
+        self.segments = []
+        if len(tokens) != 0:
+            self.segments.append(tokens)
+        self.length = len(tokens)
+        # the buffer, its position in self.segments, and the index of its first token
+        self.buffer = None
+        self.buffer_position = 0
+        self.buffer_start = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.segments)
+
+    def __reversed__(self):
+        for segment in reversed(self.segments):
+            yield from reversed(segment)
+
+    def __getitem__(self, index):
+        # only for an index of a token, e.g. from RawObject.get_token_positions()
+        for segment in self.segments:
+            if index < len(segment):
+                return segment[index]
+            index -= len(segment)
+        raise IndexError("token index out of range")
+
+    def insert(self, index, token):
+        if self.buffer is None or not self.buffer_start <= index <= self.buffer_start + len(self.buffer):
+            self.open_buffer(index)
+        self.buffer.insert(index - self.buffer_start, token)
+        self.length += 1
+
+    def insert_tokens(self, index, tokens):
+        if self.buffer is None or not self.buffer_start <= index <= self.buffer_start + len(self.buffer):
+            self.open_buffer(index)
+        self.buffer[index - self.buffer_start:index - self.buffer_start] = tokens
+        self.length += len(tokens)
+
+    def insert_rope(self, index, rope):
+        # inserts the tokens of another rope, sharing its segments
+        rope.close_buffer()
+        self.open_buffer(index)
+        self.segments[self.buffer_position:self.buffer_position] = rope.segments
+        self.buffer_position += len(rope.segments)
+        self.buffer_start += rope.length
+        self.length += rope.length
+
+    def open_buffer(self, index):
+        # starts a new buffer at index, splitting the segment there if needed
+        # index is handled like list.insert() does, e.g. a negative index counts from the end
+        if index < 0:
+            index = max(0, index + self.length)
+        elif index > self.length:
+            index = self.length
+        self.close_buffer()
+        if len(self.segments) > max_rope_segments:
+            self.segments = [tuple(self)]
+
+        position = len(self.segments)
+        start = 0
+        for i in range(len(self.segments)):
+            segment = self.segments[i]
+            if index == start:
+                position = i
+                break
+            if index < start + len(segment):
+                self.segments[i:i + 1] = [segment[:index - start], segment[index - start:]]
+                position = i + 1
+                break
+            start += len(segment)
+
+        self.buffer = []
+        self.segments.insert(position, self.buffer)
+        self.buffer_position = position
+        self.buffer_start = index
+
+    def replace_with_buffer(self, tokens):
+        # makes tokens (a new list) the only segment, and the buffer
+        self.segments = [tokens]
+        self.length = len(tokens)
+        self.buffer = tokens
+        self.buffer_position = 0
+        self.buffer_start = 0
+
+    def close_buffer(self):
+        if self.buffer is not None:
+            if len(self.buffer) == 0:
+                del self.segments[self.buffer_position]
+            self.buffer = None
+
+    def remove_positions(self, positions):
+        # removes the tokens at positions (ascending); the segments they are in are copied without them
+        self.close_buffer()
+        segments = []
+        i = 0
+        start = 0
+        for segment in self.segments:
+            end = start + len(segment)
+            if i == len(positions) or positions[i] >= end:
+                segments.append(segment)
+            else:
+                kept_tokens = []
+                kept_start = 0
+                while i < len(positions) and positions[i] < end:
+                    kept_tokens += segment[kept_start:positions[i] - start]
+                    kept_start = positions[i] - start + 1
+                    i += 1
+                kept_tokens += segment[kept_start:]
+                if len(kept_tokens) != 0:
+                    segments.append(tuple(kept_tokens))
+            start = end
+        self.segments = segments
+        self.length -= len(positions)
+
+    def convert(self, positions, master, target, replacement):
+        # see RawObject.convert_token(), positions are those of the tokens that might be converted
+        tokens = None
+        for i in positions:
+            token = self[i]
+            if token[:len(master)] == master:
+                arg_string = ":".join(token[1:])
+                if target in arg_string:
+                    if tokens is None:
+                        tokens = list(self)
+                    tokens[i] = (token[0],) + tuple(sys.intern(arg) for arg in
+                                                    arg_string.replace(target, replacement).split(":")
+                                                    if arg != "")
+        if tokens is not None:
+            self.replace_with_buffer(tokens)
+
+    def flatten(self):
+        # joins all segments into one tuple, and returns it
+        self.close_buffer()
+        if len(self.segments) == 0:
+            return ()
+        if len(self.segments) != 1 or type(self.segments[0]) != tuple:
+            self.segments = [tuple(self)]
+        return self.segments[0]
+
+
+class CompiledRawObject(RawObject):
+    # A RawObject whose tokens are stored in a TokenRope, for compiled objects and object templates.
+    # Its tokens are only joined into a single tuple (see TokenRope.flatten()) when self.tokens is read,
+    # i.e. when it is written to the output or stored in the build state.
+    __slots__ = []
+
+    @property
+    def tokens(self):
+        return self._tokens.flatten()
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = TokenRope(tokens)
+        self.token_name_counts = {}
+        for token in tokens:
+            self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        self.token_positions = None
+
+    def append_token(self, token):
+        self.insert_token(len(self._tokens), token)
+
+    def insert_token(self, index, token):
+        # appending to the buffer is by far the most common case, so it is done here directly
+        rope = self._tokens
+        if self.token_positions:
+            index = get_insertion_index(index, len(rope))
+        if rope.buffer is not None and index == rope.buffer_start + len(rope.buffer):
+            rope.buffer.append(token)
+            rope.length += 1
+        else:
+            rope.insert(index, token)
+        self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        if self.token_positions:
+            self.token_positions.insert(index, [token], len(rope))
+
+    def insert_tokens(self, index, tokens):
+        index = get_insertion_index(index, len(self._tokens))
+        self._tokens.insert_tokens(index, tokens)
+        for token in tokens:
+            self.token_name_counts[token[0]] = self.token_name_counts.get(token[0], 0) + 1
+        if self.token_positions:
+            self.token_positions.insert(index, tokens, len(self._tokens))
+
+    def insert_tokens_of(self, index, raw_object):
+        # inserts all tokens of the (compiled) raw_object, sharing them if possible, and returns how many they were
+        if type(raw_object._tokens) != TokenRope:
+            self.insert_tokens(index, raw_object.tokens)
+            return len(raw_object.tokens)
+        self._tokens.insert_rope(index, raw_object._tokens)
+        for token_name, count in raw_object.token_name_counts.items():
+            self.token_name_counts[token_name] = self.token_name_counts.get(token_name, 0) + count
+        # the shared tokens aren't gone through, so their positions are found once they are needed
+        self.token_positions = None
+        return len(raw_object._tokens)
+
+    def remove_tokens_at(self, positions):
+        self._tokens.remove_positions(positions)
+
+    def convert_token(self, master, target, replacement):
+        # see RawObject.convert_token()
+        master = tuple(master)
+        if len(master) == 0:
+            # every token might be converted, so they are joined into one segment first to look them up faster
+            self._tokens.flatten()
+            positions = range(len(self._tokens))
+        elif master[0] not in self.token_name_counts:
+            return
+        else:
+            positions = self.get_token_positions(master[0])
+        self._tokens.convert(positions, master, target, replacement)
+
+
+class CountedRawObject(CompiledRawObject):
+    # a RawObject which counts the list inserts and removes done to its tokens,
+    # only used for compiled objects when the Compiler has metrics, see compile_metrics.py
+    __slots__ = ["inserted_count", "removed_count"]
+
+    def __init__(self, *args, **kwargs):
+        self.inserted_count = 0
+        self.removed_count = 0
+        super().__init__(*args, **kwargs)
+
+    def insert_token(self, index, token):
+        self.inserted_count += 1
+        super().insert_token(index, token)
+
+    def insert_tokens(self, index, tokens):
+        self.inserted_count += 1
+        super().insert_tokens(index, tokens)
+
+    def insert_tokens_of(self, index, raw_object):
+        self.inserted_count += 1
+        return super().insert_tokens_of(index, raw_object)
+
+    def remove_token(self, ask_token):
+        removed_count = super().remove_token(ask_token)
+        if removed_count != 0:
+            self.removed_count += 1
+        return removed_count
+
+
 class Mod:
+    __slots__ = ["name", "version", "creator", "df_version", "description_string", "dependencies_string", "path",
+                 "file_names"]
 
     def __init__(self, name, version, creator, df_version,
                  description_string, dependencies_string,
@@ -240,6 +826,145 @@ class Mod:
             self.file_names = []
 
 
+class SelectionIndex:
+    # An index of the normal objects of one object type, used to select objects by the criteria of
+    # EDIT, PLUS_SELECT and UNSELECT without going through every object for every criterion.
+    # Objects are referred to by their position, i.e. the order they were added in, so that selections keep the
+    # order of the objects.
+
+    def __init__(self, objects=None):
+        self.objects = []
+        self.positions = {}
+        self.positions_by_id = {}
+        # OBJECT_CLASS and CREATURE_CLASS values
+        self.positions_by_class = {}
+        # token names; these may also list objects which no longer have a token of that name (e.g. after
+        # REMOVE_SPEC_TAG), so they are only used to narrow down which objects to check
+        self.positions_by_token_name = {}
+        # positions of LazyRawObjects whose tokens haven't been indexed yet; only selecting by ID doesn't need them,
+        # so they are indexed on the first selection by anything else
+        self.unindexed_positions = set()
+        if objects is not None:
+            for raw_object in objects:
+                self.add_object(raw_object)
+
+    def add_object(self, raw_object):
+        position = len(self.objects)
+        self.objects.append(raw_object)
+        self.positions[raw_object] = position
+        self.positions_by_id.setdefault(raw_object.object_id, set()).add(position)
+        if type(raw_object) == LazyRawObject and raw_object.texts is not None:
+            self.unindexed_positions.add(position)
+            return
+        for token in raw_object.tokens:
+            self.add_token_at_position(position, token)
+
+    def add_token(self, raw_object, token):
+        # should be called when a token is added to an already indexed object
+        # (unindexed objects get all their tokens indexed later, including this one)
+        if raw_object in self.positions:
+            self.add_token_at_position(self.positions[raw_object], token)
+
+    def index_unindexed_objects(self):
+        for position in self.unindexed_positions:
+            for token in self.objects[position].tokens:
+                self.add_token_at_position(position, token)
+        self.unindexed_positions = set()
+
+    def index_object(self, raw_object):
+        # indexes the tokens an already added object has now, if they haven't been indexed yet
+        # (an object may have been added more than once, at different positions)
+        for position in self.positions_by_id.get(raw_object.object_id, ()):
+            if position in self.unindexed_positions and self.objects[position] is raw_object:
+                self.unindexed_positions.remove(position)
+                for token in raw_object.tokens:
+                    self.add_token_at_position(position, token)
+
+    def add_token_at_position(self, position, token):
+        self.positions_by_token_name.setdefault(token[0], set()).add(position)
+        if len(token) == 2 and token[0] in ["OBJECT_CLASS", "CREATURE_CLASS"]:
+            self.positions_by_class.setdefault(token[1], set()).add(position)
+
+    def select(self, criteria):
+        # Returns the objects matching all the criteria, in order. Each criterion gives a set of candidate positions,
+        # and optionally a check the candidates must also pass. The criteria with the fewest candidates are applied
+        # first, and the rest only have to check the positions that are still selected.
+        if len(criteria) == 0:
+            print("Error found at unknown location in your raws: selection criteria missing.")
+
+        if criteria[0] == "ALL":
+            return list(self.objects)
+
+        if len(self.unindexed_positions) != 0 and \
+                any(criterion in ["SEL_BY_CLASS", "SEL_BY_TAG", "SEL_BY_TAG_PRECISE"] for criterion in criteria):
+            self.index_unindexed_objects()
+
+        selectors = []
+        for i in range(len(criteria)):
+            # selects a single object
+            if criteria[i] == "SEL_BY_ID":
+                selectors.append((self.positions_by_id.get(criteria[i + 1], set()), None))
+            # selects multiple objects
+            # ...by object class
+            elif criteria[i] == "SEL_BY_CLASS":
+                selectors.append((self.positions_by_class.get(criteria[i + 1], set()), None))
+            # ...by token (and any amount of leading values)
+            elif criteria[i] == "SEL_BY_TAG":
+                token_values = get_selection_token_values(criteria, i)
+                if len(token_values) == 0:
+                    selectors.append((range(len(self.objects)), lambda raw_object: len(raw_object.tokens) != 0))
+                else:
+                    selectors.append((self.positions_by_token_name.get(token_values[0], set()),
+                                      lambda raw_object, token_values=token_values:
+                                      raw_object.has_token(token_values)))
+            # ...by precise token (i.e. like "by token", but instead of leading values, the values specified are the
+            #                      *only* values;
+            #                      SELECT_BY_TAG_PRECISE:BODY:QUADRUPED_NECK won't select the vanilla toad raws,
+            #                      as the toad's BODY token continues after QUADRUPED_NECK.)
+            elif criteria[i] == "SEL_BY_TAG_PRECISE":
+                token_values = get_selection_token_values(criteria, i)
+                print(token_values)
+                if len(token_values) == 0:
+                    selectors.append((set(), None))
+                else:
+                    selectors.append((self.positions_by_token_name.get(token_values[0], set()),
+                                      lambda raw_object, token_values=tuple(token_values):
+                                      token_values in raw_object.tokens))
+
+        if len(selectors) == 0:
+            return list(self.objects)
+
+        selectors.sort(key=lambda selector: len(selector[0]))
+        selected_positions = None
+        for candidate_positions, check in selectors:
+            if selected_positions is None:
+                selected_positions = candidate_positions
+            else:
+                selected_positions = [position for position in selected_positions if position in candidate_positions]
+            if check is not None:
+                selected_positions = [position for position in selected_positions if check(self.objects[position])]
+            if len(selected_positions) == 0:
+                return []
+
+        # returns the objects that matched the criteria
+        return [self.objects[position] for position in sorted(selected_positions)]
+
+
+def new_build_state():
+    return {"compiler_version": compiler_version,
+            "build_fingerprint": None,
+            "objects": {},
+            "files": {},
+            "output_files": {}}
+
+
+def fingerprint(value):
+    # a hash of some (marshallable) value, e.g. a list of tokens.
+    # marshal version 2 is used because later versions write shared objects as references, which depends on
+    # the objects' identities and not just their values.
+    return hashlib.sha1(marshal.dumps(value, 2)).hexdigest()
+
+
 def init_raw_dict_of_dicts():
     return {object_type: {}
             for object_type in
@@ -247,6 +972,13 @@ def init_raw_dict_of_dicts():
             [val for sublist in object_types.values() for val in sublist]}
 
 
+def init_selection_indexes():
+    return {object_type: SelectionIndex()
+            for object_type in
+            # this just flattens the list of object_types.values()
+            [val for sublist in object_types.values() for val in sublist]}
+
+
 def init_raw_dict_of_lists():
     return {object_type: []
             for object_type in
@@ -256,13 +988,45 @@ def init_raw_dict_of_lists():
 
 class Compiler:
 
-    def __init__(self):
+    def __init__(self, parse_cache=None, build_state_path=None, workers=1, metrics=None,
+                 progress_callback=None, cancel_event=None, manifest_cache=None, lazy_objects=False, checkpoints=None):
+        # an optional ParseCache (see parse_cache.py), to avoid tokenizing unchanged files again
+        self.parse_cache = parse_cache
+        # In lazy mode, the tokens of objects are only split out of the raw files when needed, and objects that
+        # aren't changed by anything are written out as they were read, see LazyRawObject.
+        # The files are then read as text, so the parse cache and parallel reading aren't used.
+        self.lazy_objects = lazy_objects
+        # an optional ManifestCache (see mod_manifest.py), to sort the files of mods without opening them
+        self.manifest_cache = manifest_cache
+        # optional CompileCheckpoints (see compile_checkpoints.py), to skip reading the mods at the start of the
+        # load order if they were read the same way in an earlier compile, see Compiler.read_mods()
+        self.checkpoints = checkpoints
+        # how many processes to read and tokenize raw files with, see Compiler.read_files_in_parallel()
+        self.workers = workers
+        # an optional path to store the build state (the object dependency graph and compiled objects) in,
+        # so the next compile only has to recompile objects whose inputs changed, see Compiler.load_build_state()
+        self.build_state_path = build_state_path
+        self.previous_build_state = new_build_state()
+        self.build_state = new_build_state()
+        # fingerprints of the compiled objects and object templates, keyed by (object_type, object_id)
+        self.compiled_object_fingerprints = {}
+        self.compiled_object_template_fingerprints = {}
+        self.recompiled_objects_count = 0
+        # an optional CompileMetrics (see compile_metrics.py), to find out what makes a compile slow
+        self.metrics = metrics
+        # for running in a worker thread, see Compiler.report_progress()
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+
         # normally it's nicer to be able to refer to objects using ID, so a dictionary of dictionaries is preferred
         self.normal_objects = init_raw_dict_of_dicts()
         # however, there is also a list version containing the same objects,
         # so they can be outputted/written in a nice order (i.e. purely for the aesthetics of the output files)
         self.normal_objects_lists = init_raw_dict_of_lists()
 
+        # indexes of the normal objects of each object type, used to select them for EDITs, see SelectionIndex
+        self.selection_indexes = init_selection_indexes()
+
         # object templates only have a dict-of-dicts, because they are not outputted to files
         self.object_templates = init_raw_dict_of_dicts()
 
@@ -276,30 +1040,220 @@ class Compiler:
         # an anti recursion loop measure
         self.currently_compiling_ids = []
 
-    def compile_mods(self, mods, output_path):
+        # the tokens of expanded object templates, keyed by (object_type, template_id, is_object_template, arguments),
+        # see Compiler.expand_object_template()
+        self.template_expansions = {}
 
-        # goes through each mod, see Compiler.read_mod_raws() for most of the raw handling
-        for i in range(len(mods)):
-            print("reading mod " + str(i + 1) + "/" + str(len(mods)), mods[i].name)
-            self.read_mod_raws_and_apply_edit_objects(mods[i])
+    def compile_mods(self, mods, output_path):
 
+        if self.build_state_path is not None:
+            self.load_build_state()
+            # with manifests of the mods, a compile of exactly the same mods as the last time can be skipped entirely
+            if self.manifest_cache is not None:
+                build_fingerprint = self.get_build_fingerprint(mods, output_path)
+                if self.previous_build_state["build_fingerprint"] == build_fingerprint and \
+                        all(self.is_output_file_unchanged(file_path)
+                            for file_path in self.previous_build_state["output_files"]):
+                    print("nothing has changed since the last compile")
+                    return
+                self.build_state["build_fingerprint"] = build_fingerprint
+
+        start_time = time.perf_counter()
+        self.read_mods(mods)
+        if self.metrics is not None:
+            self.metrics.record_phase("read", time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
         self.apply_special_tokens_to_create_compiled_objects()
+        if self.metrics is not None:
+            self.metrics.record_phase("apply_special_tokens", time.perf_counter() - start_time)
 
+        start_time = time.perf_counter()
         self.write_compiled_objects(output_path)
+        if self.metrics is not None:
+            self.metrics.record_phase("write", time.perf_counter() - start_time)
+
+        if self.build_state_path is not None:
+            self.save_build_state()
+
+    def get_build_fingerprint(self, mods, output_path):
+        # A hash of everything the output depends on; the compiler version, the output folder, and the mods in load
+        # order, with the names, order and contents of their files (see ModManifest.get_fingerprint()).
+        return fingerprint((compiler_version, os.path.abspath(output_path),
+                            [(mod.name, mod.version, mod.path, mod.file_names,
+                              self.manifest_cache.get_manifest(mod).get_fingerprint()) for mod in mods]))
+
+    def is_output_file_unchanged(self, file_path):
+        # whether an output file is still the way the previous compile left it (or still absent, if it removed it)
+        if file_path not in self.previous_build_state["output_files"]:
+            return False
+        output_file = self.previous_build_state["output_files"][file_path]
+        if output_file["hash"] is None:
+            return not os.path.exists(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return stat.st_size == output_file["size"] and stat.st_mtime_ns == output_file["mtime_ns"]
+
+    def read_mods(self, mods):
+        # With checkpoints, reading starts from the state after the longest start of the load order that was read
+        # before (and whose files haven't changed since), so only the mods after it are read.
+        first_mod_index = 0
+        if self.checkpoints is not None:
+            checkpoint_keys = self.get_checkpoint_keys(mods)
+            checkpoint_positions = self.checkpoints.get_checkpoint_positions(len(mods))
+            first_mod_index = self.resume_from_checkpoint(checkpoint_keys)
+
+        # sorts the files of each mod according to the first line in the file (not file name!)
+        if self.manifest_cache is None:
+            sorted_file_names_by_mod = [sort_file_names(mod) for mod in mods[first_mod_index:]]
+        else:
+            sorted_file_names_by_mod = [sort_file_names(mod, self.manifest_cache.get_manifest(mod))
+                                        for mod in mods[first_mod_index:]]
 
-    def read_mod_raws_and_apply_edit_objects(self, mod):
+        # Reading and tokenizing the files doesn't depend on the load order, so it can be done in parallel.
+        # Applying the results (and EDITs) does, so that is still done one mod and file at a time below.
+        files_tokens_by_mod = [None] * len(sorted_file_names_by_mod)
+        if self.workers > 1 and not self.lazy_objects and \
+                sum(len(file_names) for file_names in sorted_file_names_by_mod) >= parallel_read_min_files:
+            files_tokens_by_mod = self.read_files_in_parallel(mods[first_mod_index:], sorted_file_names_by_mod)
+
+        # goes through each mod, see Compiler.read_mod_raws() for most of the raw handling
+        for i in range(first_mod_index, len(mods)):
+            print("reading mod " + str(i + 1) + "/" + str(len(mods)), mods[i].name)
+            self.report_progress("read", i, len(mods), mods[i].name + " " + mods[i].version)
+            self.read_mod_raws_and_apply_edit_objects(mods[i], sorted_file_names_by_mod[i - first_mod_index],
+                                                      files_tokens_by_mod[i - first_mod_index])
+            if self.checkpoints is not None and i + 1 in checkpoint_positions:
+                self.checkpoints.store_state(checkpoint_keys[i], self.get_read_state())
+
+    def get_checkpoint_keys(self, mods):
+        # The key of the checkpoint after each number of mods. Each key is a hash of the one before and the mod, with
+        # its files and their contents (or, without manifests, their sizes and modification times), so a key
+        # only matches if all mods up to it are the same, in the same order, with the same files.
+        if self.manifest_cache is None:
+            mod_contents = [[(file_name, os.stat(mod.path + "/objects/" + file_name).st_size,
+                              os.stat(mod.path + "/objects/" + file_name).st_mtime_ns)
+                             for file_name in mod.file_names] for mod in mods]
+        else:
+            mod_contents = [self.manifest_cache.get_manifest(mod).get_fingerprint() for mod in mods]
+
+        checkpoint_keys = []
+        key = fingerprint((compiler_version, tokenizer_version, self.lazy_objects))
+        for mod, contents in zip(mods, mod_contents):
+            key = fingerprint((key, mod.name, mod.version, mod.path, mod.file_names, contents))
+            checkpoint_keys.append(key)
+        return checkpoint_keys
+
+    def resume_from_checkpoint(self, checkpoint_keys):
+        # restores the state of the longest checkpoint there is, and returns how many mods it is after
+        for mods_count in range(len(checkpoint_keys), 0, -1):
+            state = self.checkpoints.get_state(checkpoint_keys[mods_count - 1])
+            if state is not None:
+                print("resuming from the checkpoint after " + str(mods_count) + " mods")
+                self.set_read_state(state)
+                return mods_count
+        return 0
+
+    def get_read_state(self):
+        # everything reading the mods changes, see Compiler.__init__()
+        return self.normal_objects, self.normal_objects_lists, self.selection_indexes, self.object_templates
+
+    def set_read_state(self, state):
+        self.normal_objects, self.normal_objects_lists, self.selection_indexes, self.object_templates = state
+
+    def report_progress(self, phase, index, count, name):
+        # Tells the progress_callback that item index (counting from 0) of count is about to be handled in phase,
+        # and raises CompileCancelled if the cancel_event has been set. The phases are "read" (mods),
+        # "read_file" (files of the mod being read), "apply_special_tokens" (object types) and "write" (output files).
+        # The output files are only written once they have all been rendered, so cancelling leaves them untouched.
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CompileCancelled()
+        if self.progress_callback is not None:
+            self.progress_callback(phase, index, count, name)
+
+    def load_build_state(self):
+        # The build state of the previous compile holds, for each compiled object, a fingerprint of its
+        # uncompiled tokens (which includes all EDITs applied to it) and source file, the objects and object templates
+        # it depends on through COPY_TAGS_FROM and USE_OBJECT_TEMPLATE, and its compiled tokens.
+        # An object whose fingerprint and dependencies are unchanged doesn't have to be compiled again.
+        if not os.path.isfile(self.build_state_path):
+            return
+        try:
+            with open(self.build_state_path, "rb") as build_state_file:
+                build_state = pickle.load(build_state_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            print("Could not read the build state " + self.build_state_path + ", compiling everything.")
+            return
+        if build_state.get("compiler_version") == compiler_version:
+            self.previous_build_state = build_state
+
+    def save_build_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.build_state_path)), exist_ok=True)
+        temp_path = self.build_state_path + ".tmp"
+        with open(temp_path, "wb") as build_state_file:
+            pickle.dump(self.build_state, build_state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.build_state_path)
+
+    def read_files_in_parallel(self, mods, sorted_file_names_by_mod):
+        # returns the tokens of each file of each mod, in the same order as sorted_file_names_by_mod.
+        # The files are read here, and files that aren't in the parse cache are tokenized in a pool of processes.
+        file_strings = []
+        for mod, sorted_file_names in zip(mods, sorted_file_names_by_mod):
+            for file_name in sorted_file_names:
+                with open(mod.path + "/objects/" + file_name, "r", encoding="latin1") as raw_file:
+                    file_strings.append(raw_file.read())
+
+        files_tokens = [None] * len(file_strings)
+        if self.parse_cache is not None:
+            for i in range(len(file_strings)):
+                files_tokens[i] = self.parse_cache.get_cached_tokens(file_strings[i])
+        uncached_indexes = [i for i in range(len(file_strings)) if files_tokens[i] is None]
+
+        print("tokenizing " + str(len(uncached_indexes)) + " files using " + str(self.workers) + " processes")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            uncached_tokens = executor.map(split_string_into_marshalled_tokens,
+                                           [file_strings[i] for i in uncached_indexes],
+                                           chunksize=max(1, len(uncached_indexes) // (self.workers * 4)))
+            for i, marshalled_tokens in zip(uncached_indexes, uncached_tokens):
+                files_tokens[i] = marshal.loads(marshalled_tokens)
+                if self.parse_cache is not None:
+                    self.parse_cache.store_tokens(file_strings[i], files_tokens[i])
+
+        # splits the flat list back up by mod
+        files_tokens_by_mod = []
+        start = 0
+        for sorted_file_names in sorted_file_names_by_mod:
+            files_tokens_by_mod.append(files_tokens[start:start + len(sorted_file_names)])
+            start += len(sorted_file_names)
+        return files_tokens_by_mod
+
+    def read_mod_raws_and_apply_edit_objects(self, mod, sorted_file_names=None, files_tokens=None):
 
         # sorts the files according to the first line in the file (not file name!)
-        sorted_file_names = sort_file_names(mod)
+        if sorted_file_names is None:
+            sorted_file_names = sort_file_names(mod)
 
         # goes through each file of the mod, in the sorted order
         for i in range(len(sorted_file_names)):
-            # opens the file and splits it into tokens
             print("\treading file " + str(i + 1) + "/" + str(len(sorted_file_names)), sorted_file_names[i])
             file_name = sorted_file_names[i]
-            raw_file = open(mod.path + "/objects/" + file_name, "r", encoding="latin1")
-            raw_file_tokens = split_file_into_tokens(raw_file)
-            raw_file.close()
+            self.report_progress("read_file", i, len(sorted_file_names), file_name)
+            file_start_time = time.perf_counter()
+            if files_tokens is not None:
+                # the file has already been read and tokenized, see Compiler.read_files_in_parallel()
+                raw_file = None
+                raw_file_tokens = files_tokens[i]
+            else:
+                # opens the file, its tokens are streamed from it below (or taken from the parse cache)
+                raw_file = open(mod.path + "/objects/" + file_name, "r", encoding="latin1")
+                if self.lazy_objects:
+                    raw_file_tokens = iter_lazy_tokens(raw_file.read())
+                elif self.parse_cache is None:
+                    raw_file_tokens = iter_tokens(raw_file)
+                else:
+                    raw_file_tokens = self.parse_cache.get_tokens(raw_file.read())
 
             # initially it doesn't know what object types to expect
             # and it has to know, because e.g. "COLOR" is both an object type and a common token elsewhere.
@@ -317,8 +1271,18 @@ class Compiler:
             convert_target = None
 
             # goes through all tokens
-            for j in range(len(raw_file_tokens)):
-                token = raw_file_tokens[j]
+            for token, is_last_token in iter_with_last(raw_file_tokens):
+                # in lazy mode, the tokens of a new object come as a LazyTokens, see iter_lazy_tokens()
+                if type(token) == LazyTokens:
+                    # Tokens are only added to an object which has already been added after an invalid EDIT or
+                    # OBJECT_TEMPLATE token in it. Then its tokens are indexed first, as they would have been
+                    # when it was added, see SelectionIndex.add_object().
+                    self.selection_indexes[current_object_type].index_object(current_objects[0])
+                    current_objects[0].add_lazy_tokens(token)
+                    if is_last_token:
+                        self.add_normal_object(current_object_type, current_objects[0])
+                    continue
+
                 # the "OBJECT" token tells it what object types to expect
                 if token[0] == "OBJECT":
                     pos_object_types = object_types[token[1]]
@@ -328,14 +1292,14 @@ class Compiler:
 
                     # non-EDIT objects are just read through and stored in this step
                     if reading_mode in "NEW":
-                        current_objects[0].tokens.append(token)
+                        current_objects[0].append_token(token)
 
                     elif reading_mode in "OT":
                         if token[0] in object_template_tokens:
-                            current_objects[0].tokens.append(token)
+                            current_objects[0].append_token(token)
                         else:
                             # normal tokens are read as OT_ADD_TAGs
-                            current_objects[0].tokens.append(["OT_ADD_TAG"] + token)
+                            current_objects[0].append_token(("OT_ADD_TAG",) + token)
 
                     # EDIT-objects are applied here
                     elif reading_mode == "EDIT":
@@ -347,20 +1311,17 @@ class Compiler:
                         # [EDIT:CREATURE:SEL_BY_CLASS:MAMMAL:SEL_BY_CLASS:POISONOUS] which only selects creatures that are
                         # both mammals *and* poisonous - the platypus and its variants (in vanilla).
                         if token[0] == "PLUS_SELECT":
-                            current_objects += select_objects_by_criteria(self.normal_objects_lists[current_object_type],
-                                                                          token[1:])
+                            current_objects += self.select_objects(current_object_type, token, 1, mod, file_name)
                         # UNSELECT also uses the same same kind of criteria as EDIT, but instead unselects those objects.
                         # e.g [EDIT:CREATURE:SEL_BY_CLASS:MAMMAL][UNSELECT:SEL_BY_ID:PIG] selects all mammals but the pig
                         elif token[0] == "UNSELECT":
+                            unselected_objects = set(self.select_objects(current_object_type, token, 1, mod, file_name))
                             current_objects = [raw_object for raw_object in current_objects
-                                               if raw_object not in
-                                               select_objects_by_criteria(self.normal_objects_lists[current_object_type],
-                                                                          token[1:])]
+                                               if raw_object not in unselected_objects]
 
                         elif token[0] == "ADD_SPEC_TAG":
                             if token[1] in special_tokens:
-                                for co in current_objects:
-                                    co.tokens.append(token[1:])
+                                self.append_token_to_objects(current_object_type, current_objects, token[1:])
                             else:
                                 print("Unknown special token ", token[1], " is not compatible with ADD_SPEC_TAG.")
 
@@ -394,23 +1355,19 @@ class Compiler:
 
                         # copies over special tokens and ov tokens
                         elif token[0] in special_tokens or token[0] in object_template_tokens:
-                            for co in current_objects:
-                                co.tokens.append(token)
+                            self.append_token_to_objects(current_object_type, current_objects, token)
 
                         # copies over normal tokens as OT_ADD_TAGs
                         else:
-                            for co in current_objects:
-                                co.tokens.append(["OT_ADD_TAG"] + token)
+                            self.append_token_to_objects(current_object_type, current_objects, ("OT_ADD_TAG",) + token)
 
                 # if it finds a new object or it is the last line in the file
-                if token[0] in pos_object_types + ["EDIT", "OBJECT_TEMPLATE"] or j == len(raw_file_tokens) - 1:
+                if token[0] in pos_object_types + ["EDIT", "OBJECT_TEMPLATE"] or is_last_token:
                     # finishes the current object before starting to read the next one
                     if reading_mode == "NEW":
                         # you can only define one new object at a time, thus current_objects just has one element
                         # when reading_mode == "NEW".
-                        co = current_objects[0]
-                        self.normal_objects_lists[current_object_type].append(co)
-                        self.normal_objects[current_object_type][co.object_id] = co
+                        self.add_normal_object(current_object_type, current_objects[0])
 
                     elif reading_mode == "OT":
                         co = current_objects[0]
@@ -421,16 +1378,19 @@ class Compiler:
                     if token[0] in pos_object_types and pos_object_types != ["OBJECT_TEMPLATE"]:
                         # always the same, regardless of kind of raw entry ("NEW", "EDIT" or whatever)
                         current_object_type = token[0]
-                        current_objects = [RawObject(token[1], source_file_name=file_name,
-                                                     source_mod_name_and_version=mod.name + " " + mod.version)]
+                        if self.lazy_objects:
+                            current_objects = [LazyRawObject(token[1], source_file_name=file_name,
+                                                             source_mod_name_and_version=mod.name + " " + mod.version)]
+                        else:
+                            current_objects = [RawObject(token[1], source_file_name=file_name,
+                                                         source_mod_name_and_version=mod.name + " " + mod.version)]
                         reading_mode = "NEW"
 
                     # start of an EDIT object
                     elif token[0] == "EDIT":
                         if token[1] in pos_object_types or pos_object_types == ["EDIT"]:
                             current_object_type = token[1]
-                            current_objects = select_objects_by_criteria(self.normal_objects_lists[current_object_type],
-                                                                         token[2:])
+                            current_objects = self.select_objects(current_object_type, token, 2, mod, file_name)
                             reading_mode = "EDIT"
 
                             # print(":".join(token))
@@ -447,9 +1407,37 @@ class Compiler:
                         else:
                             print("Invalid file for " + ":".join(token) + "; " + file_name)
 
+            if raw_file is not None:
+                raw_file.close()
+            if self.metrics is not None:
+                self.metrics.record_file(mod.name + " " + mod.version, file_name,
+                                         time.perf_counter() - file_start_time)
+
+    def add_normal_object(self, object_type, raw_object):
+        self.normal_objects_lists[object_type].append(raw_object)
+        self.normal_objects[object_type][raw_object.object_id] = raw_object
+        self.selection_indexes[object_type].add_object(raw_object)
+
+    def select_objects(self, object_type, token, criteria_start, mod, file_name):
+        # selects objects for an EDIT, PLUS_SELECT or UNSELECT token, see SelectionIndex.select()
+        if self.metrics is None:
+            return self.selection_indexes[object_type].select(token[criteria_start:])
+        start_time = time.perf_counter()
+        selected_objects = self.selection_indexes[object_type].select(token[criteria_start:])
+        self.metrics.record_selection(mod.name + " " + mod.version, file_name, ":".join(token),
+                                      len(selected_objects), time.perf_counter() - start_time)
+        return selected_objects
+
+    def append_token_to_objects(self, object_type, raw_objects, token):
+        # appends the token to each of the (EDIT-selected) objects, keeping their selection index up to date
+        for raw_object in raw_objects:
+            raw_object.append_token(token)
+            self.selection_indexes[object_type].add_token(raw_object, token)
+
     def apply_special_tokens_to_create_compiled_objects(self):
         print("applying object templates etc.")
-        for object_type in self.normal_objects_lists:
+        for i, object_type in enumerate(self.normal_objects_lists):
+            self.report_progress("apply_special_tokens", i, len(self.normal_objects_lists), object_type)
 
             # first object templates
             for object_template in self.object_templates[object_type].values():
@@ -474,14 +1462,14 @@ class Compiler:
         # co for "current object"
         co = self.object_templates[object_type][object_id]
 
-        output_object = RawObject(co.object_id, source_file_name=co.source_file_name,
-                                  source_mod_name_and_version=co.source_mod_name_and_version)
+        output_object = CompiledRawObject(co.object_id, source_file_name=co.source_file_name,
+                                          source_mod_name_and_version=co.source_mod_name_and_version)
         insertion_index = 0
 
         for token in co.tokens:
 
             if token[0] == "GO_TO_END":
-                insertion_index = len(output_object.tokens)
+                insertion_index = output_object.get_token_count()
 
             elif token[0] == "GO_TO_START":
                 insertion_index = 0
@@ -489,11 +1477,9 @@ class Compiler:
             # This is how GO_TO_TAG works in vanilla, strangely.
             # It goes to just before the target tag, and it looks for a string starting that way instead of full tokens.
             elif token[0] == "GO_TO_TAG":
-                goto_tag_string = ":".join(token[1:])
-                for i in range(len(output_object.tokens)):
-                    if ":".join(output_object.tokens[i]).startswith(goto_tag_string):
-                        insertion_index = i
-                        break
+                goto_tag_index = output_object.get_token_string_index(":".join(token[1:]))
+                if goto_tag_index is not None:
+                    insertion_index = goto_tag_index
 
             elif token[0] == "COPY_TAGS_FROM":
                 if self.can_get_raw_object(object_type, token[1], False):
@@ -507,18 +1493,20 @@ class Compiler:
                             raise RecursionError("COPY_TAGS_FROM loop with " + object_type + " objects "
                                                  ", ".join(self.currently_compiling_ids) + ".")
                     # note that it inserts arguments here
-                    copy_tokens = self.compiled_objects[object_type][token[1]].tokens_with_arguments_inserted(token[2:])
-                    output_object.tokens = output_object.tokens[:insertion_index] + \
-                                           copy_tokens + \
-                                           output_object.tokens[insertion_index:]
+                    copy_tokens = self.expand_object_template(self.compiled_objects[object_type][token[1]],
+                                                              object_type, False, token[2:])
+                    output_object.insert_tokens(insertion_index, copy_tokens)
                     insertion_index += len(copy_tokens)
 
             # non-special tokens
             else:
-                output_object.tokens.insert(insertion_index, token)
+                output_object.insert_token(insertion_index, token)
                 insertion_index += 1
 
         self.compiled_object_templates[object_type][object_id] = output_object
+        if self.build_state_path is not None:
+            self.compiled_object_template_fingerprints[(object_type, object_id)] = \
+                fingerprint((output_object.object_id, output_object.tokens))
         # removes the object's id when it is done
         self.currently_compiling_ids.remove(object_id)
 
@@ -532,9 +1520,42 @@ class Compiler:
 
         # co for "current object"
         co = self.normal_objects[object_type][object_id]
-
-        output_object = RawObject(co.object_id, source_file_name=co.source_file_name,
-                                  source_mod_name_and_version=co.source_mod_name_and_version)
+        if self.metrics is not None:
+            self.metrics.object_started()
+
+        # An object read in lazy mode which nothing has changed, and has no special tokens, compiles to itself.
+        # This is checked before the build state, as re-using the object from it would split its tokens.
+        if type(co) == LazyRawObject and co.is_verbatim():
+            self.recompiled_objects_count += 1
+            self.compiled_objects[object_type][object_id] = co
+            self.compiled_objects_lists[object_type].append(co)
+            if self.build_state_path is not None:
+                # (without a raw fingerprint, as there is nothing to re-use)
+                self.record_compiled_object(object_type, co, None, [])
+            if self.metrics is not None:
+                self.metrics.object_finished(object_type, co, 0, 0)
+            self.currently_compiling_ids.remove(object_id)
+            return
+
+        # with a build state from an earlier compile, unchanged objects re-use their compiled tokens
+        if self.build_state_path is not None:
+            raw_fingerprint = fingerprint((co.source_mod_name_and_version, co.source_file_name, co.tokens))
+            if self.reuse_compiled_object(object_type, co, raw_fingerprint):
+                if self.metrics is not None:
+                    self.metrics.object_finished(object_type, self.compiled_objects[object_type][object_id], 0, 0)
+                self.currently_compiling_ids.remove(object_id)
+                return
+        self.recompiled_objects_count += 1
+
+        # (kind, object_id, fingerprint) of each object or object template this object depends on
+        dependencies = []
+
+        if self.metrics is None:
+            output_object = CompiledRawObject(co.object_id, source_file_name=co.source_file_name,
+                                              source_mod_name_and_version=co.source_mod_name_and_version)
+        else:
+            output_object = CountedRawObject(co.object_id, source_file_name=co.source_file_name,
+                                             source_mod_name_and_version=co.source_mod_name_and_version)
         insertion_index = 0
         # for object template converts
         convert_master = None
@@ -557,7 +1578,7 @@ class Compiler:
                     convert_master = None
 
             if token[0] == "GO_TO_END":
-                insertion_index = len(output_object.tokens)
+                insertion_index = output_object.get_token_count()
 
             elif token[0] == "GO_TO_START":
                 insertion_index = 0
@@ -565,11 +1586,9 @@ class Compiler:
             # This is how GO_TO_TAG works in vanilla, strangely.
             # It goes to just before the target tag, and it looks for a string starting that way instead of full tokens.
             elif token[0] == "GO_TO_TAG":
-                goto_tag_string = ":".join(token[1:])
-                for i in range(len(output_object.tokens)):
-                    if ":".join(output_object.tokens[i]).startswith(goto_tag_string):
-                        insertion_index = i
-                        break
+                goto_tag_index = output_object.get_token_string_index(":".join(token[1:]))
+                if goto_tag_index is not None:
+                    insertion_index = goto_tag_index
 
             elif token[0] == "COPY_TAGS_FROM":
                 if self.can_get_raw_object(object_type, token[1], False):
@@ -581,11 +1600,11 @@ class Compiler:
                         else:
                             raise RecursionError("COPY_TAGS_FROM loop with " + object_type + " objects "
                                                  ", ".join(self.currently_compiling_ids) + ".")
-                    copy_tokens = self.compiled_objects[object_type][token[1]].tokens
-                    output_object.tokens = output_object.tokens[:insertion_index] + \
-                                           copy_tokens + \
-                                           output_object.tokens[insertion_index:]
-                    insertion_index += len(copy_tokens)
+                    # the tokens are shared with the copied object, see TokenRope
+                    insertion_index += output_object.insert_tokens_of(insertion_index,
+                                                                      self.compiled_objects[object_type][token[1]])
+                dependencies.append(("COPY_TAGS_FROM", token[1],
+                                     self.compiled_object_fingerprints.get((object_type, token[1]))))
 
             elif token[0] == "REMOVE_OBJECT":
                 output_object.is_removed = True
@@ -594,9 +1613,11 @@ class Compiler:
                 # print("used object template!!!", output_object.object_id, token[1])
                 insertion_index = self.use_object_template(output_object, insertion_index,
                                                            object_type, token[1], token[2:])
+                dependencies.append(("USE_OBJECT_TEMPLATE", token[1],
+                                     self.compiled_object_template_fingerprints.get((object_type, token[1]))))
 
             elif token[0] == "OT_ADD_TAG":
-                output_object.tokens.insert(insertion_index, token[1:])
+                output_object.insert_token(insertion_index, token[1:])
                 insertion_index += 1
 
             elif token[0] == "OT_REMOVE_TAG":
@@ -607,14 +1628,97 @@ class Compiler:
 
             # non-special tokens
             elif convert_master is None:
-                output_object.tokens.insert(insertion_index, token)
+                output_object.insert_token(insertion_index, token)
                 insertion_index += 1
 
         self.compiled_objects[object_type][object_id] = output_object
         self.compiled_objects_lists[object_type].append(output_object)
+        if self.build_state_path is not None:
+            self.record_compiled_object(object_type, output_object, raw_fingerprint, dependencies)
+        if self.metrics is not None:
+            self.metrics.object_finished(object_type, output_object,
+                                         output_object.inserted_count, output_object.removed_count)
         # removes the object's id when it is done
         self.currently_compiling_ids.remove(object_id)
 
+    def reuse_compiled_object(self, object_type, co, raw_fingerprint):
+        # returns True if the compiled object from the previous build state could be re-used
+        previous = self.previous_build_state["objects"].get((object_type, co.object_id))
+        if previous is None or previous["raw_fingerprint"] != raw_fingerprint:
+            return False
+
+        # the dependencies are checked in the order they were encountered, and COPY_TAGS_FROM sources are compiled
+        # along the way, just like compile_normal_object_using_special_tokens would. This keeps the output order.
+        for kind, dependency_id, dependency_fingerprint in previous["dependencies"]:
+            if kind == "COPY_TAGS_FROM":
+                if self.can_get_raw_object(object_type, dependency_id, False):
+                    if dependency_id not in self.compiled_objects[object_type]:
+                        if dependency_id not in self.currently_compiling_ids:
+                            self.compile_normal_object_using_special_tokens(object_type, dependency_id)
+                        else:
+                            raise RecursionError("COPY_TAGS_FROM loop with " + object_type + " objects "
+                                                 ", ".join(self.currently_compiling_ids) + ".")
+                current_fingerprint = self.compiled_object_fingerprints.get((object_type, dependency_id))
+            else:
+                current_fingerprint = self.compiled_object_template_fingerprints.get((object_type, dependency_id))
+            if current_fingerprint != dependency_fingerprint:
+                return False
+
+        output_object = CompiledRawObject(co.object_id, tokens=previous["tokens"],
+                                          source_file_name=co.source_file_name,
+                                          source_mod_name_and_version=co.source_mod_name_and_version,
+                                          is_removed=previous["is_removed"])
+        self.compiled_objects[object_type][co.object_id] = output_object
+        self.compiled_objects_lists[object_type].append(output_object)
+        self.compiled_object_fingerprints[(object_type, co.object_id)] = previous["fingerprint"]
+        self.build_state["objects"][(object_type, co.object_id)] = previous
+        return True
+
+    def record_compiled_object(self, object_type, output_object, raw_fingerprint, dependencies):
+        # adds a freshly compiled object to the build state
+        if type(output_object) == LazyRawObject and output_object.is_verbatim():
+            # objects compiled to themselves in lazy mode are fingerprinted by their text, so they aren't split
+            # (and have no tokens to re-use, see compile_normal_object_using_special_tokens())
+            tokens = None
+            output_fingerprint = fingerprint((output_object.object_id, output_object.source_mod_name_and_version,
+                                              output_object.source_file_name, output_object.is_removed,
+                                              output_object.texts))
+        else:
+            tokens = tuple(output_object.tokens)
+            output_fingerprint = fingerprint((output_object.object_id, output_object.source_mod_name_and_version,
+                                              output_object.source_file_name, output_object.is_removed, tokens))
+        self.compiled_object_fingerprints[(object_type, output_object.object_id)] = output_fingerprint
+        self.build_state["objects"][(object_type, output_object.object_id)] = {
+            "raw_fingerprint": raw_fingerprint,
+            "source_file_name": output_object.source_file_name,
+            "source_mod_name_and_version": output_object.source_mod_name_and_version,
+            "dependencies": dependencies,
+            "fingerprint": output_fingerprint,
+            "tokens": tokens,
+            "is_removed": output_object.is_removed}
+
+    def expand_object_template(self, object_template, object_type, is_object_template, arguments):
+        # Returns the tokens of the (compiled) object template, or object for COPY_TAGS_FROM in object templates,
+        # with the arguments inserted. The same templates are often used with the same arguments (e.g. material
+        # templates), so the results are kept, up to max_cached_template_expansions of them; the least recently
+        # used are thrown away first. The returned tokens are shared, and must not be changed.
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        key = (object_type, object_template.object_id, is_object_template, tuple(arguments))
+        tokens = self.template_expansions.pop(key, None)
+        if tokens is None:
+            tokens = tuple(object_template.tokens_with_arguments_inserted(arguments))
+            if len(self.template_expansions) >= max_cached_template_expansions:
+                del self.template_expansions[next(iter(self.template_expansions))]
+        # (re)inserted last, as dicts keep their insertion order
+        self.template_expansions[key] = tokens
+
+        if self.metrics is not None:
+            self.metrics.record_template_expansion(object_type, object_template.object_id, len(tokens),
+                                                   time.perf_counter() - start_time)
+        return tokens
+
     def use_object_template(self, target_object, insertion_index, object_type, ot_id, arguments):
         # Object templates are a generalized form of vanilla creature variations, body detail plans, etc.,
         # intended to replace the latter. The syntax is similar to that for vanilla creature variations,
@@ -636,7 +1740,8 @@ class Compiler:
             return insertion_index
 
         # gets the object template tokens
-        ot_tokens = self.compiled_object_templates[object_type][ot_id].tokens_with_arguments_inserted(arguments)
+        ot_tokens = self.expand_object_template(self.compiled_object_templates[object_type][ot_id],
+                                                object_type, True, arguments)
         # for object template converts
         convert_master = None
         convert_target = None
@@ -648,7 +1753,7 @@ class Compiler:
 
             if ot_token[0] == "OT_ADD_TAG":
                 #print(target_object.object_id, ot_id, ot_token)
-                target_object.tokens.insert(insertion_index, ot_token[1:])
+                target_object.insert_token(insertion_index, ot_token[1:])
                 insertion_index += 1
 
             elif ot_token[0] == "OT_REMOVE_TAG":
@@ -664,7 +1769,7 @@ class Compiler:
 
             elif ot_token[0] == "OT_ADD_CTAG":
                 if ctag_correct():
-                    target_object.tokens.insert(insertion_index, ot_token[1:])
+                    target_object.insert_token(insertion_index, ot_token[1:])
                     insertion_index += 1
 
             elif ot_token[0] == "OT_REMOVE_CTAG":
@@ -695,43 +1800,97 @@ class Compiler:
     def write_compiled_objects(self, output_path):
         print("writing to output files")
         # writes the compiled objects into one "_compiled.txt" for each super object type
-        for super_object_type in object_types:
+        compiled_file_paths = []
+        compiled_file_strings = []
+        # with a build state, also the hashes of their contents (or None for files that are removed)
+        compiled_file_hashes = []
+        for i, super_object_type in enumerate(object_types):
+            self.report_progress("write", i, len(object_types), super_object_type)
             # Edits and creature variations are not outputted;
             # as they are custom object types not recognized by DF, and do nothing outside of compilation.
             if super_object_type not in ["EDIT", "OBJECT_TEMPLATE"]:
-                # opens the file for writing
-                compiled_file = open(output_path + "/" + object_type_file_names[super_object_type] + "_compiled.txt",
-                                     "w", encoding="latin1")
-                compiled_file.write(object_type_file_names[super_object_type] + "_compiled" + "\n\n"
-                                                                                              "[OBJECT:" + super_object_type + "]" + "\n")
-
-                objects_in_file_count = 0
-
-                for object_type in object_types[super_object_type]:
-                    # writes each raw object of that object type *in order*
-                    for raw_object in self.compiled_objects_lists[object_type]:
-                        # objects is_removed by REMOVE_OBJECT are skipped
-                        if not raw_object.is_removed:
-                            objects_in_file_count += 1
-                            # a blank line between each object
-                            compiled_file.write("\n")
-                            # the file and mod it came from, for convenience's sake
-                            compiled_file.write(raw_object.source_mod_name_and_version + ", "
-                                                + raw_object.source_file_name + "\n")
-                            # the object "header"
-                            compiled_file.write("[" + object_type + ":" + raw_object.object_id + "]\n")
-                            # and then all its tokens
-                            for token in raw_object.tokens:
-                                compiled_file.write("\t[" + ":".join(token) + "]\n")
-
-                # deletes the file if there were no objects written to it
-                if objects_in_file_count == 0:
-                    compiled_file.close()
-                    os.remove(output_path + "/" + object_type_file_names[super_object_type] + "_compiled.txt")
-                # otherwise writes down the count at the end
+                compiled_file_path = output_path + "/" + object_type_file_names[super_object_type] + "_compiled.txt"
+
+                # with a build state, files whose objects are all unchanged since the last compile aren't rewritten;
+                # the fingerprint is of each object's type, ID and compiled fingerprint, in the order they are written
+                if self.build_state_path is not None:
+                    file_fingerprint = fingerprint([(object_type, raw_object.object_id,
+                                                     self.compiled_object_fingerprints[(object_type,
+                                                                                        raw_object.object_id)])
+                                                    for object_type in object_types[super_object_type]
+                                                    for raw_object in self.compiled_objects_lists[object_type]
+                                                    if not raw_object.is_removed])
+                    self.build_state["files"][compiled_file_path] = file_fingerprint
+                    if self.previous_build_state["files"].get(compiled_file_path) == file_fingerprint and \
+                            self.is_output_file_unchanged(compiled_file_path):
+                        self.build_state["output_files"][compiled_file_path] = \
+                            self.previous_build_state["output_files"][compiled_file_path]
+                        continue
+
+                compiled_file_string = self.render_compiled_file(super_object_type)
+
+                # files whose contents are the same as the last time aren't rewritten either (e.g. when only the
+                # source file of an object changed); this keeps their modification times, for anything syncing them
+                if self.build_state_path is not None:
+                    content_hash = get_content_hash(compiled_file_string)
+                    if self.is_output_file_unchanged(compiled_file_path) and \
+                            self.previous_build_state["output_files"][compiled_file_path]["hash"] == content_hash:
+                        self.build_state["output_files"][compiled_file_path] = \
+                            self.previous_build_state["output_files"][compiled_file_path]
+                        continue
+                    compiled_file_hashes.append(content_hash)
+
+                compiled_file_paths.append(compiled_file_path)
+                compiled_file_strings.append(compiled_file_string)
+
+        # the files are independent of each other, so they are written in parallel
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            # list() so that any exceptions are raised here
+            list(executor.map(write_compiled_file, compiled_file_paths, compiled_file_strings))
+
+        # the written files are recorded, so the next compile can tell whether they have been changed since
+        if self.build_state_path is not None:
+            for compiled_file_path, content_hash in zip(compiled_file_paths, compiled_file_hashes):
+                if content_hash is None:
+                    self.build_state["output_files"][compiled_file_path] = {"hash": None}
                 else:
-                    compiled_file.write("\n" + str(objects_in_file_count) + " raw objects in this compiled file.")
-                    compiled_file.close()
+                    stat = os.stat(compiled_file_path)
+                    self.build_state["output_files"][compiled_file_path] = {"hash": content_hash,
+                                                                            "size": stat.st_size,
+                                                                            "mtime_ns": stat.st_mtime_ns}
+
+    def render_compiled_file(self, super_object_type):
+        # returns the contents of the "_compiled.txt" file of a super object type as a single string,
+        # or None if there are no objects to write to it
+        file_parts = [object_type_file_names[super_object_type] + "_compiled" + "\n\n"
+                      "[OBJECT:" + super_object_type + "]" + "\n"]
+
+        objects_in_file_count = 0
+
+        for object_type in object_types[super_object_type]:
+            # writes each raw object of that object type *in order*
+            for raw_object in self.compiled_objects_lists[object_type]:
+                # objects is_removed by REMOVE_OBJECT are skipped
+                if not raw_object.is_removed:
+                    objects_in_file_count += 1
+                    # a blank line between each object,
+                    # the file and mod it came from, for convenience's sake,
+                    # and the object "header"
+                    file_parts.append("\n" + raw_object.source_mod_name_and_version + ", "
+                                      + raw_object.source_file_name + "\n"
+                                      + "[" + object_type + ":" + raw_object.object_id + "]\n")
+                    # and then all its tokens
+                    if type(raw_object) == LazyRawObject and raw_object.is_verbatim():
+                        file_parts.append(raw_object.get_verbatim_string())
+                    else:
+                        file_parts.append("".join(["\t[" + ":".join(token) + "]\n" for token in raw_object.tokens]))
+
+        # there is no file if there are no objects to write to it
+        if objects_in_file_count == 0:
+            return None
+        # otherwise writes down the count at the end
+        file_parts.append("\n" + str(objects_in_file_count) + " raw objects in this compiled file.")
+        return "".join(file_parts)
 
     def can_get_raw_object(self, object_type, object_id, is_object_template):
         if not is_object_template:
@@ -745,9 +1904,48 @@ class Compiler:
         return True
 
 
-class SyntaxUpdater:
+class LineEdits:
+    # Lines to insert into the lines of a file, collected by the SyntaxUpdater and then inserted all at once by
+    # LineEdits.apply(), instead of building a new list of lines for each insertion.
+    # Positions are those of the lines before any insertion, so insertions don't move each other. Lines inserted
+    # at the same position end up in the order they were inserted, before the line that was at that position.
 
     def __init__(self):
+        # position => the lines to insert there
+        self.insertions = {}
+
+    def insert_lines(self, position, lines):
+        self.insertions.setdefault(position, []).extend(lines)
+
+    def apply(self, lines):
+        # returns the lines with all insertions made
+        new_lines = []
+        previous_position = 0
+        for position in sorted(self.insertions):
+            new_lines += lines[previous_position:position]
+            new_lines += self.insertions[position]
+            previous_position = position
+        new_lines += lines[previous_position:]
+        return new_lines
+
+
+class SyntaxUpdater:
+
+    def __init__(self, progress_callback=None, cancel_event=None, ask_overwrite_backups=None, manifest_cache=None,
+                 workers=1):
+        # for running in a worker thread, like for the Compiler; the phases are "syntax_backup" (mods being backed up),
+        # "syntax_update" (mods) and "syntax_update_file" (files of the mod being updated),
+        # see Compiler.report_progress()
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        # a function asked (once) whether to overwrite existing backups, returning True or False.
+        # Without one, existing backups are kept.
+        self.ask_overwrite_backups = ask_overwrite_backups
+        # an optional ManifestCache (see mod_manifest.py), to sort the files of mods without opening them
+        self.manifest_cache = manifest_cache
+        # how many processes to update the syntax of files with, see SyntaxUpdater.update_files_in_parallel()
+        self.workers = workers
+
         # for the raw file currently being updated
         self.file_path = None
         self.lines = None
@@ -758,60 +1956,163 @@ class SyntaxUpdater:
         self.bdp_templates_ids = []
 
     def update_mods_syntax(self, mods, backup_path):
+        # all mods are backed up before any files are changed
+        self.make_backups(mods, backup_path)
+
+        sorted_file_names_by_mod = []
+        for mod in mods:
+            if self.manifest_cache is None:
+                sorted_file_names_by_mod.append(sort_file_names(mod))
+            else:
+                sorted_file_names_by_mod.append(sort_file_names(mod, self.manifest_cache.get_manifest(mod)))
+
+        if self.workers > 1 and \
+                sum(len(file_names) for file_names in sorted_file_names_by_mod) >= parallel_syntax_update_min_files:
+            self.update_files_in_parallel(mods, sorted_file_names_by_mod)
+            return
 
+        for i in range(len(mods)):
+            mod = mods[i]
+            sorted_file_names = sorted_file_names_by_mod[i]
+            self.report_progress("syntax_update", i, len(mods), mod.name + " " + mod.version)
+
+            # goes through each file of the mod, in the sorted order
+            for j in range(len(sorted_file_names)):
+                print("\treading file " + str(j + 1) + "/" + str(len(sorted_file_names)), sorted_file_names[j])
+                self.report_progress("syntax_update_file", j, len(sorted_file_names), sorted_file_names[j])
+                self.update_file_syntax(mod.path + "/objects/" + sorted_file_names[j], sorted_file_names[j])
+
+    def make_backups(self, mods, backup_path):
+        # the backups are snapshots in a BackupStore, which only stores files that aren't stored already
+        backup_store = BackupStore(backup_path)
         overwrite_backups_decided = False
         overwrite_backups = False
         for i in range(len(mods)):
             mod = mods[i]
-            if os.path.isdir(backup_path + "\\" + mod.name + " " + mod.version):
+            self.report_progress("syntax_backup", i, len(mods), mod.name + " " + mod.version)
+            if backup_store.has_snapshot(mod.name + " " + mod.version):
                 if not overwrite_backups_decided:
-                    if input("Found an existing backup for one of the mods. Do you want to overwrite existing "
-                             "backups?(Y/N) ").lower() == "y":
-                        overwrite_backups = True
-                    else:
-                        overwrite_backups = False
+                    if self.ask_overwrite_backups is not None:
+                        overwrite_backups = self.ask_overwrite_backups()
                     overwrite_backups_decided = True
                 if overwrite_backups:
                     print("Making backup of mod " + str(i + 1) + "/" + str(len(mods)) + ": " +
                           mod.name + " " + mod.version)
-                    shutil.rmtree(backup_path + "\\" + mod.name + " " + mod.version)
-                    shutil.copytree(mod.path, backup_path + "\\" + mod.name + " " + mod.version)
+                    backup_store.store_snapshot(mod)
             else:
                 print("Making backup of mod " + str(i + 1) + "/" + str(len(mods)) + ": " + mod.name + " " + mod.version)
-                shutil.copytree(mod.path, backup_path + "\\" + mod.name + " " + mod.version)
-
-            sorted_file_names = sort_file_names(mod)
-
-            # goes through each file of the mod, in the sorted order
-            for j in range(len(sorted_file_names)):
-                # opens the file and splits it into tokens
-                self.file_name = sorted_file_names[j]
-                print("\treading file " + str(j + 1) + "/" + str(len(sorted_file_names)), self.file_name)
-                self.file_path = mod.path + "/objects/" + self.file_name
-                raw_file = open(self.file_path, "r", encoding="latin1")
-                self.lines = raw_file.readlines()
-                self.tokens = split_lines_into_tokens(self.lines)
-                print(len(self.lines))
-                raw_file.close()
+                backup_store.store_snapshot(mod)
+        backup_store.save_file_hashes()
+        if overwrite_backups:
+            # the files of the overwritten backups may no longer be needed
+            backup_store.remove_unused_objects()
+
+    def update_file_syntax(self, file_path, file_name):
+        # opens the file and splits it into tokens
+        self.file_name = file_name
+        self.file_path = file_path
+        raw_file = open(self.file_path, "r", encoding="latin1")
+        self.lines = raw_file.readlines()
+        self.tokens = split_lines_into_tokens(self.lines)
+        print(len(self.lines))
+        raw_file.close()
 
-                if self.lines[0].startswith("b_detail_plan"):
-                    self.update_body_detail_plan()
+        if self.lines[0].startswith("b_detail_plan"):
+            self.update_body_detail_plan()
 
-                elif self.lines[0].startswith("c_variation"):
-                    print("Handling", self.file_path)
-                    self.update_creature_variation()
+        elif self.lines[0].startswith("c_variation"):
+            print("Handling", self.file_path)
+            self.update_creature_variation()
 
-                elif self.lines[0].startswith("creature"):
-                    #print("Handling", self.file_path)
-                    self.update_creature()
+        elif self.lines[0].startswith("creature"):
+            #print("Handling", self.file_path)
+            self.update_creature()
 
-                raw_file.close()
+    def update_files_in_parallel(self, mods, sorted_file_names_by_mod):
+        # The only thing carried over from one file to the next are the IDs of the body detail plans updated so far,
+        # which creature files need, see SyntaxUpdater.convert_body_detail_plan_tokens().
+        # So first the body detail plan files of all mods are updated in a pool of processes, and then all other
+        # files, each with the IDs as they were after the body detail plan files before it in the load order.
+        # The result is the same as updating the files one at a time.
+        files = []
+        for i in range(len(mods)):
+            for j in range(len(sorted_file_names_by_mod[i])):
+                file_path = mods[i].path + "/objects/" + sorted_file_names_by_mod[i][j]
+                with open(file_path, "r", encoding="latin1") as raw_file:
+                    is_body_detail_plan = raw_file.readline().startswith("b_detail_plan")
+                files.append((i, j, file_path, is_body_detail_plan))
+        bdp_files = [file for file in files if file[3]]
+        other_files = [file for file in files if not file[3]]
+
+        print("updating the syntax of " + str(len(files)) + " files using " + str(self.workers) + " processes")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            bdp_results = self.run_file_syntax_updates(executor, mods, sorted_file_names_by_mod,
+                                                       [(file, [], []) for file in bdp_files])
+
+            # the IDs each other file gets, in load order
+            bdp_results_by_file = dict(zip(bdp_files, bdp_results))
+            bdp_ids_by_file = {}
+            for file in files:
+                if file[3]:
+                    self.bdp_leftovers_ids += bdp_results_by_file[file][0]
+                    self.bdp_templates_ids = bdp_results_by_file[file][1]
+                else:
+                    bdp_ids_by_file[file] = (list(self.bdp_leftovers_ids), self.bdp_templates_ids)
+
+            self.run_file_syntax_updates(executor, mods, sorted_file_names_by_mod,
+                                         [(file,) + bdp_ids_by_file[file] for file in other_files])
+
+    def run_file_syntax_updates(self, executor, mods, sorted_file_names_by_mod, updates):
+        # updates the files of updates ((file, bdp_leftovers_ids, bdp_templates_ids) in load order) in the executor,
+        # and returns the bdp_leftovers_ids and bdp_templates_ids each of them ended up with
+        futures = [executor.submit(update_raw_file_syntax, file[2], sorted_file_names_by_mod[file[0]][file[1]],
+                                   bdp_leftovers_ids, bdp_templates_ids)
+                   for file, bdp_leftovers_ids, bdp_templates_ids in updates]
+        results = []
+        previous_mod_index = None
+        try:
+            for (file, _, _), future in zip(updates, futures):
+                mod_index, file_index = file[0], file[1]
+                if mod_index != previous_mod_index:
+                    self.report_progress("syntax_update", mod_index, len(mods),
+                                         mods[mod_index].name + " " + mods[mod_index].version)
+                    previous_mod_index = mod_index
+                self.report_progress("syntax_update_file", file_index, len(sorted_file_names_by_mod[mod_index]),
+                                     sorted_file_names_by_mod[mod_index][file_index])
+                results.append(future.result())
+        except CompileCancelled:
+            # the files already being updated are finished, so no file is left half-updated
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def report_progress(self, phase, index, count, name):
+        # files are only cancelled between, so no file is left half-updated
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CompileCancelled()
+        if self.progress_callback is not None:
+            self.progress_callback(phase, index, count, name)
 
     def update_body_detail_plan(self):
         # When it comes to body detail plans, sadly they can't be 100% converted to object templates;
         # this is because unlike all other bdp tokens, corresponding creature tokens don't exist for
         # BP_POSITION and BP_RELATION.
 
+        # The objects whose tokens are all removed in the altered bdp file (see below), found before the tokens
+        # are changed for the ot file. The removed tokens are those starting with the name of a convertible token,
+        # see get_token_removal_patterns().
+        bdp_objects = split_tokens_into_raw_objects_simple(self.tokens, "BODY_DETAIL_PLAN",
+                                                           skip_empty_objects=False)
+        moved_ids = set()
+        for bdp_object in bdp_objects:
+            if all(":".join(token).startswith(tuple(convertible_body_detail_plan_tokens))
+                   for token in bdp_object.tokens):
+                print("[BODY_DETAIL_PLAN:" + bdp_object.object_id + "]")
+                moved_ids.add(bdp_object.object_id)
+            else:
+                self.bdp_leftovers_ids.append(bdp_object.object_id)
+
         # First, creates a new object template file and fills it
 
         # gets the relevant objects
@@ -821,16 +2122,16 @@ class SyntaxUpdater:
         # saves their ids in self.bdp_templates_ids
         self.bdp_templates_ids = [ot_object.object_id for ot_object in ot_objects]
         # and writes the ot file
-        ot_file = open(self.file_path.replace("b_detail_plan_", "o_template_bdp_"), "w", encoding="latin1")
-        ot_file.write(self.lines[0].replace("b_detail_plan_", "o_template_bdp_"))
-        ot_file.write(bdp_templates_disclaimer1 + self.file_name +
-                      "\n" + file_disclaimer2)
-        ot_file.write("[OBJECT:OBJECT_TEMPLATE]")
+        ot_lines = []
+        ot_lines.append(self.lines[0].replace("b_detail_plan_", "o_template_bdp_"))
+        ot_lines.append(bdp_templates_disclaimer1 + self.file_name +
+                        "\n" + file_disclaimer2)
+        ot_lines.append("[OBJECT:OBJECT_TEMPLATE]")
         for ot_object in ot_objects:
             # a blank line between each object
-            ot_file.write("\n")
+            ot_lines.append("\n")
             # the object "header"
-            ot_file.write("[OBJECT_TEMPLATE:CREATURE:" + ot_object.object_id + "]\n")
+            ot_lines.append("[OBJECT_TEMPLATE:CREATURE:" + ot_object.object_id + "]\n")
             # and then all its tokens
             for token in ot_object.tokens:
                 # ADD_MATERIAL => USE_MATERIAL_TEMPLATE
@@ -845,43 +2146,39 @@ class SyntaxUpdater:
                 # ARG => !ARG
                 for i in range(len(token)):
                     token[i] = token[i].replace("ARG", "!ARG")
-                ot_file.write("\t[" + ":".join(token) + "]\n")
-        ot_file.flush()
-        ot_file.close()
+                ot_lines.append("\t[" + ":".join(token) + "]\n")
+        write_raw_file(self.file_path.replace("b_detail_plan_", "o_template_bdp_"), ot_lines)
 
         # Second, the original bdp file is altered
 
         # inserts disclaimer
-        self.lines.insert(1, bdp_leftover_disclaimer1 + self.file_name.replace("b_detail_plan_", "o_template_bdp_") +
-                          "\n" + file_disclaimer2)
+        line_edits = LineEdits()
+        line_edits.insert_lines(1, [bdp_leftover_disclaimer1 +
+                                    self.file_name.replace("b_detail_plan_", "o_template_bdp_") +
+                                    "\n" + file_disclaimer2])
+        self.lines = line_edits.apply(self.lines)
         # removes convertible tokens
-        for token in convertible_body_detail_plan_tokens:
-            self.remove_token(token)
+        self.remove_tokens(convertible_body_detail_plan_tokens)
+
         # if an object has no tokens after that, "comments it out" by removing its left bracket
-        self.tokens = split_lines_into_tokens(self.lines)
-        bdp_objects = split_tokens_into_raw_objects_simple(self.tokens, "BODY_DETAIL_PLAN",
-                                                           skip_empty_objects=False)
-        for bdp_object in bdp_objects:
-            if len(bdp_object.tokens) == 0:
-                pattern = re.compile("\[BODY_DETAIL_PLAN:" + bdp_object.object_id + "\]")
-                print("[BODY_DETAIL_PLAN:" + bdp_object.object_id + "]")
-                self.lines = [pattern.sub("BODY_DETAIL_PLAN:" + bdp_object.object_id + "] -moved-", line)
-                              for line in self.lines]
-            else:
-                self.bdp_leftovers_ids.append(bdp_object.object_id)
+        def comment_out(match):
+            if match.group(1) in moved_ids:
+                return "BODY_DETAIL_PLAN:" + match.group(1) + "] -moved-"
+            return match.group(0)
+
+        # all of them in one go
+        if len(moved_ids) != 0:
+            self.lines = [body_detail_plan_pattern.sub(comment_out, line) for line in self.lines]
         # and writes the edited file
-        raw_file = open(self.file_path, "w", encoding="latin1")
-        for line in self.lines:
-            raw_file.write(line)
-        raw_file.flush()
-        raw_file.close()
+        write_raw_file(self.file_path, self.lines)
 
     def update_creature_variation(self):
         # "c_variation_" => "o_template_cv_" (the first line)
         self.lines[0] = self.lines[0].replace("c_variation_", "o_template_cv_")
 
         # inserts disclaimer
-        self.lines.insert(1, syntax_updated_disclaimer1 + file_disclaimer2)
+        line_edits = LineEdits()
+        line_edits.insert_lines(1, [syntax_updated_disclaimer1 + file_disclaimer2])
 
         # gets a string of ot tokens from the cv tokens of each object
         ot_token_line_chunks = self.get_ot_tokens_line_chunks("CREATURE_VARIATION")
@@ -892,14 +2189,16 @@ class SyntaxUpdater:
                 cv_indexes.append(i+1)
         print(ot_token_line_chunks, cv_indexes)
         print(len(ot_token_line_chunks), len(cv_indexes))
-        # inserts the lines starting at the bottom
-        for i in range(len(ot_token_line_chunks)):
-            self.lines = self.lines[:cv_indexes[-i]] + \
-                         ["\t" + line + "\n" for line in ot_token_line_chunks[-i]] + self.lines[cv_indexes[-i]:]
+        # inserts the lines, pairing the chunks and indexes from the bottom up
+        # (the first chunk holds the tokens before the first CREATURE_VARIATION, if there is one more chunk)
+        if len(cv_indexes) != 0:
+            for i in range(len(ot_token_line_chunks)):
+                index = cv_indexes[max(i - len(ot_token_line_chunks) + len(cv_indexes), 0)]
+                line_edits.insert_lines(index, ["\t" + line + "\n" for line in ot_token_line_chunks[i]])
+        self.lines = line_edits.apply(self.lines)
 
         # removes the cv tokens
-        for token_name in creature_variation_tokens:
-            self.remove_token(token_name)
+        self.remove_tokens(creature_variation_tokens)
 
         for i in range(len(self.lines)):
             # OBJECT:CREATURE_VARIATION => OBJECT:OBJECT_TEMPLATE
@@ -911,15 +2210,12 @@ class SyntaxUpdater:
         os.remove(self.file_path)
         self.file_path = self.file_path.replace("c_variation_", "o_template_cv_")
         # and writes the edited file
-        raw_file = open(self.file_path, "w", encoding="latin1")
-        for line in self.lines:
-            raw_file.write(line)
-        raw_file.flush()
-        raw_file.close()
+        write_raw_file(self.file_path, self.lines)
 
     def update_creature(self):
         # inserts disclaimer
-        self.lines.insert(1, syntax_updated_disclaimer1 + file_disclaimer2)
+        line_edits = LineEdits()
+        line_edits.insert_lines(1, [syntax_updated_disclaimer1 + file_disclaimer2])
 
         # APPLY_CREATURE_VARIATION => USE_OBJECT_TEMPLATE
         for i in range(len(self.lines)):
@@ -938,25 +2234,19 @@ class SyntaxUpdater:
                 accv_indexes_and_indentation.append((i, indentation))
         print(ot_token_line_chunks, accv_indexes_and_indentation)
         print(len(ot_token_line_chunks), len(accv_indexes_and_indentation))
-        # inserts the lines starting at the bottom
-        for i in range(len(ot_token_line_chunks)):
-            index = accv_indexes_and_indentation[-i][0]
-            indentation = accv_indexes_and_indentation[-i][1]
-            self.lines = self.lines[:index] + \
-                         ["\t"*indentation + line + "\n" for line in ot_token_line_chunks[-i]] + self.lines[index:]
-
-        # removes APPLY_CURRENT_CREATURE_VARIATION
-        self.remove_token("APPLY_CURRENT_CREATURE_VARIATION")
-        # removes all creature_variation_tokens
-        for token_name in creature_variation_tokens:
-            self.remove_token(token_name)
+        # inserts the lines, pairing the chunks and indexes from the bottom up
+        if len(accv_indexes_and_indentation) != 0:
+            for i in range(len(ot_token_line_chunks)):
+                index, indentation = accv_indexes_and_indentation[
+                    max(i - len(ot_token_line_chunks) + len(accv_indexes_and_indentation), 0)]
+                line_edits.insert_lines(index, ["\t"*indentation + line + "\n" for line in ot_token_line_chunks[i]])
+        self.lines = line_edits.apply(self.lines)
+
+        # removes APPLY_CURRENT_CREATURE_VARIATION and all creature_variation_tokens
+        self.remove_tokens(["APPLY_CURRENT_CREATURE_VARIATION"] + creature_variation_tokens)
 
         # and writes the edited file
-        raw_file = open(self.file_path, "w", encoding="latin1")
-        for line in self.lines:
-            raw_file.write(line)
-        raw_file.flush()
-        raw_file.close()
+        write_raw_file(self.file_path, self.lines)
 
     def get_ot_tokens_line_chunks(self, object_type):
         # gets the lines of object template tokens to replace creature variation tokens
@@ -1075,41 +2365,40 @@ class SyntaxUpdater:
 
         return ot_token_line_chunks
 
-    def remove_token(self, ask_token):
-        # this is regex to recognize any of the creature variation tokens (and removing them)
-        # the "normal" way of recognizing the tokens by splitting them into lists doesn't work here,
+    def remove_tokens(self, ask_tokens):
+        # this is regex to recognize any of the tokens in ask_tokens (token names, or lists of their first values) and
+        # removing them; the "normal" way of recognizing the tokens by splitting them into lists doesn't work here,
         # because it strips away all comments etc.
-        if type(ask_token) == str:
-            # pattern 1, token alone on line
-            p1 = re.compile("^\s*\[" + ask_token +":?[^\]]*\]\s*$")
-            # pattern 2, token not alone on line
-            p2 = re.compile("\[" + ask_token + ":?[^\]]*\]")
-        elif type(ask_token) == list:
-            p1 = re.compile("^\s*\[" + ":".join(ask_token) + ":?[^\]]*\]\s*$")
-            p2 = re.compile("\[" + ":".join(ask_token) + ":?[^\]]*\]")
-        else:
-            raise TypeError("Unexpected type for ask_token, ", type(ask_token), ". Expected str or list.")
+        # Only the lines containing any of the tokens are gone through token by token, with the same result as
+        # removing each token from all lines in turn.
+        any_token_pattern, token_patterns = get_token_removal_patterns(ask_tokens)
         for i in range(len(self.lines)):
-            # replaces the appropriate pattern
-            if p1.match(self.lines[i]):
-                self.lines[i] = p1.sub("", self.lines[i])
-            else:
-                self.lines[i] = p2.sub("", self.lines[i])
+            if any_token_pattern.search(self.lines[i]) is None:
+                continue
+            for p1, p2 in token_patterns:
+                # replaces the appropriate pattern
+                if p1.match(self.lines[i]):
+                    self.lines[i] = p1.sub("", self.lines[i])
+                else:
+                    self.lines[i] = p2.sub("", self.lines[i])
 
     def convert_body_detail_plan_tokens(self):
         # Either convert (each) BODY_DETAIL_PLAN into USE_OBJECT_TEMPLATE, leave it unchanged, or split it into both,
         # depending on self.bdp_leftovers_ids and self.bdp_templates_ids (whether the bdp were changed/split before)
-        pattern = re.compile("\[BODY_DETAIL_PLAN:[^\]]*[\]:]")
-        for i in range(len(self.lines)):
-            bdp_strings = pattern.findall(self.lines[i])
-            for bdp_string in bdp_strings:
-                bdp_token = bdp_string[1:-1].split(":")
-                replacement_string = ""
-                if bdp_token[1] in self.bdp_leftovers_ids:
-                    replacement_string += bdp_string
-                if bdp_token[1] in self.bdp_templates_ids:
-                    replacement_string += "[" + ":".join(["USE_OBJECT_TEMPLATE"] + bdp_token[1:]) + "]"
-                self.lines[i] = self.lines[i].replace(bdp_string, replacement_string)
+        leftovers_ids = set(self.bdp_leftovers_ids)
+        templates_ids = set(self.bdp_templates_ids)
+
+        def convert(match):
+            bdp_string = match.group(0)
+            bdp_token = bdp_string[1:-1].split(":")
+            replacement_string = ""
+            if bdp_token[1] in leftovers_ids:
+                replacement_string += bdp_string
+            if bdp_token[1] in templates_ids:
+                replacement_string += "[" + ":".join(["USE_OBJECT_TEMPLATE"] + bdp_token[1:]) + "]"
+            return replacement_string
+
+        self.lines = [body_detail_plan_use_pattern.sub(convert, line) for line in self.lines]
 
 
 # ====== misc. functions ========================================================================================
@@ -1117,42 +2406,100 @@ class SyntaxUpdater:
 def split_file_into_tokens(file):
     # splits the contents of a file into tokens
     # note that calling this reads all the lines, meaning the next file.readlines()/.readline() will return nothing
-    return split_lines_into_tokens(list(line for line in file))
+    return list(iter_tokens(file))
 
 
 def split_lines_into_tokens(lines):
     # does what it sounds like, splits lines (a list of strings, such as from file.readlines()) into tokens,
-    # discarding comments along the way
-    token_list = []
-
-    file_string = "".join(lines)
-    reading_mode = "comments"
-    token = ""
-    args = ""
-    # just goes through each of the characters in the file, switching "reading_mode" when necessary.
-    for c in file_string:
-        if reading_mode == "comments":
-            if c == "[":
-                reading_mode = "token"
-        elif reading_mode == "token":
-            if c == ":":
-                reading_mode = "args"
-            elif c == "]":
-                token_list.append([token])
-                token = ""
-                reading_mode = "comments"
-            else:
-                token += c
-        elif reading_mode == "args":
-            if c == "]":
-                token_list.append([token] + args.split(":"))
-                token = ""
-                args = ""
-                reading_mode = "comments"
+    # discarding comments along the way.
+    # Unlike the other functions here, the tokens are (mutable) lists, as used by the SyntaxUpdater.
+    return [list(token) for token in iter_string_tokens("".join(lines))]
+
+
+def split_string_into_tokens(string):
+    # like split_file_into_tokens, but for a single string such as from file.read()
+    return list(iter_string_tokens(string))
+
+
+def split_string_into_marshalled_tokens(string):
+    # Used by Compiler.read_files_in_parallel() to send tokens back from the worker processes.
+    # Unlike pickle, marshal keeps the strings interned.
+    return marshal.dumps(split_string_into_tokens(string))
+
+
+def iter_tokens(file):
+    # like split_file_into_tokens, but yields the tokens one at a time instead of building a list
+    return iter_string_tokens(file.read())
+
+
+def iter_string_tokens(string):
+    # a token is everything between a "[" and the next "]", anything outside of that is a comment.
+    # Like in DF, a "[" inside a token is just part of it, and a "[" that is never closed is ignored.
+    # The tokens are tuples of interned strings; the same few token names and values are repeated
+    # hundreds of thousands of times in the raws, and this way they are only stored once.
+    for match in token_pattern.finditer(string):
+        yield tuple(map(sys.intern, match.group(1).split(":")))
+
+
+def iter_lazy_tokens(string):
+    # Like iter_string_tokens(), but for reading in lazy mode (see LazyRawObject); the tokens in the body of each new
+    # object are yielded as a single LazyTokens holding their text, instead of one at a time. The other tokens
+    # ("OBJECT" tokens, the tokens starting objects, and the tokens of EDIT and OBJECT_TEMPLATE objects) are
+    # yielded as usual. Which tokens start objects is told the same way as in
+    # Compiler.read_mod_raws_and_apply_edit_objects(), by keeping track of the object types to expect.
+    pos_object_types = ["EDIT", "OBJECT_TEMPLATE"]
+    is_in_new_object = False
+    text_start = None
+    text_end = None
+    has_special_tokens = False
+    for match in lazy_token_pattern.finditer(string):
+        token_name = match.group(2)
+        if token_name != "OBJECT" and token_name != "EDIT" and token_name != "OBJECT_TEMPLATE" and \
+                token_name not in pos_object_types:
+            if is_in_new_object:
+                if text_start is None:
+                    text_start = match.start()
+                text_end = match.end()
+                if token_name in lazy_special_token_names:
+                    has_special_tokens = True
             else:
-                args += c
-
-    return token_list
+                yield tuple(map(sys.intern, match.group(1).split(":")))
+            continue
+
+        if text_start is not None:
+            yield LazyTokens(string[text_start:text_end], has_special_tokens)
+            text_start = None
+            has_special_tokens = False
+
+        token = tuple(map(sys.intern, match.group(1).split(":")))
+        if token[0] == "OBJECT":
+            pos_object_types = object_types[token[1]]
+        elif token[0] in pos_object_types and pos_object_types != ["OBJECT_TEMPLATE"]:
+            is_in_new_object = True
+        # invalid EDIT and OBJECT_TEMPLATE tokens are ignored by the Compiler, meaning it keeps reading the same object
+        elif token[0] == "EDIT":
+            if token[1] in pos_object_types or pos_object_types == ["EDIT"]:
+                is_in_new_object = False
+        elif token[0] == "OBJECT_TEMPLATE":
+            if token[1] in pos_object_types or pos_object_types == ["OBJECT_TEMPLATE"]:
+                is_in_new_object = False
+        yield token
+
+    if text_start is not None:
+        yield LazyTokens(string[text_start:text_end], has_special_tokens)
+
+
+def iter_with_last(iterable):
+    # yields (item, is_last) pairs, so that a stream can be handled like a list with a known last index
+    iterator = iter(iterable)
+    try:
+        previous = next(iterator)
+    except StopIteration:
+        return
+    for item in iterator:
+        yield previous, False
+        previous = item
+    yield previous, True
 
 
 def split_tokens_into_raw_objects_simple(tokens, object_type, allowed_tokens=None, skip_empty_objects=False):
@@ -1167,10 +2514,10 @@ def split_tokens_into_raw_objects_simple(tokens, object_type, allowed_tokens=Non
         # adds tokens to the current object
         if token[0] != object_type and reading_mode == "NEW":
             if allowed_tokens is None:
-                co.tokens.append(token)
+                co.append_token(token)
             else:
                 if token[0] in allowed_tokens:
-                    co.tokens.append(token)
+                    co.append_token(token)
         # when a new object or the end of the file is encountered
         if token[0] == object_type or i == len(tokens) - 1:
             # finishes the current object before starting to read the next one
@@ -1183,21 +2530,50 @@ def split_tokens_into_raw_objects_simple(tokens, object_type, allowed_tokens=Non
     return raw_objects
 
 
-def sort_file_names(mod):
+def write_compiled_file(file_path, file_string):
+    # Writes a compiled file, or removes it if file_string is None.
+    # The file is written to a temporary file first and then renamed, so DF (or anything else reading the output
+    # folder) never sees a half-written file.
+    if file_string is None:
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        return
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, "w", encoding="latin1") as compiled_file:
+        compiled_file.write(file_string)
+    os.replace(temp_file_path, file_path)
+
+
+def write_raw_file(file_path, lines):
+    # Writes a raw file updated by the SyntaxUpdater. Like compiled files, it is written to a temporary file which
+    # then replaces it, so the old file itself is never written to, which keeps it intact if it is hardlinked into a
+    # BackupStore (see backup_store.py).
+    write_compiled_file(file_path, "".join(lines))
+
+
+def get_content_hash(file_string):
+    # a hash of the contents of a compiled file, or None if there is no such file
+    if file_string is None:
+        return None
+    return hashlib.sha1(file_string.encode("latin1")).hexdigest()
+
+
+def sort_file_names(mod, manifest=None):
     # before the files are read, they are sorted in accordance to the first line,
     # here called the "header"
     # https://dwarffortresswiki.org/index.php/DF2014:Raw_file#Parsing
+    # If an up to date manifest of the mod is given (see mod_manifest.py), the headers are taken from it instead.
+    if manifest is not None:
+        return manifest.get_sorted_file_names(mod.file_names)
+
     file_names_by_header = {header: [] for header in header_load_order}
 
     for file_name in mod.file_names:
         with open(mod.path + "/objects/" + file_name, "r", encoding="latin1") as f:
             first_line = f.readline()
-        file_header = False
+        file_header = get_file_header(first_line)
         # if there is no proper header, the file is simply ignored
-        for header in header_load_order:
-            if first_line.startswith(header):
-                file_header = header
-        if file_header is not False:
+        if file_header is not None:
             file_names_by_header[file_header].append(file_name)
 
     # completes the sorting, and returns the list
@@ -1207,6 +2583,47 @@ def sort_file_names(mod):
     return sorted_file_names
 
 
+def get_file_header(first_line):
+    # returns the header in header_load_order that the first line of a file starts with, or None
+    file_header = None
+    for header in header_load_order:
+        if first_line.startswith(header):
+            file_header = header
+    return file_header
+
+
+def get_token_removal_patterns(ask_tokens):
+    # Returns a pattern matching any of the tokens in ask_tokens, and for each of them (in order) a pattern for the
+    # token alone on a line and one for the token anywhere, see SyntaxUpdater.remove_tokens().
+    # The patterns are compiled once for each list of tokens.
+    token_names = []
+    for ask_token in ask_tokens:
+        if type(ask_token) == str:
+            token_names.append(ask_token)
+        elif type(ask_token) == list:
+            token_names.append(":".join(ask_token))
+        else:
+            raise TypeError("Unexpected type for ask_token, ", type(ask_token), ". Expected str or list.")
+    token_names = tuple(token_names)
+
+    if token_names not in token_removal_patterns:
+        # pattern 1, token alone on line; pattern 2, token not alone on line
+        token_patterns = [(re.compile("^\\s*\\[" + token_name + ":?[^\\]]*\\]\\s*$"),
+                           re.compile("\\[" + token_name + ":?[^\\]]*\\]")) for token_name in token_names]
+        any_token_pattern = re.compile("\\[(?:" + "|".join(token_names) + "):?[^\\]]*\\]")
+        token_removal_patterns[token_names] = (any_token_pattern, token_patterns)
+    return token_removal_patterns[token_names]
+
+
+def update_raw_file_syntax(file_path, file_name, bdp_leftovers_ids, bdp_templates_ids):
+    # updates the syntax of a single file in a worker process, see SyntaxUpdater.update_files_in_parallel()
+    syntax_updater = SyntaxUpdater()
+    syntax_updater.bdp_leftovers_ids = bdp_leftovers_ids
+    syntax_updater.bdp_templates_ids = bdp_templates_ids
+    syntax_updater.update_file_syntax(file_path, file_name)
+    return syntax_updater.bdp_leftovers_ids, syntax_updater.bdp_templates_ids
+
+
 def count_tabs(string):
     n = 0
     for c in string:
@@ -1217,50 +2634,68 @@ def count_tabs(string):
     return n
 
 
+def insert_arguments(token, arguments):
+    # returns the token with the arguments inserted, see insert_arguments_into_string()
+    if not any("!" in token_arg for token_arg in token):
+        return token
+    return tuple(insert_arguments_into_string(token_arg, arguments) if "!" in token_arg else token_arg
+                 for token_arg in token)
+
+
+def insert_arguments_into_string(string, arguments):
+    # Replaces each "!ARG" followed by a number with that argument, in a single pass.
+    # This gives the same result as replacing "!ARG" + str(i) for each argument, from the last to the first,
+    # (the old way, which RawObject.tokens_with_arguments_inserted() still uses if an argument contains a "!"):
+    # the longest leading part of the number that is a valid argument number is replaced, so with 12 arguments
+    # "!ARG12" becomes argument 12 but "!ARG13" becomes argument 1 followed by "3", and "!ARG0" is left alone.
+    # The exception is when the old way makes new "!ARG"s as arguments are inserted, e.g. "!A!ARG1" with "RG2" as
+    # the first argument, or "!ARG1!ARG2" with "1" as the second. Strings where that is possible, i.e. where a "!"
+    # doesn't start an argument or an argument is directly followed by another, are still done the old way.
+    is_ambiguous = False
+
+    def replace_argument(match):
+        nonlocal is_ambiguous
+        if string.startswith("!", match.end()):
+            is_ambiguous = True
+        digits = match.group(1)
+        for length in range(len(digits), 0, -1):
+            if digits[0] != "0" and int(digits[:length]) <= len(arguments):
+                return arguments[int(digits[:length]) - 1] + digits[length:]
+        return match.group(0)
+
+    new_string, replaced_count = argument_pattern.subn(replace_argument, string)
+    if is_ambiguous or replaced_count != string.count("!"):
+        for i in range(len(arguments) - 1, -1, -1):
+            string = string.replace("!ARG" + str(i + 1), arguments[i])
+        return sys.intern(string)
+    return sys.intern(new_string)
+
+
+def get_insertion_index(index, token_count):
+    # returns where list.insert(index, ...) would insert into a list of token_count tokens,
+    # e.g. a negative index counts from the end
+    if index < 0:
+        return max(0, index + token_count)
+    return min(index, token_count)
+
+
+def get_token_names_starting_with(token_name_counts, name_start):
+    # returns the set of token names in token_name_counts (see RawObject.tokens) that start with name_start
+    return {token_name for token_name in token_name_counts if token_name.startswith(name_start)}
+
+
 def select_objects_by_criteria(objects, criteria):
-    if len(criteria) == 0:
-        print("Error found at unknown location in your raws: selection criteria missing.")
-
-    if criteria[0] == "ALL":
-        return objects
-
-    for i in range(len(criteria)):
-        # selects a single object
-        if criteria[i] == "SEL_BY_ID":
-            objects = [raw_object for raw_object in objects
-                       if raw_object.object_id == criteria[i + 1]]
-        # selects multiple objects
-        # ...by object class
-        elif criteria[i] == "SEL_BY_CLASS":
-            objects = [raw_object for raw_object in objects
-                       if (["OBJECT_CLASS", criteria[i + 1]] in raw_object.tokens or
-                           ["CREATURE_CLASS", criteria[i + 1]] in raw_object.tokens)]
-        # ...by token (and any amount of leading values)
-        elif criteria[i] == "SEL_BY_TAG":
-            # all the "criteria" between SEL_BY_TAG and the next "SEL_BY" are assumed to be a token
-            # and its leading values. For this to be possible, there's an inner loop
-            token_values = []
-            for j in range(i + 1, len(criteria)):
-                if criteria[j] in ["SEL_BY_ID", "SEL_BY_CLASS", "SEL_BY_TAG", "SEL_BY_TAG_PRECISE"]:
-                    break
-                else:
-                    token_values.append(criteria[j])
-            objects = [raw_object for raw_object in objects
-                       if raw_object.has_token(token_values)]
-        # ...by precise token (i.e. like "by token", but instead of leading values, the values specified are the
-        #                      *only* values;
-        #                      SELECT_BY_TAG_PRECISE:BODY:QUADRUPED_NECK won't select the vanilla toad raws,
-        #                      as the toad's BODY token continues after QUADRUPED_NECK.)
-        elif criteria[i] == "SEL_BY_TAG_PRECISE":
-            token_values = []
-            for j in range(i + 1, len(criteria)):
-                if criteria[j] in ["SEL_BY_ID", "SEL_BY_CLASS", "SEL_BY_TAG", "SEL_BY_TAG_PRECISE"]:
-                    break
-                else:
-                    token_values.append(criteria[j])
-            print(token_values)
-            objects = [raw_object for raw_object in objects
-                       if token_values in raw_object.tokens]
+    # see SelectionIndex.select(), the Compiler keeps a SelectionIndex for each object type instead of calling this
+    return SelectionIndex(objects).select(criteria)
+
 
-    # returns the objects that matched the criteria
-    return objects
+def get_selection_token_values(criteria, i):
+    # all the "criteria" between SEL_BY_TAG/SEL_BY_TAG_PRECISE (at index i) and the next "SEL_BY" are assumed to be
+    # a token and its leading values
+    token_values = []
+    for j in range(i + 1, len(criteria)):
+        if criteria[j] in ["SEL_BY_ID", "SEL_BY_CLASS", "SEL_BY_TAG", "SEL_BY_TAG_PRECISE"]:
+            break
+        else:
+            token_values.append(criteria[j])
+    return token_values